@@ -0,0 +1,49 @@
+import argparse
+import time
+from typing import List, Tuple
+
+from src.config.prompts import get_narrator_prompt, get_visionary_prompt, get_skeptic_prompt, get_leader_prompt
+from src.models.history import QAHistory
+
+MYSTERY = "Un hombre aparece muerto en una cabaña en lo alto de la montaña, rodeado de nieve sin huellas."
+SOLUTION = "Era el piloto de una avioneta que se estrelló; la cabaña es el fuselaje."
+QUESTION = "¿El hombre murió por causas naturales y nadie más estuvo implicado en su muerte?"
+
+def play_council_game(qa_history: List[Tuple[str, str]], turns: int) -> None:
+    """
+    Builds the prompts of a Council game of `turns` rounds: the three council prompts and the
+    narrator prompt render the history every round, then the turn is appended.
+    """
+    for turn in range(turns):
+        get_visionary_prompt(MYSTERY, qa_history)
+        get_skeptic_prompt(MYSTERY, qa_history, "Una teoría audaz.")
+        get_leader_prompt(MYSTERY, qa_history, "Una teoría audaz.", "Una crítica.")
+        get_narrator_prompt(MYSTERY, SOLUTION, qa_history, QUESTION)
+        qa_history.append((f"{QUESTION} ({turn})", "no es relevante"))
+
+def best_of(history_factory, turns: int, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        play_council_game(history_factory(), turns)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    """
+    Micro-benchmark of prompt building: plain list history (re-rendered on every prompt)
+    versus QAHistory (rendered incrementally and cached per format).
+    """
+    parser = argparse.ArgumentParser(description="Black Stories AI - Benchmark del historial de preguntas")
+    parser.add_argument("-turnos", type=str, default="20,100,1000", help="Comma-separated game lengths")
+    parser.add_argument("-repeticiones", type=int, default=5, help="Runs per measurement (the best one is kept)")
+    args = parser.parse_args()
+
+    print(f"{'Turnos':>8} {'list (ms)':>12} {'QAHistory (ms)':>16} {'Mejora':>8}")
+    for turns in (int(value) for value in args.turnos.split(",")):
+        plain = best_of(list, turns, args.repeticiones)
+        cached = best_of(QAHistory, turns, args.repeticiones)
+        print(f"{turns:>8} {plain * 1000:>12.2f} {cached * 1000:>16.2f} {plain / cached:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import json
+
 from src.utils.config import Config
 from src.game.game_engine import GameEngine
 
@@ -10,12 +12,29 @@ def main():
     game_config = config_loader.get_config()
 
     game_engine = GameEngine(game_config)
+    streaming = False # A streamed message is being printed as its deltas arrive
     for output in game_engine.run(
         difficulty=game_config["difficulty"],
         narrator_model=game_config["narrator_model"],
         detective_model=game_config["detective_model"]
     ):
+        delta = _delta_text(output)
+        if delta is not None:
+            print(delta, end="", flush=True)
+            streaming = True
+            continue
+        if streaming:
+            print()
+            streaming = False
         print(output)
 
+def _delta_text(output: str) -> str | None:
+    """
+    The text of an NDJSON delta message (see streaming.ndjson_delta), or None for any other output.
+    """
+    if not output.startswith('{"type": "delta"'):
+        return None
+    return json.loads(output)["content"]
+
 if __name__ == "__main__":
     main()
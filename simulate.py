@@ -0,0 +1,59 @@
+import argparse
+
+from src.utils.config import Config
+from src.game.simulator import BatchSimulator, build_matrix, open_result_store
+
+def main():
+    """
+    Headless batch simulator: plays many AI-vs-AI games and stores their results in a JSONL or SQLite file.
+    Running the same command again resumes the batch, skipping the games that already completed.
+    """
+    config_loader = Config(parse_cli=False)
+    game_config = config_loader.get_config()
+
+    parser = argparse.ArgumentParser(description="Black Stories AI - Simulador de partidas por lotes")
+    parser.add_argument("-narradores", type=str, default=game_config["narrator_model"],
+                        help="Comma-separated Narrator models (e.g., gemini:gemini-2.5-flash,ollama:llama3)")
+    parser.add_argument("-detectives", type=str, default=game_config["detective_model"],
+                        help="Comma-separated Detective models")
+    parser.add_argument("-dificultades", type=str, default=game_config["difficulty"],
+                        help="Comma-separated difficulties (facil, media, dificil)")
+    parser.add_argument("-partidas", type=int, default=1,
+                        help="Games per narrator/detective/difficulty combination")
+    parser.add_argument("-salida", type=str, default="logs/simulation.jsonl",
+                        help="Results file: .jsonl, or .db/.sqlite for SQLite")
+    parser.add_argument("-concurrencia", type=int, default=8,
+                        help="Games played at the same time (per process)")
+    parser.add_argument("-procesos", type=int, default=0,
+                        help="Worker processes; 0 or 1 runs everything on a single event loop")
+    args = parser.parse_args()
+
+    difficulties = [d.strip() for d in args.dificultades.split(",") if d.strip()]
+    for difficulty in difficulties:
+        if difficulty not in game_config["question_limits"]:
+            parser.error(f"Dificultad no válida: {difficulty}")
+
+    specs = build_matrix(
+        [m.strip() for m in args.narradores.split(",") if m.strip()],
+        [m.strip() for m in args.detectives.split(",") if m.strip()],
+        difficulties,
+        args.partidas,
+    )
+
+    store = open_result_store(args.salida)
+    simulator = BatchSimulator(game_config, concurrency=args.concurrencia, processes=args.procesos)
+    pending = len(simulator.pending(specs, store))
+    print(f"Partidas: {len(specs)} en total, {len(specs) - pending} ya completadas, {pending} pendientes.")
+
+    try:
+        for done, record in enumerate(simulator.run(specs, store), start=1):
+            outcome = record["verdict"] if record["status"] == "completed" else f"ERROR: {record['error']}"
+            print(f"[{done}/{pending}] {record['game_id']} -> {outcome} "
+                  f"({record['questions']} preguntas, {record['duration']:.1f}s)")
+    except KeyboardInterrupt:
+        print("Simulación interrumpida. Ejecuta el mismo comando para reanudarla.")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
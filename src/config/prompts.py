@@ -1,14 +1,15 @@
 from typing import List, Tuple, Dict
 
-def get_narrator_prompt(mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]], question: str) -> str:
+from src.models.history import ContextBudget, render_history
+
+def get_narrator_prompt_parts(mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]], question: str, budget: ContextBudget | None = None) -> Tuple[str, str]:
     """
-    Constructs the prompt for the Narrator AI to answer a question.
+    Constructs the Narrator prompt as (prefix, suffix): the prefix holds the instructions and the story,
+    which stay the same for the whole game, and the suffix the history and the current question.
     """
-    history_str = "\n".join([f"Detective: {q}\nNarrador: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial de preguntas y respuestas:\n" + history_str
+    history_str = render_history(qa_history, "interrogatorio", budget)
 
-    return f"""
+    prefix = f"""
     Eres la IA Narrador en un interrogatorio policial formal.
     Conoces la siguiente historia completa:
     Situación misteriosa: {mystery_situation}
@@ -17,11 +18,19 @@ def get_narrator_prompt(mystery_situation: str, hidden_solution: str, qa_history
     Tu rol es responder ESTRICTAMENTE solo con "sí", "no" o "no es relevante" a las preguntas del Detective.
     Mantén un tono profesional y formal. No des pistas adicionales ni explicaciones.
 
-    {history_str}
+    """
+    suffix = f"""{history_str}
 
     Pregunta del Detective: "{question}"
     Tu respuesta (sí/no/no es relevante):
     """
+    return prefix, suffix
+
+def get_narrator_prompt(mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]], question: str, budget: ContextBudget | None = None) -> str:
+    """
+    Constructs the prompt for the Narrator AI to answer a question.
+    """
+    return "".join(get_narrator_prompt_parts(mystery_situation, hidden_solution, qa_history, question, budget))
 
 def get_narrator_validation_prompt(mystery_situation: str, hidden_solution: str, detective_solution: str, difficulty: str) -> str:
     """
@@ -56,15 +65,14 @@ def get_narrator_validation_prompt(mystery_situation: str, hidden_solution: str,
     }}
     """
 
-def get_detective_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]]) -> str:
+def get_detective_prompt_parts(mystery_situation: str, qa_history: List[Tuple[str, str]], budget: ContextBudget | None = None) -> Tuple[str, str]:
     """
-    Constructs the prompt for the Detective AI to ask a question or attempt a solution.
+    Constructs the Detective prompt as (prefix, suffix): the instructions and the mystery, which stay
+    the same for the whole game, and the history with the request for the next action.
     """
-    history_str = "\n".join([f"Detective: {q}\nNarrador: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial de preguntas y respuestas:\n" + history_str
+    history_str = render_history(qa_history, "interrogatorio", budget)
 
-    return f"""
+    prefix = f"""
     Eres la IA Detective en un interrogatorio policial formal.
     Tu objetivo es descubrir la solución a la siguiente situación misteriosa:
     Situación misteriosa: {mystery_situation}
@@ -77,20 +85,26 @@ def get_detective_prompt(mystery_situation: str, qa_history: List[Tuple[str, str
     Después de indicar que estás listo, tu siguiente turno será para dar la solución final.
     Tienes UNA única oportunidad para dar la solución final.
 
-    {history_str}
+    """
+    suffix = f"""{history_str}
 
     Tu siguiente acción (pregunta o indicación de que estás listo para resolver).
     Asegúrate de que tu respuesta sea una pregunta directa o una de las frases para resolver.
     NO incluyas "Detective:" al inicio de tu pregunta.
     """
+    return prefix, suffix
+
+def get_detective_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], budget: ContextBudget | None = None) -> str:
+    """
+    Constructs the prompt for the Detective AI to ask a question or attempt a solution.
+    """
+    return "".join(get_detective_prompt_parts(mystery_situation, qa_history, budget))
 
-def get_detective_final_solution_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]]) -> str:
+def get_detective_final_solution_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], budget: ContextBudget | None = None) -> str:
     """
     Constructs a prompt specifically for the Detective to provide the final solution.
     """
-    history_str = "\n".join([f"Detective: {q}\nNarrador: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial de preguntas y respuestas:\n" + history_str
+    history_str = render_history(qa_history, "interrogatorio", budget)
 
     return f"""
     Eres la IA Detective. Has indicado que estás listo para resolver la situación misteriosa.
@@ -128,13 +142,11 @@ def get_story_generation_prompt(difficulty: str) -> str:
     La historia debe ser concisa y clara.
     """
 
-def get_visionary_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]]) -> str:
+def get_visionary_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], budget: ContextBudget | None = None) -> str:
     """
     Prompt for the Visionary Detective: proposes wild and creative theories.
     """
-    history_str = "\n".join([f"Pregunta: {q}\nRespuesta: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial del caso:\n" + history_str
+    history_str = render_history(qa_history, "caso", budget)
 
     return f"""
     Eres "El Visionario", un detective creativo y poco convencional en un consejo de investigación.
@@ -148,13 +160,11 @@ def get_visionary_prompt(mystery_situation: str, qa_history: List[Tuple[str, str
     Sé breve y directo.
     """
 
-def get_skeptic_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str) -> str:
+def get_skeptic_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str, budget: ContextBudget | None = None) -> str:
     """
     Prompt for the Skeptic Detective: critiques theories and checks logic.
     """
-    history_str = "\n".join([f"Pregunta: {q}\nRespuesta: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial del caso:\n" + history_str
+    history_str = render_history(qa_history, "caso", budget)
 
     return f"""
     Eres "El Escéptico", un detective lógico y crítico en un consejo de investigación.
@@ -169,13 +179,11 @@ def get_skeptic_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]]
     Sé breve y crítico.
     """
 
-def get_leader_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str, skeptic_critique: str) -> str:
+def get_leader_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str, skeptic_critique: str, budget: ContextBudget | None = None) -> str:
     """
     Prompt for the Leader Detective: synthesizes and asks the final question.
     """
-    history_str = "\n".join([f"Pregunta: {q}\nRespuesta: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial del caso:\n" + history_str
+    history_str = render_history(qa_history, "caso", budget)
 
     return f"""
     Eres "El Líder", el jefe de un consejo de investigación.
@@ -192,13 +200,11 @@ def get_leader_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]],
     Si crees que ya tenemos la solución completa, di exactamente: "SOLUCIÓN: [Tu explicación completa]".
     """
 
-def get_hint_prompt(mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]]) -> str:
+def get_hint_prompt(mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]], budget: ContextBudget | None = None) -> str:
     """
     Constructs the prompt for the Hint AI (Watson) to provide a subtle hint.
     """
-    history_str = "\n".join([f"Detective: {q}\nNarrador: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial de preguntas y respuestas:\n" + history_str
+    history_str = render_history(qa_history, "interrogatorio", budget)
 
     return f"""
     Eres "Watson", un asistente inteligente que ayuda al Detective a resolver un misterio.
@@ -218,13 +224,11 @@ def get_hint_prompt(mystery_situation: str, hidden_solution: str, qa_history: Li
     Ejemplo: "¿Has considerado revisar el estado del arma?" o "Tal vez el motivo no sea el dinero..."
     """
 
-def get_leader_final_guess_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str, skeptic_critique: str) -> str:
+def get_leader_final_guess_prompt(mystery_situation: str, qa_history: List[Tuple[str, str]], visionary_theory: str, skeptic_critique: str, budget: ContextBudget | None = None) -> str:
     """
     Prompt for the Leader Detective when the question limit is reached. Forces a solution.
     """
-    history_str = "\n".join([f"Pregunta: {q}\nRespuesta: {a}" for q, a in qa_history])
-    if history_str:
-        history_str = "\n\nHistorial del caso:\n" + history_str
+    history_str = render_history(qa_history, "caso", budget)
 
     return f"""
     Eres "El Líder". SE HA ALCANZADO EL LÍMITE DE PREGUNTAS.
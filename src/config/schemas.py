@@ -0,0 +1,32 @@
+from typing import Dict, Any
+
+# JSON Schemas for the replies that the game parses. They are sent as Ollama's `format` and, converted
+# by the API client, as Gemini's `responseSchema`, so the model can only produce a parseable reply.
+
+NARRATOR_ANSWERS = ["sí", "no", "no es relevante"]
+
+NARRATOR_ANSWER_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "respuesta": {"type": "string", "enum": NARRATOR_ANSWERS},
+    },
+    "required": ["respuesta"],
+}
+
+VALIDATION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "veredicto": {"type": "string", "enum": ["Correcto", "Incorrecto"]},
+        "analisis": {"type": "string"},
+    },
+    "required": ["veredicto", "analisis"],
+}
+
+STORY_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "situacion_misteriosa": {"type": "string"},
+        "solucion_oculta": {"type": "string"},
+    },
+    "required": ["situacion_misteriosa", "solucion_oculta"],
+}
@@ -1,34 +1,42 @@
 import json
-from typing import Dict, Any, Generator, Tuple, List
+from typing import Dict, Any, AsyncGenerator, Generator, List
 
 from src.models.game_state import GameState
-from src.models.story import Story
+from src.models.history import ContextBudget
 from src.services.api_client import APIClient
-from src.services.story_generator import StoryGenerator
-from src.services.narrator import Narrator
+from src.services.async_api_client import AsyncAPIClient
+from src.services.story_generator import AsyncStoryGenerator
+from src.services.narrator import AsyncNarrator
+from src.services.story_pool import get_story_pool
+from src.services.usage import describe_usage
+from src.utils.tracing import span
+from src.game.streaming import ndjson_delta
 from src.config.prompts import get_visionary_prompt, get_skeptic_prompt, get_leader_prompt, get_leader_final_guess_prompt
 
 class CouncilEngine:
     """
     Orchestrates the 'Council of Detectives' game mode.
+    Like GameEngine, the game is written once as async generators; `run` runs it on the background event loop.
     """
 
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.api_client = APIClient(config)
+        self.async_api_client: AsyncAPIClient = self.api_client.core # run_async() replaces it with a client of its own event loop
+        self.story_pool = get_story_pool(config)
+        self.context_budget = ContextBudget.from_config(config) # Bounds the case history in the Council prompts
         self.game_state: GameState | None = None
-        self.narrator_ai: Narrator | None = None
-
-    def _initialize_game(self, difficulty: str, narrator_model: str, visionary_model: str, skeptic_model: str, leader_model: str) -> Generator[str, None, None]:
-        yield "Convocando al Consejo de Detectives..."
-        story_generator = StoryGenerator(self.api_client, narrator_model)
-        
-        story: Story
-        try:
-            story = story_generator.generate_story(difficulty)
-        except Exception as e:
-            yield f"Error al generar la historia: {e}"
-            raise
+        self.narrator_ai: AsyncNarrator | None = None
+
+    async def _initialize_game(self, difficulty: str, narrator_model: str, leader_model: str) -> AsyncGenerator[str, None]:
+        story = self.story_pool.take(difficulty, narrator_model) if self.story_pool else None
+        if story is None:
+            story_generator = AsyncStoryGenerator(self.async_api_client, narrator_model)
+            try:
+                story = await story_generator.generate_story(difficulty)
+            except Exception as e:
+                yield f"Error al generar la historia: {e}"
+                raise
 
         self.game_state = GameState(
             narrator_model=narrator_model,
@@ -37,83 +45,103 @@ class CouncilEngine:
             mystery_situation=story.mystery_situation,
             hidden_solution=story.hidden_solution,
         )
-
-        yield "============================================================"
-        yield "                  CONSEJO DE DETECTIVES"
-        yield "============================================================"
-        yield f"Narrador: {narrator_model}"
-        yield f"Visionario: {visionary_model}"
-        yield f"Escéptico: {skeptic_model}"
-        yield f"Líder: {leader_model}"
-        yield "------------------------------------------------------------"
-        yield f"Misterio: {story.mystery_situation}"
-        yield "============================================================"
-
-    def _run_council_loop(self, visionary_model: str, skeptic_model: str, leader_model: str) -> Generator[str, None, None]:
-        if not self.game_state:
+        self.narrator_ai = AsyncNarrator(self.async_api_client, narrator_model, story, difficulty)
+
+    def _header_lines(self, narrator_model: str, visionary_model: str, skeptic_model: str, leader_model: str) -> List[str]:
+        """
+        Returns the banner shown once the story is ready.
+        """
+        return [
+            "============================================================",
+            "                  CONSEJO DE DETECTIVES",
+            "============================================================",
+            f"Narrador: {narrator_model}",
+            f"Visionario: {visionary_model}",
+            f"Escéptico: {skeptic_model}",
+            f"Líder: {leader_model}",
+            "------------------------------------------------------------",
+            f"Misterio: {self.game_state.mystery_situation}",
+            "============================================================",
+        ]
+
+    async def _stream_phase(self, model: str, prompt: str, target: str, role: str, chunks: List[str]) -> AsyncGenerator[str, None]:
+        """
+        Streams one council member's thought as NDJSON deltas, collecting the text into `chunks`.
+        """
+        async for chunk in self.async_api_client.stream_text(model, prompt, role=role):
+            chunks.append(chunk)
+            yield ndjson_delta(target, chunk)
+
+    async def _run_council_loop(self, visionary_model: str, skeptic_model: str, leader_model: str) -> AsyncGenerator[str, None]:
+        if not self.game_state or not self.narrator_ai:
             raise RuntimeError("Game not initialized.")
 
-        self.narrator_ai = Narrator(
-            self.api_client,
-            self.game_state.narrator_model,
-            Story(self.game_state.mystery_situation, self.game_state.hidden_solution),
-            self.game_state.difficulty,
-        )
-
         max_questions = self.config["question_limits"].get(self.game_state.difficulty, 10)
 
         while not self.game_state.detective_solved:
-            current_questions = len(self.game_state.qa_history)
-            is_final_turn = False
-
-            if current_questions >= max_questions:
-                yield json.dumps({"type": "system", "content": f"⚠️ ¡Límite de {max_questions} preguntas alcanzado! El Consejo debe arriesgar una solución final."})
-                is_final_turn = True
-            
-            # 1. Visionary Phase
-            yield json.dumps({"type": "system", "content": "🤔 El Visionario está pensando..."})
-            visionary_prompt = get_visionary_prompt(self.game_state.mystery_situation, self.game_state.qa_history)
-            visionary_thought = self.api_client.generate_text(visionary_model, visionary_prompt).strip()
-            yield json.dumps({"type": "council_visionary", "content": visionary_thought})
-
-            # 2. Skeptic Phase
-            yield json.dumps({"type": "system", "content": "🤨 El Escéptico está analizando..."})
-            skeptic_prompt = get_skeptic_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought)
-            skeptic_thought = self.api_client.generate_text(skeptic_model, skeptic_prompt).strip()
-            yield json.dumps({"type": "council_skeptic", "content": skeptic_thought})
-
-            # 3. Leader Phase
-            yield json.dumps({"type": "system", "content": "🫡 El Líder está decidiendo..."})
-            
-            if is_final_turn:
-                leader_prompt = get_leader_final_guess_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought, skeptic_thought)
-            else:
-                leader_prompt = get_leader_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought, skeptic_thought)
-            
-            leader_action = self.api_client.generate_text(leader_model, leader_prompt).strip()
-
-            # Check if Leader wants to solve OR if it's forced
-            if "SOLUCIÓN:" in leader_action.upper() or is_final_turn:
-                # If forced and missing prefix, assume the whole text is the solution
-                if "SOLUCIÓN:" in leader_action.upper():
-                    solution_text = leader_action.split(":", 1)[1].strip()
+            with span("council.round", turn=len(self.game_state.qa_history) + 1):
+                is_final_turn = False
+
+                if len(self.game_state.qa_history) >= max_questions:
+                    yield json.dumps({"type": "system", "content": f"⚠️ ¡Límite de {max_questions} preguntas alcanzado! El Consejo debe arriesgar una solución final."})
+                    is_final_turn = True
+
+                # 1. Visionary Phase
+                yield json.dumps({"type": "system", "content": "🤔 El Visionario está pensando..."})
+                visionary_prompt = get_visionary_prompt(self.game_state.mystery_situation, self.game_state.qa_history, budget=self.context_budget)
+                chunks: List[str] = []
+                async for delta in self._stream_phase(visionary_model, visionary_prompt, "council_visionary", "visionary", chunks):
+                    yield delta
+                visionary_thought = "".join(chunks).strip()
+                yield json.dumps({"type": "council_visionary", "content": visionary_thought})
+
+                # 2. Skeptic Phase
+                yield json.dumps({"type": "system", "content": "🤨 El Escéptico está analizando..."})
+                skeptic_prompt = get_skeptic_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought, budget=self.context_budget)
+                chunks = []
+                async for delta in self._stream_phase(skeptic_model, skeptic_prompt, "council_skeptic", "skeptic", chunks):
+                    yield delta
+                skeptic_thought = "".join(chunks).strip()
+                yield json.dumps({"type": "council_skeptic", "content": skeptic_thought})
+
+                # 3. Leader Phase
+                yield json.dumps({"type": "system", "content": "🫡 El Líder está decidiendo..."})
+
+                if is_final_turn:
+                    leader_prompt = get_leader_final_guess_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought, skeptic_thought, budget=self.context_budget)
                 else:
-                    solution_text = leader_action
+                    leader_prompt = get_leader_prompt(self.game_state.mystery_situation, self.game_state.qa_history, visionary_thought, skeptic_thought, budget=self.context_budget)
+
+                leader_action = (await self.async_api_client.generate_text(leader_model, leader_prompt, role="leader")).strip()
+
+                solution_text = self._extract_solution(leader_action, is_final_turn)
+                if solution_text is not None:
+                    self.game_state.detective_solution_attempt = solution_text
+                    self.game_state.detective_solved = True
+                    yield json.dumps({"type": "council_leader", "content": f"¡Tengo la solución! {solution_text}"})
+                    break
 
-                self.game_state.detective_solution_attempt = solution_text
-                self.game_state.detective_solved = True
-                yield json.dumps({"type": "council_leader", "content": f"¡Tengo la solución! {solution_text}"})
-                break
-            else:
                 question = leader_action
                 yield json.dumps({"type": "council_leader", "content": question})
 
                 # 4. Narrator Phase
-                narrator_answer = self.narrator_ai.answer_question(question, self.game_state.qa_history)
+                narrator_answer = await self.narrator_ai.answer_question(question, self.game_state.qa_history)
                 self.game_state.qa_history.append((question, narrator_answer))
                 yield json.dumps({"type": "narrator", "content": narrator_answer})
 
-    def _finalize_game(self) -> Generator[str, None, None]:
+    @staticmethod
+    def _extract_solution(leader_action: str, is_final_turn: bool) -> str | None:
+        """
+        Returns the Leader's solution text, or None if the Leader asked a question instead.
+        """
+        if "SOLUCIÓN:" in leader_action.upper():
+            return leader_action.split(":", 1)[1].strip()
+        # If forced and missing prefix, assume the whole text is the solution
+        if is_final_turn:
+            return leader_action
+        return None
+
+    async def _finalize_game(self) -> AsyncGenerator[str, None]:
         if not self.game_state or not self.narrator_ai:
             raise RuntimeError("Game not initialized.")
 
@@ -121,25 +149,62 @@ class CouncilEngine:
         verdict = "Incorrecto"
         analysis = "El Consejo no llegó a una conclusión."
 
-        if self.game_state.detective_solution_attempt:
-            verdict, analysis = self.narrator_ai.validate_solution(self.game_state.detective_solution_attempt)
+        solution = self.game_state.detective_solution_attempt
+        if solution:
+            chunks: List[str] = []
+            async for chunk in self.narrator_ai.stream_validation(solution):
+                chunks.append(chunk)
+                yield ndjson_delta("validation", chunk)
+            verdict, analysis = await self.narrator_ai.parse_streamed_validation(solution, "".join(chunks))
             if verdict.lower() == "correcto":
                 result = "VICTORIA"
-            else:
-                result = "DERROTA"
-        
-        yield json.dumps({"type": "summary", "content": f"""
+
+        self.game_state.usage = self.narrator_ai.api_client.usage.get_summary()
+        yield json.dumps({"type": "summary", "content": self._summary_html(result, verdict, analysis), "usage": self.game_state.usage})
+
+    def _summary_html(self, result: str, verdict: str, analysis: str) -> str:
+        return f"""
         <h3>RESULTADO: {result}</h3>
         <p><strong>Solución Real:</strong> {self.game_state.hidden_solution}</p>
         <p><strong>Solución del Consejo:</strong> {self.game_state.detective_solution_attempt}</p>
         <p><strong>Veredicto:</strong> {verdict}</p>
         <p><strong>Análisis:</strong> {analysis}</p>
-        """})
+        <p><strong>Tokens de prompt reutilizados:</strong> {self.narrator_ai.api_client.prompt_cache_stats["saved_tokens"]}</p>
+        <p><strong>Tokens usados:</strong> {describe_usage(self.game_state.usage)}</p>
+        """
+
+    async def _play(self, difficulty: str, narrator_model: str, visionary_model: str, skeptic_model: str, leader_model: str) -> AsyncGenerator[str, None]:
+        """
+        The complete Council game, as run by both `run` and `run_async`.
+        """
+        with span("game.run", mode="council", narrator=narrator_model, leader=leader_model):
+            try:
+                yield "Convocando al Consejo de Detectives..."
+                async for line in self._initialize_game(difficulty, narrator_model, leader_model):
+                    yield line
+                for line in self._header_lines(narrator_model, visionary_model, skeptic_model, leader_model):
+                    yield line
+                async for line in self._run_council_loop(visionary_model, skeptic_model, leader_model):
+                    yield line
+                async for line in self._finalize_game():
+                    yield line
+            except Exception as e:
+                yield json.dumps({"type": "error", "content": f"Error crítico en el Consejo: {e}"})
 
     def run(self, difficulty: str, narrator_model: str, visionary_model: str, skeptic_model: str, leader_model: str) -> Generator[str, None, None]:
+        """
+        Runs the Council game from a blocking caller, on the background event loop.
+        """
+        yield from self.api_client.iterate(self._play(difficulty, narrator_model, visionary_model, skeptic_model, leader_model))
+
+    async def run_async(self, difficulty: str, narrator_model: str, visionary_model: str, skeptic_model: str, leader_model: str) -> AsyncGenerator[str, None]:
+        """
+        Runs the Council game on the running event loop, without blocking it.
+        Produces the same stream of messages as `run`.
+        """
+        self.async_api_client = AsyncAPIClient(self.config)
         try:
-            yield from self._initialize_game(difficulty, narrator_model, visionary_model, skeptic_model, leader_model)
-            yield from self._run_council_loop(visionary_model, skeptic_model, leader_model)
-            yield from self._finalize_game()
-        except Exception as e:
-            yield json.dumps({"type": "error", "content": f"Error crítico en el Consejo: {e}"})
+            async for line in self._play(difficulty, narrator_model, visionary_model, skeptic_model, leader_model):
+                yield line
+        finally:
+            await self.async_api_client.aclose()
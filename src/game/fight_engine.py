@@ -1,13 +1,20 @@
 import json
 import asyncio
-from typing import Dict, Any, AsyncGenerator
+import logging
+from typing import Dict, Any, AsyncGenerator, Tuple
 
 from src.models.game_state import GameState
 from src.models.story import Story
-from src.services.api_client import APIClient
-from src.services.story_generator import StoryGenerator
-from src.services.narrator import Narrator
-from src.services.detective import Detective
+from src.services.async_api_client import AsyncAPIClient
+from src.services.story_generator import AsyncStoryGenerator
+from src.services.narrator import AsyncNarrator
+from src.services.detective import AsyncDetective
+from src.services.story_pool import get_story_pool
+from src.services.usage import describe_usage
+from src.utils.tracing import span
+from src.game.streaming import merge_streams
+
+logger = logging.getLogger(__name__)
 
 class FightEngine:
     """
@@ -17,10 +24,11 @@ class FightEngine:
 
     def __init__(self, config: Dict[str, Any]):
         self.config = config
-        self.api_client = APIClient(config)
+        self.api_client = AsyncAPIClient(config)
+        self.story_pool = get_story_pool(config)
         self.game_state_det1: GameState | None = None
         self.game_state_det2: GameState | None = None
-        self.narrator_ai: Narrator | None = None
+        self.narrator_ai: AsyncNarrator | None = None
         self.story: Story | None = None
 
     async def _initialize_fight(self, narrator_model: str, detective_model_1: str, detective_model_2: str) -> AsyncGenerator[str, None]:
@@ -28,39 +36,33 @@ class FightEngine:
         Initializes the fight by generating a story and setting up AI roles.
         """
         yield json.dumps({"type": "narrator", "content": "Narrador: Iniciando la generación de la historia..."})
-        story_generator = StoryGenerator(self.api_client, narrator_model)
-        
-        retries = 3
-        for attempt in range(retries):
+        self.story = self.story_pool.take("fight_mode", narrator_model) if self.story_pool else None
+        if self.story is not None:
+            yield json.dumps({"type": "narrator", "content": "Narrador: ¡Historia generada con éxito!"})
+            yield json.dumps({"type": "narrator", "content": f"Misterio para los Detectives: {self.story.mystery_situation}"})
+        else:
+            story_generator = AsyncStoryGenerator(self.api_client, narrator_model)
             try:
-                print(f"DEBUG: Attempt {attempt + 1}/{retries} - Calling story_generator.generate_story (wrapped in asyncio.to_thread)...")
-                self.story = await asyncio.to_thread(story_generator.generate_story, "fight_mode") # Use a generic difficulty for story generation
-                print(f"DEBUG: Attempt {attempt + 1}/{retries} - Returned from story_generator.generate_story.")
-                
-                # Explicit check and logging for story content
-                if self.story and self.story.mystery_situation and self.story.hidden_solution:
-                    yield json.dumps({"type": "narrator", "content": "Narrador: ¡Historia generada con éxito!"})
-                    yield json.dumps({"type": "narrator", "content": f"Misterio para los Detectives: {self.story.mystery_situation}"})
-                    print(f"DEBUG: Story generated: Mystery='{self.story.mystery_situation[:50]}...', Solution='{self.story.hidden_solution[:50]}...'")
-                else:
-                    error_msg = "Narrador: Error: La historia se generó, pero el contenido está vacío o incompleto."
-                    yield json.dumps({"type": "error", "content": error_msg})
-                    print(f"ERROR: {error_msg} Story object: {self.story}")
-                    # If story is empty/incomplete, we should retry or raise
-                    if attempt + 1 == retries:
-                        raise ValueError("Story content is empty or incomplete after generation.")
-                    continue # Try again if content is bad but no exception was raised
-                break # Exit loop if story is successfully generated and valid
+                self.story = await story_generator.generate_story("fight_mode") # Use a generic difficulty for story generation
             except Exception as e:
-                error_msg = f"Error al generar la historia (intento {attempt + 1}/{retries}): {e}"
+                error_msg = f"Error al generar la historia: {e}"
+                yield json.dumps({"type": "error", "content": error_msg})
+                logger.warning("%s", error_msg, exc_info=True)
+                raise
+
+            # Explicit check and logging for story content
+            if self.story and self.story.mystery_situation and self.story.hidden_solution:
+                yield json.dumps({"type": "narrator", "content": "Narrador: ¡Historia generada con éxito!"})
+                yield json.dumps({"type": "narrator", "content": f"Misterio para los Detectives: {self.story.mystery_situation}"})
+                logger.debug("Story generated: mystery=%.50r, solution=%.50r", self.story.mystery_situation, self.story.hidden_solution)
+            else:
+                error_msg = "Narrador: Error: La historia se generó, pero el contenido está vacío o incompleto."
                 yield json.dumps({"type": "error", "content": error_msg})
-                print(f"ERROR in _initialize_fight: {error_msg}") # Added more specific debug
-                if attempt + 1 == retries:
-                    raise
+                logger.warning("%s Story object: %s", error_msg, self.story)
         
         # After the loop, if self.story is still None or invalid, raise an error
         if not self.story or not self.story.mystery_situation or not self.story.hidden_solution:
-            print("ERROR: Final check - Story generation failed or content is invalid after all attempts.")
+            logger.error("Story generation failed or content is invalid after all attempts")
             raise RuntimeError("La generación de la historia falló o el contenido no es válido después de varios intentos.")
 
         self.game_state_det1 = GameState(
@@ -87,35 +89,48 @@ class FightEngine:
         yield json.dumps({"type": "narrator", "content": "------------------------------------------------------------"})
         yield json.dumps({"type": "narrator", "content": "============================================================"})
 
-    async def _perform_detective_turn(self, detective_id: int, detective_ai: Detective, narrator_ai: Narrator, game_state: GameState, max_questions: int) -> AsyncGenerator[str, None]:
+    async def _perform_detective_turn(self, detective_id: int, detective_ai: AsyncDetective, narrator_ai: AsyncNarrator, game_state: GameState, max_questions: int) -> AsyncGenerator[str, None]:
         """
         Performs a single question-and-answer turn for a detective.
         """
-        if len(game_state.qa_history) >= max_questions:
-            yield json.dumps({"type": f"detective{detective_id}_question", "content": f"¡Se ha alcanzado el límite de {max_questions} preguntas para el Detective {detective_id}!"})
-            # Optionally, force a final solution attempt here if not already done
-            if not game_state.detective_solution_attempt:
-                solution_attempt = detective_ai.provide_final_solution(game_state.qa_history)
-                game_state.detective_solution_attempt = solution_attempt
-                game_state.detective_solved = True # Mark as solved for completion logic
-                yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} presenta su solución final: {solution_attempt}"})
-            return
-
-        detective_response = detective_ai.ask_question_or_solve(game_state.qa_history)
-
-        if detective_ai.is_ready_to_solve(detective_response):
-            game_state.detective_solution_attempt = detective_ai.provide_final_solution(game_state.qa_history)
-            game_state.detective_solved = True
-            yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} dice: ¡Estoy listo para resolver! Mi solución es: {game_state.detective_solution_attempt}"})
-            return
-
-        narrator_answer = await asyncio.to_thread(narrator_ai.answer_question, detective_response, game_state.qa_history) # Run sync in thread
-        game_state.qa_history.append((detective_response, narrator_answer))
+        with span("game.turn", detective=detective_id, turn=len(game_state.qa_history) + 1):
+            if len(game_state.qa_history) >= max_questions:
+                yield json.dumps({"type": f"detective{detective_id}_question", "content": f"¡Se ha alcanzado el límite de {max_questions} preguntas para el Detective {detective_id}!"})
+                # Optionally, force a final solution attempt here if not already done
+                if not game_state.detective_solution_attempt:
+                    solution_attempt = await detective_ai.provide_final_solution(game_state.qa_history)
+                    game_state.detective_solution_attempt = solution_attempt
+                    game_state.detective_solved = True # Mark as solved for completion logic
+                    yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} presenta su solución final: {solution_attempt}"})
+                return
+
+            detective_response = await detective_ai.ask_question_or_solve(game_state.qa_history)
+
+            if detective_ai.is_ready_to_solve(detective_response):
+                game_state.detective_solution_attempt = await detective_ai.provide_final_solution(game_state.qa_history)
+                game_state.detective_solved = True
+                yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} dice: ¡Estoy listo para resolver! Mi solución es: {game_state.detective_solution_attempt}"})
+                return
+
+            narrator_answer = await narrator_ai.answer_question(detective_response, game_state.qa_history)
+            game_state.qa_history.append((detective_response, narrator_answer))
         
-        yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} pregunta: {detective_response}"})
-        yield json.dumps({"type": "narrator", "content": f"Narrador responde a Detective {detective_id}: {narrator_answer}"})
+            yield json.dumps({"type": f"detective{detective_id}_question", "content": f"Detective {detective_id} pregunta: {detective_response}"})
+            yield json.dumps({"type": "narrator", "content": f"Narrador responde a Detective {detective_id}: {narrator_answer}"})
         
-        await asyncio.sleep(0.5) # Small delay for readability
+            turn_delay = self.config.get("fight_turn_delay", 0.0)
+            if turn_delay > 0:
+                await asyncio.sleep(turn_delay) # Optional cosmetic delay for readability
+
+    async def _detective_round(self, detective_id: int, detective_ai: AsyncDetective, game_state: GameState, max_questions: int) -> AsyncGenerator[str, None]:
+        """
+        Plays one detective's part of a round, framed by its turn header and, if it finished, a closing line.
+        """
+        yield json.dumps({"type": "narrator", "content": f"Turno del Detective {detective_id}:"})
+        async for msg in self._perform_detective_turn(detective_id, detective_ai, self.narrator_ai, game_state, max_questions):
+            yield msg
+        if game_state.detective_solved:
+            yield json.dumps({"type": "narrator", "content": f"Detective {detective_id} ha finalizado."})
 
     async def _run_fight_loop(self) -> AsyncGenerator[str, None]:
         """
@@ -124,17 +139,17 @@ class FightEngine:
         if not self.game_state_det1 or not self.game_state_det2 or not self.story:
             raise RuntimeError("Fight not initialized.")
 
-        self.narrator_ai = Narrator(
+        self.narrator_ai = AsyncNarrator(
             self.api_client,
             self.game_state_det1.narrator_model, # Narrator model is same for both
             self.story,
             self.game_state_det1.difficulty,
         )
 
-        detective1_ai = Detective(
+        detective1_ai = AsyncDetective(
             self.api_client, self.game_state_det1.detective_model, self.game_state_det1.mystery_situation
         )
-        detective2_ai = Detective(
+        detective2_ai = AsyncDetective(
             self.api_client, self.game_state_det2.detective_model, self.game_state_det2.mystery_situation
         )
 
@@ -147,21 +162,20 @@ class FightEngine:
             turn_counter += 1
             yield json.dumps({"type": "narrator", "content": f"--- Ronda {turn_counter} ---"})
             
-            # Detective 1's turn
+            rounds = []
             if not self.game_state_det1.detective_solved:
-                yield json.dumps({"type": "narrator", "content": "Turno del Detective 1:"})
-                async for msg in self._perform_detective_turn(1, detective1_ai, self.narrator_ai, self.game_state_det1, max_questions):
-                    yield msg
-                if self.game_state_det1.detective_solved:
-                    yield json.dumps({"type": "narrator", "content": f"Detective 1 ha finalizado."})
-            
-            # Detective 2's turn
+                rounds.append(self._detective_round(1, detective1_ai, self.game_state_det1, max_questions))
             if not self.game_state_det2.detective_solved:
-                yield json.dumps({"type": "narrator", "content": "Turno del Detective 2:"})
-                async for msg in self._perform_detective_turn(2, detective2_ai, self.narrator_ai, self.game_state_det2, max_questions):
+                rounds.append(self._detective_round(2, detective2_ai, self.game_state_det2, max_questions))
+
+            if self.config.get("fight_concurrent_rounds", True):
+                # Both detectives have independent histories, so their question/answer chains can overlap
+                async for msg in merge_streams(rounds):
                     yield msg
-                if self.game_state_det2.detective_solved:
-                    yield json.dumps({"type": "narrator", "content": f"Detective 2 ha finalizado."})
+            else:
+                for round_stream in rounds:
+                    async for msg in round_stream:
+                        yield msg
 
             if self.game_state_det1.detective_solved and self.game_state_det2.detective_solved:
                 break # Both have solved or reached limits
@@ -171,12 +185,15 @@ class FightEngine:
                 break
 
         # Ensure final solution attempts are recorded if they haven't already
-        if not self.game_state_det1.detective_solved and len(self.game_state_det1.qa_history) >= max_questions:
-            self.game_state_det1.detective_solution_attempt = detective1_ai.provide_final_solution(self.game_state_det1.qa_history)
-            self.game_state_det1.detective_solved = True
-        if not self.game_state_det2.detective_solved and len(self.game_state_det2.qa_history) >= max_questions:
-            self.game_state_det2.detective_solution_attempt = detective2_ai.provide_final_solution(self.game_state_det2.qa_history)
-            self.game_state_det2.detective_solved = True
+        async def record_final_solution(detective_ai: AsyncDetective, game_state: GameState) -> None:
+            if not game_state.detective_solved and len(game_state.qa_history) >= max_questions:
+                game_state.detective_solution_attempt = await detective_ai.provide_final_solution(game_state.qa_history)
+                game_state.detective_solved = True
+
+        await asyncio.gather(
+            record_final_solution(detective1_ai, self.game_state_det1),
+            record_final_solution(detective2_ai, self.game_state_det2),
+        )
 
 
     async def _finalize_fight(self) -> AsyncGenerator[str, None]:
@@ -188,17 +205,17 @@ class FightEngine:
 
         summary_messages = []
         
-        # Finalize Detective 1
-        verdict1, analysis1 = "No solution provided", ""
-        if self.game_state_det1.detective_solution_attempt:
-            # Validate solution without passing qa_history, as Narrator.validate_solution does not accept it.
-            verdict1, analysis1 = await asyncio.to_thread(self.narrator_ai.validate_solution, self.game_state_det1.detective_solution_attempt)
-        
-        # Finalize Detective 2
-        verdict2, analysis2 = "No solution provided", ""
-        if self.game_state_det2.detective_solution_attempt:
+        async def validate(game_state: GameState) -> Tuple[str, str]:
+            if not game_state.detective_solution_attempt:
+                return "No solution provided", ""
             # Validate solution without passing qa_history, as Narrator.validate_solution does not accept it.
-            verdict2, analysis2 = await asyncio.to_thread(self.narrator_ai.validate_solution, self.game_state_det2.detective_solution_attempt)
+            return await self.narrator_ai.validate_solution(game_state.detective_solution_attempt)
+
+        # Both verdicts are independent, so validate the two solutions in parallel
+        (verdict1, analysis1), (verdict2, analysis2) = await asyncio.gather(
+            validate(self.game_state_det1),
+            validate(self.game_state_det2),
+        )
 
         # Determine Winner
         winner = None
@@ -247,18 +264,35 @@ class FightEngine:
         summary_messages.append(f"<h3>GANADOR: {winner}</h3>")
         summary_messages.append(f"<p><strong>Razón:</strong> {winner_rationale}</p>")
 
-        yield json.dumps({"type": "summary", "content": "".join(summary_messages)})
+        cache_stats = self.narrator_ai.answer_cache.get_stats() if self.narrator_ai.answer_cache else None
+        if cache_stats:
+            summary_messages.append(
+                f"<p><strong>Respuestas reutilizadas por el Narrador:</strong> {cache_stats['hits'] + cache_stats['shared']} "
+                f"de {cache_stats['hits'] + cache_stats['misses']} preguntas</p>"
+            )
+
+        prompt_cache_stats = self.api_client.prompt_cache_stats
+        summary_messages.append(f"<p><strong>Tokens de prompt reutilizados:</strong> {prompt_cache_stats['saved_tokens']}</p>")
+
+        usage = self.api_client.usage.get_summary() # One narrator serves both detectives, so the totals cover the whole fight
+        self.game_state_det1.usage = self.game_state_det2.usage = usage
+        summary_messages.append(f"<p><strong>Tokens usados:</strong> {describe_usage(usage)}</p>")
+
+        yield json.dumps({"type": "summary", "content": "".join(summary_messages), "answer_cache": cache_stats, "prompt_cache": prompt_cache_stats, "usage": usage})
 
     async def run(self, narrator_model: str, detective_model_1: str, detective_model_2: str) -> AsyncGenerator[str, None]:
         """
         Runs the complete Black Stories AI fight mode.
         """
-        try:
-            async for msg in self._initialize_fight(narrator_model, detective_model_1, detective_model_2):
-                yield msg
-            async for msg in self._run_fight_loop():
-                yield msg
-            async for msg in self._finalize_fight():
-                yield msg
-        except Exception as e:
-            yield json.dumps({"type": "error", "content": f"El modo pelea ha terminado debido a un error crítico: {e}. Asegúrate de que tus claves de API y la URL de Ollama estén configuradas correctamente."})
+        with span("game.run", mode="fight", narrator=narrator_model, detectives=[detective_model_1, detective_model_2]):
+            try:
+                async for msg in self._initialize_fight(narrator_model, detective_model_1, detective_model_2):
+                    yield msg
+                async for msg in self._run_fight_loop():
+                    yield msg
+                async for msg in self._finalize_fight():
+                    yield msg
+            except Exception as e:
+                yield json.dumps({"type": "error", "content": f"El modo pelea ha terminado debido a un error crítico: {e}. Asegúrate de que tus claves de API y la URL de Ollama estén configuradas correctamente."})
+            finally:
+                await self.api_client.aclose()
@@ -1,42 +1,47 @@
 import json
-from typing import Dict, Any, Generator
+from typing import Dict, Any, AsyncGenerator, Generator, List
 
 from src.models.game_state import GameState
-from src.models.story import Story
 from src.services.api_client import APIClient
-from src.services.story_generator import StoryGenerator
-from src.services.narrator import Narrator
-from src.services.detective import Detective
+from src.services.async_api_client import AsyncAPIClient
+from src.services.story_generator import AsyncStoryGenerator
+from src.services.narrator import AsyncNarrator
+from src.services.detective import AsyncDetective
+from src.services.story_pool import get_story_pool
+from src.services.usage import describe_usage
+from src.utils.tracing import span
+from src.utils.cancellation import CancelToken, GameCancelled
+from src.game.streaming import ndjson_delta
 
 class GameEngine:
     """
     Orchestrates the Black Stories AI game, managing the flow between different components.
+    The game is written once, as async generators; the blocking entry points (`run` and the
+    interactive mode) run it on the background event loop through `api_client`.
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], cancel_token: CancelToken | None = None):
         self.config = config
-        self.api_client = APIClient(config)
+        self.api_client = APIClient(config, cancel_token) # The token aborts its calls when the web client disconnects
+        self.async_api_client: AsyncAPIClient = self.api_client.core # run_async() replaces it with a client of its own event loop
+        self.story_pool = get_story_pool(config)
         self.game_state: GameState | None = None
-        self.narrator_ai: Narrator | None = None
+        self.narrator_ai: AsyncNarrator | None = None
+        self.error: str | None = None # Set when run()/run_async() stops on a critical error
 
-    def _initialize_game(self, difficulty: str, narrator_model: str, detective_model: str) -> Generator[str, None, None]:
+    async def _initialize_game(self, difficulty: str, narrator_model: str, detective_model: str) -> AsyncGenerator[str, None]:
         """
-        Initializes the game by generating a story and setting up AI roles.
+        Initializes the game by generating a story and setting up the narrator.
         """
-        yield "Generando una nueva historia de Black Stories..."
-        story_generator = StoryGenerator(self.api_client, narrator_model)
-        
-        story: Story
-        retries = 3
-        for attempt in range(retries):
+        story = self.story_pool.take(difficulty, narrator_model) if self.story_pool else None
+        if story is None:
+            story_generator = AsyncStoryGenerator(self.async_api_client, narrator_model)
             try:
-                story = story_generator.generate_story(difficulty)
-                break
+                story = await story_generator.generate_story(difficulty)
             except Exception as e:
-                yield f"Error al generar la historia (intento {attempt + 1}/{retries}): {e}"
-                if attempt + 1 == retries:
-                    raise
-        
+                yield f"Error al generar la historia: {e}"
+                raise
+
         self.game_state = GameState(
             narrator_model=narrator_model,
             detective_model=detective_model,
@@ -44,68 +49,64 @@ class GameEngine:
             mystery_situation=story.mystery_situation,
             hidden_solution=story.hidden_solution,
         )
+        self.narrator_ai = AsyncNarrator(self.async_api_client, narrator_model, story, difficulty)
 
-        yield "============================================================"
-        yield "                  BLACK STORIES AI"
-        yield "============================================================"
-        yield f"Narrador: {narrator_model}"
-        yield f"Detective: {detective_model}"
-        yield f"Dificultad: {difficulty}"
-        yield "------------------------------------------------------------"
-        yield f"Misterio: {story.mystery_situation}"
-        yield "============================================================"
+    def _header_lines(self, narrator_model: str, detective_model: str, difficulty: str) -> List[str]:
+        """
+        Returns the banner shown once the story is ready.
+        """
+        return [
+            "============================================================",
+            "                  BLACK STORIES AI",
+            "============================================================",
+            f"Narrador: {narrator_model}",
+            f"Detective: {detective_model}",
+            f"Dificultad: {difficulty}",
+            "------------------------------------------------------------",
+            f"Misterio: {self.game_state.mystery_situation}",
+            "============================================================",
+        ]
 
-    def _run_game_loop(self) -> Generator[str, None, None]:
+    async def _run_game_loop(self) -> AsyncGenerator[str, None]:
         """
         Runs the main game loop where the detective asks questions and the narrator responds.
         """
-        if not self.game_state:
+        if not self.game_state or not self.narrator_ai:
             raise RuntimeError("Game not initialized.")
 
-        self.narrator_ai = Narrator(
-            self.api_client,
-            self.game_state.narrator_model,
-            Story(self.game_state.mystery_situation, self.game_state.hidden_solution),
-            self.game_state.difficulty,
-        )
-        detective_ai = Detective(
-            self.api_client, self.game_state.detective_model, self.game_state.mystery_situation
+        detective_ai = AsyncDetective(
+            self.async_api_client, self.game_state.detective_model, self.game_state.mystery_situation
         )
 
         detective_ready_to_solve = False
         max_questions = self.config["question_limits"].get(self.game_state.difficulty, 10)
 
         while not self.game_state.detective_solved:
-            current_questions = len(self.game_state.qa_history)
-
-            if current_questions >= max_questions and not detective_ready_to_solve:
-                yield f"¡Se ha alcanzado el límite de {max_questions} preguntas!"
-                yield "El Detective tiene UNA ÚLTIMA OPORTUNIDAD para dar su solución final."
-                detective_ready_to_solve = True
-            
-            if detective_ready_to_solve:
-                self.game_state.detective_solution_attempt = detective_ai.provide_final_solution(self.game_state.qa_history)
-                self.game_state.detective_solved = True
-                break
-            
-            if not detective_ready_to_solve:
-                detective_response = detective_ai.ask_question_or_solve(self.game_state.qa_history)
+            with span("game.turn", turn=len(self.game_state.qa_history) + 1):
+                if len(self.game_state.qa_history) >= max_questions and not detective_ready_to_solve:
+                    yield f"¡Se ha alcanzado el límite de {max_questions} preguntas!"
+                    yield "El Detective tiene UNA ÚLTIMA OPORTUNIDAD para dar su solución final."
+                    detective_ready_to_solve = True
+
+                if detective_ready_to_solve:
+                    self.game_state.detective_solution_attempt = await detective_ai.provide_final_solution(self.game_state.qa_history)
+                    self.game_state.detective_solved = True
+                    break
+
+                detective_response = await detective_ai.ask_question_or_solve(self.game_state.qa_history)
 
                 if detective_ai.is_ready_to_solve(detective_response):
                     detective_ready_to_solve = True
                     yield "Detective: ¡Estoy listo para resolver!"
                     continue
 
-                narrator_answer = self.narrator_ai.answer_question(detective_response, self.game_state.qa_history)
+                narrator_answer = await self.narrator_ai.answer_question(detective_response, self.game_state.qa_history)
                 self.game_state.qa_history.append((detective_response, narrator_answer))
-                
+
                 yield f"Detective: {detective_response}"
                 yield f"Narrador: {narrator_answer}"
 
-        if not self.game_state.detective_solved and not self.game_state.detective_solution_attempt:
-            self.game_state.detective_solved = True
-
-    def _finalize_game(self) -> Generator[str, None, None]:
+    async def _finalize_game(self) -> AsyncGenerator[str, None]:
         """
         Finalizes the game by validating the detective's solution and displaying the results.
         """
@@ -116,15 +117,29 @@ class GameEngine:
         verdict = "Incorrecto"
         analysis = "El Detective no proporcionó una solución."
 
-        if self.game_state.detective_solution_attempt:
-            verdict, analysis = self.narrator_ai.validate_solution(self.game_state.detective_solution_attempt)
+        solution = self.game_state.detective_solution_attempt
+        if solution:
+            chunks: List[str] = []
+            async for chunk in self.narrator_ai.stream_validation(solution):
+                chunks.append(chunk)
+                yield ndjson_delta("validation", chunk)
+            verdict, analysis = await self.narrator_ai.parse_streamed_validation(solution, "".join(chunks))
             if verdict.lower() == "correcto":
                 result = "VICTORIA"
-            else:
-                result = "DERROTA"
-        
-        # Construct HTML Summary
-        summary_html = f"""
+
+        self.game_state.verdict = verdict
+        self.game_state.validation_analysis = analysis
+        self.game_state.usage = self.narrator_ai.api_client.usage.get_summary()
+
+        # Yield as a single JSON message
+        yield json.dumps({"type": "summary", "content": self._summary_html(result, verdict, analysis), "usage": self.game_state.usage})
+        yield "save_conversation"
+
+    def _summary_html(self, result: str, verdict: str, analysis: str) -> str:
+        """
+        Builds the HTML summary shown at the end of the game.
+        """
+        return f"""
         <div class="game-result {result.lower()}">
             <h2>RESULTADO: {result}</h2>
         </div>
@@ -149,24 +164,59 @@ class GameEngine:
             <p><strong>Veredicto:</strong> {verdict}</p>
             <p><strong>Análisis:</strong> {analysis}</p>
         </div>
+
+        <div class="summary-section">
+            <p><strong>Tokens de prompt reutilizados:</strong> {self.narrator_ai.api_client.prompt_cache_stats["saved_tokens"]}</p>
+            <p><strong>Tokens usados:</strong> {describe_usage(self.game_state.usage)}</p>
+        </div>
         """
 
-        # Yield as a single JSON message
-        yield json.dumps({"type": "summary", "content": summary_html})
-        yield "save_conversation"
+    async def _play(self, difficulty: str, narrator_model: str, detective_model: str) -> AsyncGenerator[str, None]:
+        """
+        The complete game, as run by both `run` and `run_async`.
+        """
+        with span("game.run", mode="single", narrator=narrator_model, detective=detective_model):
+            try:
+                with span("game.init"):
+                    yield "Generando una nueva historia de Black Stories..."
+                    async for line in self._initialize_game(difficulty, narrator_model, detective_model):
+                        yield line
+                    for line in self._header_lines(narrator_model, detective_model, difficulty):
+                        yield line
+                async for line in self._run_game_loop():
+                    yield line
+                with span("game.finalize"):
+                    async for line in self._finalize_game():
+                        yield line
+            except GameCancelled as e:
+                self.error = str(e) # Nobody is listening anymore
+            except Exception as e:
+                self.error = str(e)
+                yield f"El juego ha terminado debido a un error crítico: {e}"
+                yield "Asegúrate de que tus claves de API y la URL de Ollama estén configuradas correctamente."
 
     def run(self, difficulty: str, narrator_model: str, detective_model: str) -> Generator[str, None, None]:
         """
-        Runs the complete Black Stories AI game.
+        Runs the complete Black Stories AI game from a blocking caller (the CLI, a Flask streaming response).
+        The game runs on the background event loop and its lines are yielded as they are produced.
         """
         try:
-            yield from self._initialize_game(difficulty, narrator_model, detective_model)
-            yield from self._run_game_loop()
-            yield from self._finalize_game()
-        except Exception as e:
-            yield f"El juego ha terminado debido a un error crítico: {e}"
-            yield "Asegúrate de que tus claves de API y la URL de Ollama estén configuradas correctamente."
-    
+            yield from self.api_client.iterate(self._play(difficulty, narrator_model, detective_model))
+        except GameCancelled as e:
+            self.error = str(e) # Nobody is listening anymore
+
+    async def run_async(self, difficulty: str, narrator_model: str, detective_model: str) -> AsyncGenerator[str, None]:
+        """
+        Runs the complete Black Stories AI game on the running event loop, without blocking it.
+        Produces the same stream of lines as `run`.
+        """
+        self.async_api_client = AsyncAPIClient(self.config)
+        try:
+            async for line in self._play(difficulty, narrator_model, detective_model):
+                yield line
+        finally:
+            await self.async_api_client.aclose()
+
     def save_conversation(self):
         if self.narrator_ai:
             self.narrator_ai.save_full_conversation()
@@ -176,34 +226,7 @@ class GameEngine:
         Initializes an interactive game where the user plays as the detective.
         """
         yield "Generando una nueva historia de Black Stories para ti..."
-        story_generator = StoryGenerator(self.api_client, narrator_model)
-        
-        story: Story
-        retries = 3
-        for attempt in range(retries):
-            try:
-                story = story_generator.generate_story(difficulty)
-                break
-            except Exception as e:
-                yield f"Error al generar la historia (intento {attempt + 1}/{retries}): {e}"
-                if attempt + 1 == retries:
-                    raise
-        
-        self.game_state = GameState(
-            narrator_model=narrator_model,
-            detective_model="User", # User is the detective
-            difficulty=difficulty,
-            mystery_situation=story.mystery_situation,
-            hidden_solution=story.hidden_solution,
-        )
-
-        # Initialize Narrator immediately for interactive mode
-        self.narrator_ai = Narrator(
-            self.api_client,
-            self.game_state.narrator_model,
-            Story(self.game_state.mystery_situation, self.game_state.hidden_solution),
-            self.game_state.difficulty,
-        )
+        yield from self.api_client.iterate(self._initialize_game(difficulty, narrator_model, "User")) # User is the detective
 
         yield "============================================================"
         yield "                  BLACK STORIES AI (INTERACTIVE)"
@@ -212,7 +235,7 @@ class GameEngine:
         yield "Detective: TÚ"
         yield f"Dificultad: {difficulty}"
         yield "------------------------------------------------------------"
-        yield f"Misterio: {story.mystery_situation}"
+        yield f"Misterio: {self.game_state.mystery_situation}"
         yield "============================================================"
         yield json.dumps({"type": "interactive_ready", "content": "Game initialized. Waiting for your questions."})
 
@@ -223,7 +246,7 @@ class GameEngine:
         if not self.game_state or not self.narrator_ai:
             raise RuntimeError("Game not initialized.")
 
-        narrator_answer = self.narrator_ai.answer_question(question, self.game_state.qa_history)
+        narrator_answer = self.api_client.run(self.narrator_ai.answer_question(question, self.game_state.qa_history))
         self.game_state.qa_history.append((question, narrator_answer))
         return narrator_answer
 
@@ -236,5 +259,5 @@ class GameEngine:
 
         self.game_state.detective_solution_attempt = solution
         self.game_state.detective_solved = True
-        
-        yield from self._finalize_game()
+
+        yield from self.api_client.iterate(self._finalize_game())
@@ -6,6 +6,7 @@ from src.models.story import Story
 from src.services.api_client import APIClient
 from src.services.story_generator import StoryGenerator
 from src.services.detective import Detective
+from src.services.story_pool import get_story_pool
 
 class InverseEngine:
     """
@@ -17,6 +18,7 @@ class InverseEngine:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.api_client = APIClient(config)
+        self.story_pool = get_story_pool(config)
         self.game_state: GameState | None = None
         self.detective_ai: Detective | None = None
 
@@ -26,19 +28,15 @@ class InverseEngine:
         """
         yield "Generando una nueva historia para que TÚ seas el Narrador..."
         
-        # We still use StoryGenerator to create the scenario for the user
-        story_generator = StoryGenerator(self.api_client, detective_model) # Model doesn't matter much here for generation
-        
-        story: Story
-        retries = 3
-        for attempt in range(retries):
+        story = self.story_pool.take(difficulty, detective_model) if self.story_pool else None
+        if story is None:
+            # We still use StoryGenerator to create the scenario for the user
+            story_generator = StoryGenerator(self.api_client, detective_model) # Model doesn't matter much here for generation
             try:
                 story = story_generator.generate_story(difficulty)
-                break
             except Exception as e:
-                yield f"Error al generar la historia (intento {attempt + 1}/{retries}): {e}"
-                if attempt + 1 == retries:
-                    raise
+                yield f"Error al generar la historia: {e}"
+                raise
         
         self.game_state = GameState(
             narrator_model="User",
@@ -130,7 +128,8 @@ class InverseEngine:
         if getattr(self, 'is_solution_attempt', False):
             if answer.lower() in ["sí", "si", "correcto", "exacto", "¡correcto!"]:
                 yield "¡El Detective ha resuelto el caso!"
-                yield json.dumps({"type": "game_over", "result": "AI_WINS"})
+                self.game_state.usage = self.api_client.usage.get_summary()
+                yield json.dumps({"type": "game_over", "result": "AI_WINS", "usage": self.game_state.usage})
                 # End game
             else:
                 yield "El Detective falló en su solución. El juego continúa."
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, Any, AsyncGenerator, Generator, Iterable, List, Set
+
+from src.game.game_engine import GameEngine
+from src.game.streaming import merge_streams
+
+@dataclass(frozen=True)
+class GameSpec:
+    """
+    One game of a batch: which models play it, at which difficulty, and its repetition number.
+    """
+    narrator_model: str
+    detective_model: str
+    difficulty: str
+    repetition: int
+
+    @property
+    def game_id(self) -> str:
+        """
+        Stable identifier used to skip games that are already in the results file when resuming.
+        """
+        return f"{self.narrator_model}|{self.detective_model}|{self.difficulty}|{self.repetition}"
+
+def build_matrix(narrator_models: Iterable[str], detective_models: Iterable[str], difficulties: Iterable[str], repetitions: int) -> List[GameSpec]:
+    """
+    Expands the narrator x detective x difficulty matrix into `repetitions` games per combination.
+    """
+    return [
+        GameSpec(narrator_model, detective_model, difficulty, repetition)
+        for narrator_model, detective_model, difficulty in product(narrator_models, detective_models, difficulties)
+        for repetition in range(1, repetitions + 1)
+    ]
+
+class JsonlResultStore:
+    """
+    Appends one JSON record per finished game to a JSONL file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def completed_ids(self) -> Set[str]:
+        """
+        Returns the ids of games that finished without a critical error.
+        A line cut short by an interrupted run is ignored, so that game is played again.
+        """
+        completed: Set[str] = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("status") == "completed":
+                    completed.add(record["game_id"])
+        return completed
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+class SqliteResultStore:
+    """
+    Stores one row per game in a SQLite database. Replaying a game overwrites its previous row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                game_id TEXT PRIMARY KEY,
+                narrator_model TEXT NOT NULL,
+                detective_model TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                status TEXT NOT NULL,
+                verdict TEXT,
+                questions INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                record TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def completed_ids(self) -> Set[str]:
+        rows = self._conn.execute("SELECT game_id FROM results WHERE status = 'completed'")
+        return {game_id for (game_id,) in rows}
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record["game_id"],
+                record["narrator_model"],
+                record["detective_model"],
+                record["difficulty"],
+                record["status"],
+                record["verdict"],
+                record["questions"],
+                record["duration"],
+                json.dumps(record, ensure_ascii=False),
+            ),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+def open_result_store(path: str) -> JsonlResultStore | SqliteResultStore:
+    """
+    Picks the results backend from the file extension: .db/.sqlite/.sqlite3 for SQLite, JSONL otherwise.
+    """
+    if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3"):
+        return SqliteResultStore(path)
+    return JsonlResultStore(path)
+
+async def play_game(config: Dict[str, Any], spec: GameSpec) -> Dict[str, Any]:
+    """
+    Plays one headless game through `GameEngine.run_async` and returns its result record.
+    """
+    engine = GameEngine(config)
+    started = time.monotonic()
+    async for _ in engine.run_async(spec.difficulty, spec.narrator_model, spec.detective_model):
+        pass # The display lines are not needed, the result is read from the game state
+
+    game_state = engine.game_state
+    return {
+        "game_id": spec.game_id,
+        "narrator_model": spec.narrator_model,
+        "detective_model": spec.detective_model,
+        "difficulty": spec.difficulty,
+        "repetition": spec.repetition,
+        "status": "error" if engine.error else "completed",
+        "error": engine.error,
+        "story": {
+            "mystery_situation": game_state.mystery_situation,
+            "hidden_solution": game_state.hidden_solution,
+        } if game_state else None,
+        "qa_history": game_state.qa_history if game_state else [],
+        "solution_attempt": game_state.detective_solution_attempt if game_state else None,
+        "verdict": game_state.verdict if game_state else None,
+        "questions": len(game_state.qa_history) if game_state else 0,
+        "duration": round(time.monotonic() - started, 4),
+        "calls": engine.async_api_client.call_log,
+        "prompt_cache": engine.async_api_client.prompt_cache_stats,
+        "usage": engine.async_api_client.usage.get_summary(),
+        "answer_cache": engine.narrator_ai.answer_cache.get_stats() if engine.narrator_ai and engine.narrator_ai.answer_cache else None,
+    }
+
+async def _play_games(config: Dict[str, Any], specs: List[GameSpec], concurrency: int) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Plays `specs` with `concurrency` asyncio workers and yields each record as soon as its game ends.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for spec in specs:
+        queue.put_nowait(spec)
+
+    async def worker() -> AsyncGenerator[Dict[str, Any], None]:
+        while not queue.empty():
+            spec = queue.get_nowait()
+            yield await play_game(config, spec)
+
+    async for record in merge_streams([worker() for _ in range(max(1, min(concurrency, len(specs))))]):
+        yield record
+
+def _play_shard(config: Dict[str, Any], specs: List[GameSpec], concurrency: int) -> List[Dict[str, Any]]:
+    """
+    Process pool entry point: plays a shard of games on the worker process's own event loop.
+    """
+    async def collect() -> List[Dict[str, Any]]:
+        return [record async for record in _play_games(config, specs, concurrency)]
+    return asyncio.run(collect())
+
+class BatchSimulator:
+    """
+    Runs many AI-vs-AI games without the UI and streams their results into a results store.
+    Games already completed in the store are skipped, so an interrupted batch can simply be run again.
+    """
+
+    def __init__(self, config: Dict[str, Any], concurrency: int = 8, processes: int = 0):
+        self.config = config
+        self.concurrency = max(1, concurrency)
+        self.processes = processes
+
+    def pending(self, specs: List[GameSpec], store: JsonlResultStore | SqliteResultStore) -> List[GameSpec]:
+        """
+        Returns the games of `specs` that the store does not hold as completed yet.
+        """
+        completed = store.completed_ids()
+        return [spec for spec in specs if spec.game_id not in completed]
+
+    async def run_async(self, specs: List[GameSpec], store: JsonlResultStore | SqliteResultStore) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Plays the pending games on the running event loop and yields each record after it is stored.
+        """
+        async for record in _play_games(self.config, self.pending(specs, store), self.concurrency):
+            store.write(record)
+            yield record
+
+    def run(self, specs: List[GameSpec], store: JsonlResultStore | SqliteResultStore) -> Generator[Dict[str, Any], None, None]:
+        """
+        Plays the pending games and yields each record after it is stored.
+        With `processes` > 1 the games are split into shards of `concurrency` games played on a process pool;
+        otherwise they all run as asyncio workers on one event loop.
+        """
+        pending = self.pending(specs, store)
+        if self.processes > 1:
+            shards = [pending[i:i + self.concurrency] for i in range(0, len(pending), self.concurrency)]
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                futures = [executor.submit(_play_shard, self.config, shard, self.concurrency) for shard in shards]
+                for future in as_completed(futures):
+                    for record in future.result():
+                        store.write(record)
+                        yield record
+            return
+
+        loop = asyncio.new_event_loop()
+        async_iter = _play_games(self.config, pending, self.concurrency).__aiter__()
+        try:
+            while True:
+                try:
+                    record = loop.run_until_complete(async_iter.__anext__())
+                except StopAsyncIteration:
+                    break
+                store.write(record)
+                yield record
+        finally:
+            loop.run_until_complete(async_iter.aclose()) # Cancels the games still running on an early stop
+            loop.close()
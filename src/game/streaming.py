@@ -0,0 +1,43 @@
+import asyncio
+import json
+from typing import AsyncGenerator, List
+
+def ndjson_delta(target: str, content: str) -> str:
+    """
+    Builds an NDJSON message carrying a partial chunk of text for the message of type `target`.
+    The frontend appends deltas to a live bubble and replaces it when the full `target` message arrives.
+    """
+    return json.dumps({"type": "delta", "target": target, "content": content})
+
+async def merge_streams(streams: List[AsyncGenerator[str, None]]) -> AsyncGenerator[str, None]:
+    """
+    Runs several async message streams at the same time and yields their messages as they are produced.
+    Messages of one stream keep their relative order; messages of different streams may interleave.
+    The first exception raised by any stream cancels the others and is re-raised.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def drain(stream: AsyncGenerator[str, None]) -> None:
+        try:
+            async for msg in stream:
+                await queue.put(msg)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(finished)
+
+    tasks = [asyncio.create_task(drain(stream)) for stream in streams]
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if item is finished:
+                pending -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,213 @@
+import json
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Any, AsyncGenerator, List
+
+from src.models.game_state import GameState
+from src.models.story import Story
+from src.services.async_api_client import AsyncAPIClient
+from src.services.story_generator import AsyncStoryGenerator
+from src.services.narrator import AsyncNarrator
+from src.services.detective import AsyncDetective
+from src.services.story_pool import get_story_pool
+from src.services.usage import describe_usage
+from src.utils.tracing import span
+from src.game.streaming import merge_streams
+
+@dataclass
+class TournamentEntry:
+    """
+    One participant of a tournament: its interrogation state and the Narrator's verdict.
+    """
+    participant: int
+    game_state: GameState
+    verdict: str = "Sin solución"
+    analysis: str = ""
+    error: str | None = None
+
+    @property
+    def is_correct(self) -> bool:
+        return self.verdict.lower() == "correcto"
+
+    @property
+    def questions(self) -> int:
+        return len(self.game_state.qa_history)
+
+class TournamentEngine:
+    """
+    Orchestrates a tournament: N detective models interrogate the same Narrator story at the same time
+    (bounded by `tournament_concurrency`) and are ranked on a single leaderboard by correctness and
+    number of questions.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.concurrency = max(1, config.get("tournament_concurrency", 10))
+        # Keep enough idle keep-alive sockets for every interrogation running at once
+        self.api_client = AsyncAPIClient({**config, "pool_max_size": max(config.get("pool_max_size", 4), self.concurrency)})
+        self.story_pool = get_story_pool(config)
+        self.story: Story | None = None
+        self.narrator_ai: AsyncNarrator | None = None
+        self.entries: List[TournamentEntry] = []
+
+    async def _initialize_tournament(self, difficulty: str, narrator_model: str, detective_models: List[str]) -> AsyncGenerator[str, None]:
+        """
+        Generates the shared story and sets up one GameState per participant.
+        """
+        yield json.dumps({"type": "narrator", "content": "Narrador: Generando la historia del torneo..."})
+        self.story = self.story_pool.take(difficulty, narrator_model) if self.story_pool else None
+        if self.story is None:
+            story_generator = AsyncStoryGenerator(self.api_client, narrator_model)
+            try:
+                self.story = await story_generator.generate_story(difficulty)
+            except Exception as e:
+                yield json.dumps({"type": "error", "content": f"Error al generar la historia: {e}"})
+                raise
+
+        self.narrator_ai = AsyncNarrator(self.api_client, narrator_model, self.story, difficulty)
+        self.entries = [
+            TournamentEntry(
+                participant=index,
+                game_state=GameState(
+                    narrator_model=narrator_model,
+                    detective_model=detective_model,
+                    difficulty=difficulty,
+                    mystery_situation=self.story.mystery_situation,
+                    hidden_solution=self.story.hidden_solution,
+                ),
+            )
+            for index, detective_model in enumerate(detective_models, start=1)
+        ]
+
+        yield json.dumps({"type": "narrator", "content": "============================================================"})
+        yield json.dumps({"type": "narrator", "content": "                  BLACK STORIES AI - TORNEO"})
+        yield json.dumps({"type": "narrator", "content": "============================================================"})
+        yield json.dumps({"type": "narrator", "content": f"Narrador: {narrator_model}"})
+        for entry in self.entries:
+            yield json.dumps({"type": "narrator", "content": f"Detective {entry.participant}: {entry.game_state.detective_model}"})
+        yield json.dumps({"type": "narrator", "content": "------------------------------------------------------------"})
+        yield json.dumps({"type": "narrator", "content": f"Misterio: {self.story.mystery_situation}"})
+        yield json.dumps({"type": "narrator", "content": "============================================================"})
+
+    async def _interrogate(self, entry: TournamentEntry, max_questions: int) -> AsyncGenerator[str, None]:
+        """
+        Runs one participant's whole interrogation and validates its solution.
+        Errors are recorded on the entry so a failing model does not stop the rest of the tournament.
+        """
+        game_state = entry.game_state
+        detective_ai = AsyncDetective(self.api_client, game_state.detective_model, game_state.mystery_situation)
+
+        def message(content: str) -> str:
+            return json.dumps({
+                "type": "tournament_turn",
+                "participant": entry.participant,
+                "model": game_state.detective_model,
+                "content": content,
+            })
+
+        with span("tournament.game", participant=entry.participant, model=game_state.detective_model):
+            try:
+                while not game_state.detective_solved:
+                    if len(game_state.qa_history) >= max_questions:
+                        yield message(f"¡Límite de {max_questions} preguntas alcanzado! Debe dar su solución final.")
+                        break
+
+                    detective_response = await detective_ai.ask_question_or_solve(game_state.qa_history)
+                    if detective_ai.is_ready_to_solve(detective_response):
+                        break
+
+                    narrator_answer = await self.narrator_ai.answer_question(detective_response, game_state.qa_history)
+                    game_state.qa_history.append((detective_response, narrator_answer))
+                    yield message(f"Pregunta: {detective_response} — Narrador: {narrator_answer}")
+
+                game_state.detective_solution_attempt = await detective_ai.provide_final_solution(game_state.qa_history)
+                game_state.detective_solved = True
+                yield message(f"Solución propuesta: {game_state.detective_solution_attempt}")
+
+                entry.verdict, entry.analysis = await self.narrator_ai.validate_solution(game_state.detective_solution_attempt)
+                yield message(f"Veredicto: {entry.verdict}")
+            except Exception as e:
+                entry.error = str(e)
+                entry.verdict = "Error"
+                yield json.dumps({"type": "error", "content": f"Detective {entry.participant} ({game_state.detective_model}) abandona el torneo: {e}"})
+
+    async def _run_tournament(self) -> AsyncGenerator[str, None]:
+        """
+        Runs every participant's interrogation concurrently, at most `tournament_concurrency` at a time.
+        """
+        if not self.story or not self.entries:
+            raise RuntimeError("Tournament not initialized.")
+
+        max_questions = self.config["question_limits"].get(self.entries[0].game_state.difficulty, 10)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(entry: TournamentEntry) -> AsyncGenerator[str, None]:
+            async with semaphore:
+                async for msg in self._interrogate(entry, max_questions):
+                    yield msg
+
+        async for msg in merge_streams([bounded(entry) for entry in self.entries]):
+            yield msg
+
+    def _ranking(self) -> List[TournamentEntry]:
+        """
+        Correct solutions first, then fewer questions; ties keep the participant order.
+        """
+        return sorted(self.entries, key=lambda entry: (not entry.is_correct, entry.questions, entry.participant))
+
+    async def _finalize_tournament(self) -> AsyncGenerator[str, None]:
+        """
+        Emits the leaderboard as a single summary message.
+        """
+        ranking = self._ranking()
+        rows = []
+        leaderboard = []
+        for position, entry in enumerate(ranking, start=1):
+            rows.append(
+                f"<tr><td>{position}</td><td>{entry.game_state.detective_model}</td>"
+                f"<td>{entry.verdict}</td><td>{entry.questions}</td></tr>"
+            )
+            leaderboard.append({
+                "position": position,
+                "participant": entry.participant,
+                "model": entry.game_state.detective_model,
+                "verdict": entry.verdict,
+                "questions": entry.questions,
+                "solution": entry.game_state.detective_solution_attempt,
+                "error": entry.error,
+            })
+
+        usage = self.api_client.usage.get_summary() # The games share a narrator and a client, so the totals cover the whole tournament
+        for entry in self.entries:
+            entry.game_state.usage = usage
+
+        winner = ranking[0].game_state.detective_model if ranking and ranking[0].is_correct else "Ninguno"
+        summary_html = (
+            "<h2>Clasificación del Torneo</h2>"
+            f"<p><strong>Historia Original:</strong><br>{self.story.mystery_situation}<br>Solución: {self.story.hidden_solution}</p>"
+            "<table class=\"leaderboard\"><tr><th>#</th><th>Detective</th><th>Veredicto</th><th>Preguntas</th></tr>"
+            + "".join(rows)
+            + "</table>"
+            f"<h3>GANADOR: {winner}</h3>"
+            f"<p><strong>Tokens de prompt reutilizados:</strong> {self.api_client.prompt_cache_stats['saved_tokens']}</p>"
+            f"<p><strong>Tokens usados:</strong> {describe_usage(usage)}</p>"
+        )
+        cache_stats = self.narrator_ai.answer_cache.get_stats() if self.narrator_ai and self.narrator_ai.answer_cache else None
+        yield json.dumps({"type": "summary", "content": summary_html, "leaderboard": leaderboard, "answer_cache": cache_stats, "prompt_cache": self.api_client.prompt_cache_stats, "usage": usage})
+
+    async def run(self, difficulty: str, narrator_model: str, detective_models: List[str]) -> AsyncGenerator[str, None]:
+        """
+        Runs the complete tournament.
+        """
+        with span("game.run", mode="tournament", narrator=narrator_model, detectives=len(detective_models)):
+            try:
+                async for msg in self._initialize_tournament(difficulty, narrator_model, detective_models):
+                    yield msg
+                async for msg in self._run_tournament():
+                    yield msg
+                async for msg in self._finalize_tournament():
+                    yield msg
+            except Exception as e:
+                yield json.dumps({"type": "error", "content": f"El torneo ha terminado debido a un error crítico: {e}"})
+            finally:
+                await self.api_client.aclose()
@@ -1,5 +1,7 @@
 from dataclasses import dataclass, field
-from typing import List, Tuple
+from typing import Any, Dict
+
+from src.models.history import QAHistory
 
 @dataclass
 class GameState:
@@ -11,6 +13,13 @@ class GameState:
     difficulty: str
     mystery_situation: str
     hidden_solution: str
-    qa_history: List[Tuple[str, str]] = field(default_factory=list)
+    qa_history: QAHistory = field(default_factory=QAHistory)
     detective_solved: bool = False
     detective_solution_attempt: str | None = None
+    verdict: str | None = None
+    validation_analysis: str | None = None
+    usage: Dict[str, Any] | None = None # Tokens, timings and cost per role (UsageTracker.get_summary), set when the game ends
+
+    def __post_init__(self):
+        if not isinstance(self.qa_history, QAHistory):
+            self.qa_history = QAHistory(self.qa_history)
@@ -0,0 +1,212 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Tuple
+
+from src.services.answer_cache import normalize_question
+from src.services.prompt_cache import estimate_tokens
+
+# Rendered forms of a Q&A history: style -> (line template, section header)
+HISTORY_FORMATS: Dict[str, Tuple[str, str]] = {
+    "interrogatorio": ("Detective: {q}\nNarrador: {a}", "\n\nHistorial de preguntas y respuestas:\n"),
+    "caso": ("Pregunta: {q}\nRespuesta: {a}", "\n\nHistorial del caso:\n"),
+}
+
+# Fact sheet sections, in the order they are rendered and the reverse order they are trimmed
+FACT_CATEGORIES: Dict[str, str] = {
+    "confirmado": "Hechos confirmados (respuesta \"sí\")",
+    "descartado": "Hechos descartados (respuesta \"no\")",
+    "irrelevante": "Temas no relevantes",
+}
+
+@dataclass(frozen=True)
+class ContextBudget:
+    """
+    Limit on the rendered history of a prompt. Past `max_tokens`, turns older than the last
+    `recent_turns` are compacted into a fact sheet.
+    """
+    max_tokens: int
+    recent_turns: int = 8
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ContextBudget | None":
+        """
+        Returns the configured budget, or None when `context_budget_tokens` is 0 (no limit).
+        """
+        max_tokens = config.get("context_budget_tokens", 0)
+        if max_tokens <= 0:
+            return None
+        return cls(max_tokens, max(1, config.get("context_recent_turns", 8)))
+
+class FactSheet:
+    """
+    Deduplicated summary of compacted turns: each question is filed as confirmed, ruled out or
+    irrelevant according to its answer. Asking the same question again (after normalization)
+    replaces the earlier entry, so the sheet holds the latest answer once.
+    """
+
+    def __init__(self):
+        self.turns = 0
+        self._facts: Dict[Tuple[str, ...], Tuple[str, str]] = {} # normalized question -> (category, text)
+
+    @staticmethod
+    def _category(answer: str) -> str:
+        answer = answer.strip().lower().rstrip(".!")
+        if answer in ("sí", "si"):
+            return "confirmado"
+        if answer == "no":
+            return "descartado"
+        return "irrelevante"
+
+    def add(self, question: str, answer: str) -> None:
+        self.turns += 1
+        text = question.strip().strip("¿?").strip()
+        key = normalize_question(question) or (text,)
+        self._facts.pop(key, None)
+        self._facts[key] = (self._category(answer), text)
+
+    def render(self, max_tokens: int) -> str:
+        """
+        Renders the sheet, dropping the oldest irrelevant topics and then the oldest ruled-out facts
+        while it exceeds `max_tokens`. Confirmed facts are always kept.
+        """
+        entries = {category: [text for kind, text in self._facts.values() if kind == category] for category in FACT_CATEGORIES}
+        while True:
+            lines = [f"Resumen de las {self.turns} preguntas anteriores:"]
+            for category, title in FACT_CATEGORIES.items():
+                if entries[category]:
+                    lines.append(f"{title}:")
+                    lines.extend(f"- {text}" for text in entries[category])
+            sheet = "\n".join(lines)
+            if estimate_tokens(sheet) <= max_tokens:
+                return sheet
+            if entries["irrelevante"]:
+                entries["irrelevante"].pop(0)
+            elif entries["descartado"]:
+                entries["descartado"].pop(0)
+            else:
+                return sheet
+
+def _render_lines(turns: Iterable[Tuple[str, str]], style: str) -> str:
+    line = HISTORY_FORMATS[style][0]
+    return "\n".join(line.format(q=q, a=a) for q, a in turns)
+
+class HistoryRenderer:
+    """
+    Renders a growing Q&A history into its prompt sections. Each style is cached together with the
+    number of turns it covers, so a new render only formats the turns appended since the last one,
+    and repeated renders of an unchanged history (the three Council prompts of a round) are free.
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, Tuple[int, str, str]] = {} # style -> (turns rendered, lines, full section)
+        self._fact_sheets: Dict[ContextBudget, FactSheet] = {} # Sheet of the turns before the recent window
+
+    def render(self, qa_history: List[Tuple[str, str]], style: str) -> str:
+        """
+        Returns the history section in the given style, or "" for an empty history.
+        """
+        rendered, lines, section = self._cache.get(style, (0, "", ""))
+        if rendered == len(qa_history):
+            return section
+        new_lines = _render_lines(qa_history[rendered:], style)
+        lines = f"{lines}\n{new_lines}" if lines else new_lines
+        section = HISTORY_FORMATS[style][1] + lines
+        self._cache[style] = (len(qa_history), lines, section)
+        return section
+
+    def render_within(self, qa_history: List[Tuple[str, str]], style: str, budget: ContextBudget) -> str:
+        """
+        Like `render`, but once the section exceeds the budget the older turns are replaced by a fact sheet,
+        which is also kept incrementally: each turn is filed once, when it leaves the recent window.
+        A history only grows, so once compacted it stays compacted and the full section is no longer built.
+        """
+        sheet = self._fact_sheets.get(budget)
+        if sheet is None:
+            section = self.render(qa_history, style)
+            if estimate_tokens(section) <= budget.max_tokens or len(qa_history) <= budget.recent_turns:
+                return section
+            sheet = self._fact_sheets[budget] = FactSheet()
+
+        for question, answer in qa_history[sheet.turns:len(qa_history) - budget.recent_turns]:
+            sheet.add(question, answer)
+        return _compacted_section(sheet, qa_history[-budget.recent_turns:], style, budget)
+
+    def reset(self) -> None:
+        self._cache.clear()
+        self._fact_sheets.clear()
+
+class QAHistory(list):
+    """
+    The (question, answer) turns of a game. A plain list for every caller, but it owns a
+    HistoryRenderer so prompt builders can reuse the rendered history between calls.
+    Appending keeps the cache; any mutation that can rewrite earlier turns resets it.
+    """
+
+    def __init__(self, turns: Iterable[Tuple[str, str]] = ()):
+        super().__init__(turns)
+        self.renderer = HistoryRenderer()
+
+    def render(self, style: str) -> str:
+        return self.renderer.render(self, style)
+
+    def __setitem__(self, index, value):
+        self.renderer.reset()
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self.renderer.reset()
+        super().__delitem__(index)
+
+    def __imul__(self, times):
+        self.renderer.reset()
+        return super().__imul__(times)
+
+    def insert(self, index, value):
+        self.renderer.reset()
+        super().insert(index, value)
+
+    def pop(self, index=-1):
+        self.renderer.reset()
+        return super().pop(index)
+
+    def remove(self, value):
+        self.renderer.reset()
+        super().remove(value)
+
+    def clear(self):
+        self.renderer.reset()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.renderer.reset()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.renderer.reset()
+        super().reverse()
+
+def _compacted_section(sheet: FactSheet, recent: List[Tuple[str, str]], style: str, budget: ContextBudget) -> str:
+    head = HISTORY_FORMATS[style][1]
+    tail = f"\n\nÚltimas preguntas:\n{_render_lines(recent, style)}"
+    # The sheet gets what the recent turns and the section's own headings leave of the budget
+    sheet_budget = max(budget.max_tokens - estimate_tokens(head + tail), budget.max_tokens // 4)
+    return head + sheet.render(sheet_budget) + tail
+
+def render_history(qa_history: List[Tuple[str, str]], style: str, budget: ContextBudget | None = None) -> str:
+    """
+    Renders a Q&A history section for a prompt, reusing the cached rendering of a QAHistory.
+    Plain lists are rendered from scratch. With a `budget`, long histories are compacted into a
+    fact sheet followed by the most recent turns verbatim.
+    """
+    if isinstance(qa_history, QAHistory):
+        if budget is None:
+            return qa_history.render(style)
+        return qa_history.renderer.render_within(qa_history, style, budget)
+
+    lines = _render_lines(qa_history, style)
+    section = HISTORY_FORMATS[style][1] + lines if lines else ""
+    if budget is None or estimate_tokens(section) <= budget.max_tokens or len(qa_history) <= budget.recent_turns:
+        return section
+    sheet = FactSheet()
+    for question, answer in qa_history[:-budget.recent_turns]:
+        sheet.add(question, answer)
+    return _compacted_section(sheet, qa_history[-budget.recent_turns:], style, budget)
@@ -0,0 +1,96 @@
+import re
+import threading
+import unicodedata
+from typing import Dict, Any, FrozenSet, Tuple
+
+# Spanish function words that do not change what a yes/no question asks
+STOPWORDS = frozenset(
+    """
+    a al algo algun alguna alguno algunos con de del el en era es esta estaba este esto fue ha habia
+    la las le les lo los me mi por que se su sus un una uno unos unas y o acaso verdad
+    """.split()
+)
+
+def normalize_question(question: str) -> Tuple[str, ...]:
+    """
+    Reduces a question to its content words: lowercase, no accents, no punctuation, no stopwords.
+    Word order is kept, since "¿mató el hombre a la mujer?" and "¿mató la mujer al hombre?" differ.
+    """
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    words = re.sub(r"[^\w\s]", " ", text).split()
+    return tuple(word for word in words if word not in STOPWORDS)
+
+def shingles(words: Tuple[str, ...]) -> FrozenSet[Tuple[str, ...]]:
+    """
+    The words of a normalized question and its ordered word pairs. The pairs tell
+    "murió hombre antes mujer" from "murió mujer antes hombre", which share every word.
+    """
+    return frozenset((word,) for word in words) | frozenset(zip(words, words[1:]))
+
+def jaccard(words_a: Tuple[str, ...], words_b: Tuple[str, ...]) -> float:
+    """
+    Jaccard similarity of two normalized questions over their shingles (words and ordered word pairs),
+    so questions with the same words in another order score well below 1.
+    """
+    set_a, set_b = shingles(words_a), shingles(words_b)
+    if not set_a or not set_b:
+        return 0.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+class AnswerCache:
+    """
+    Narrator answers for one story, keyed by the normalized question. A repeated or reworded question
+    gets the cached "sí" / "no" / "no es relevante" without another LLM call.
+    With a `similarity` threshold above 0, a question whose content words and word pairs overlap a cached
+    one by at least that Jaccard similarity is also a hit; at 0 only identical normalized questions match.
+    Word pairs keep order in play, but a swap that changes who did what to whom can still score above a
+    low threshold, which is why the default is 0.
+    """
+
+    def __init__(self, similarity: float = 0.0):
+        self.similarity = similarity
+        self._answers: Dict[Tuple[str, ...], str] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "shared": 0}
+
+    def get(self, question: str) -> str | None:
+        key = normalize_question(question)
+        with self._lock:
+            answer = self._answers.get(key) if key else None
+            if answer is None and key and self.similarity > 0:
+                best = 0.0
+                for cached_key, cached_answer in self._answers.items():
+                    score = jaccard(key, cached_key)
+                    if score >= self.similarity and score > best:
+                        best, answer = score, cached_answer
+            self._stats["hits" if answer is not None else "misses"] += 1
+        return answer
+
+    def put(self, question: str, answer: str) -> None:
+        key = normalize_question(question)
+        if not key:
+            return # A question made only of stopwords is too vague to reuse
+        with self._lock:
+            self._answers[key] = answer
+
+    def count_shared(self) -> None:
+        """
+        Records a miss that was answered by an identical question already in flight.
+        """
+        with self._lock:
+            self._stats["shared"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns hit/miss counters, the hit rate and the number of cached questions.
+        Shared in-flight answers count as hits in the hit rate, since they also saved an LLM call.
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            saved = self._stats["hits"] + self._stats["shared"]
+            return {
+                **self._stats,
+                "size": len(self._answers),
+                "hit_rate": round(saved / lookups, 3) if lookups else 0.0,
+            }
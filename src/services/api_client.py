@@ -1,134 +1,98 @@
-import json
-import http.client
-from typing import Dict, Any, Tuple
+import asyncio
+import concurrent.futures
+from typing import Callable, Coroutine, Dict, Any, AsyncIterator, Generator, List, TypeVar
+
+from src.services.async_api_client import AsyncAPIClient
+from src.services.connection_pool import get_shared_pool
+from src.services.usage import UsageTracker
+from src.utils.background_loop import get_background_loop
+from src.utils.cancellation import CancelToken
+
+T = TypeVar("T")
 
 class APIClient:
     """
-    Generic API client for interacting with LLM providers like Gemini and Ollama.
-    Handles connection errors and retries.
+    Blocking API client for interacting with LLM providers like Gemini and Ollama.
+    A thin wrapper around an AsyncAPIClient (`core`): every call runs on the process-wide background
+    event loop while the calling thread waits, so retries, failover, hedging and streaming have a single
+    implementation. Keep-alive connections are shared by every blocking client (see get_shared_pool).
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], cancel_token: CancelToken | None = None):
         self.config = config
-
-    def _make_request(
-        self,
-        host: str,
-        port: int,
-        path: str,
-        method: str,
-        headers: Dict[str, str],
-        body: str | None = None,
-        use_https: bool = True,
-        timeout: int = 60 # Default timeout of 60 seconds
-    ) -> Tuple[int, str]:
+        self.cancel_token = cancel_token # Cancelled when the game's client disconnects
+        self.background = get_background_loop()
+        self.core = AsyncAPIClient(config, cancel_token, pool=get_shared_pool(
+            max_size=config.get("pool_max_size", 4),
+            idle_timeout=config.get("pool_idle_timeout", 30.0),
+        ))
+
+    @property
+    def call_log(self) -> List[Dict[str, Any]]:
+        return self.core.call_log
+
+    @property
+    def usage(self) -> UsageTracker:
+        return self.core.usage
+
+    @property
+    def prompt_cache_stats(self) -> Dict[str, int]:
+        return self.core.prompt_cache_stats
+
+    def _check_cancelled(self) -> None:
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
         """
-        Makes an HTTP/HTTPS request to the specified host and returns the status and response.
+        Runs a coroutine (of `core` or of a service built on it) on the background loop and waits for its result.
+        Cancelling the game's token cancels it and raises GameCancelled.
         """
-        conn = None
         try:
-            print(f"DEBUG: _make_request - Connecting to {host}:{port} (HTTPS: {use_https}, Timeout: {timeout})...")
-            if use_https:
-                conn = http.client.HTTPSConnection(host, port, timeout=timeout)
-            else:
-                conn = http.client.HTTPConnection(host, port, timeout=timeout)
-
-            print(f"DEBUG: _make_request - Sending {method} request to {path}...")
-            conn.request(method, path, body, headers)
-            print(f"DEBUG: _make_request - Request sent. Waiting for response...")
-            response = conn.getresponse()
-            print(f"DEBUG: _make_request - Received response. Status: {response.status}")
-            return response.status, response.read().decode('utf-8')
-        except http.client.Timeout as e:
-            print(f"ERROR: _make_request - Timeout occurred: {e}")
-            raise ConnectionError(f"Timeout de conexión o lectura con {host}: {e}")
-        except Exception as e:
-            print(f"ERROR: _make_request - General connection error: {e}")
-            raise ConnectionError(f"Error de conexión con {host}: {e}")
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.background.loop:
+            coroutine.close()
+            raise RuntimeError("APIClient no puede usarse desde el bucle de eventos en segundo plano; usa su AsyncAPIClient (core).")
+
+        future = self.background.submit(coroutine)
+        unlink = self.cancel_token.on_cancel(future.cancel) if self.cancel_token is not None else None
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            self._check_cancelled()
+            raise
         finally:
-            if conn:
-                print(f"DEBUG: _make_request - Closing connection.")
-                conn.close()
+            future.cancel() # No-op once done; otherwise the caller is gone (e.g. KeyboardInterrupt) and so is the call
+            if unlink is not None:
+                unlink()
 
-    def _call_gemini_api(self, model: str, prompt: str) -> str:
+    def iterate(self, stream: AsyncIterator[T], name: str | None = None) -> Generator[T, None, None]:
         """
-        Calls the Gemini API to generate content.
+        Runs an async generator (of `core` or of a game built on it) on the background loop and yields
+        its items to the calling thread (see BackgroundLoop.iterate). If the game's token is cancelled,
+        the generator is stopped and GameCancelled raised.
         """
-        print(f"DEBUG: _call_gemini_api - Calling Gemini API for model: {model}")
-        api_key = self.config.get("gemini_api_key")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY no configurada para Gemini.")
-
-        host = "generativelanguage.googleapis.com"
-        path = f"/v1beta/models/{model}:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-            "x-goog-api-key": api_key,
-        }
-        body = json.dumps({"contents": [{"parts": [{"text": prompt}]}]})
-        
-        # Get timeout from config, with a default of 60 seconds
-        api_timeout = self.config.get("api_timeout", 60) 
-
-        status, response_text = self._make_request(host, 443, path, "POST", headers, body, use_https=True, timeout=api_timeout)
-
-        if status == 200:
-            response_data = json.loads(response_text)
-            return response_data["candidates"][0]["content"]["parts"][0]["text"]
-        else:
-            raise Exception(f"Error en la API de Gemini (Status: {status}): {response_text}")
+        yield from self.background.iterate(stream, name, self.cancel_token)
+        self._check_cancelled()
 
-    def _call_ollama_api(self, model: str, prompt: str) -> str:
+    def generate_text(self, provider_model: str, prompt: str, response_schema: Dict[str, Any] | None = None, prefix: str | None = None, role: str | None = None, parse: Callable[[str], Any] | None = None) -> Any:
         """
-        Calls the Ollama API to generate content.
+        Generates text using the specified LLM provider and model, blocking until the reply arrives.
+        See `AsyncAPIClient.generate_text` for the arguments, retries, failover and hedging.
         """
-        print(f"DEBUG: _call_ollama_api - Calling Ollama API for model: {model}")
-        ollama_host = self.config.get("ollama_host")
-        if not ollama_host:
-            raise ValueError("OLLAMA_HOST no configurada para Ollama.")
+        return self.run(self.core.generate_text(provider_model, prompt, response_schema, prefix, role, parse))
 
-        # Parse host and port from ollama_host
-        # Assuming ollama_host is like http://localhost:11434
-        if "://" in ollama_host:
-            protocol, rest = ollama_host.split("://", 1)
-            host_port = rest.split("/", 1)[0]
-        else:
-            host_port = ollama_host.split("/", 1)[0]
-            protocol = "http" # Default to http if no protocol specified
-
-        host, port_str = (host_port.split(":") + ["80"])[:2] # Default port 80 if not specified
-        port = int(port_str)
-        use_https = (protocol == "https")
-
-        path = "/api/generate"
-        headers = {"Content-Type": "application/json"}
-        body = json.dumps({
-            "model": model,
-            "prompt": prompt,
-            "stream": False
-        })
-        
-        # Get timeout from config, with a default of 60 seconds
-        api_timeout = self.config.get("api_timeout", 60)
-
-        status, response_text = self._make_request(host, port, path, "POST", headers, body, use_https=use_https, timeout=api_timeout)
-
-        if status == 200:
-            response_data = json.loads(response_text)
-            return response_data["response"]
-        else:
-            raise Exception(f"Error en la API de Ollama (Status: {status}): {response_text}")
-
-    def generate_text(self, provider_model: str, prompt: str) -> str:
+    def stream_text(self, provider_model: str, prompt: str, response_schema: Dict[str, Any] | None = None, role: str | None = None) -> Generator[str, None, None]:
         """
-        Generates text using the specified LLM provider and model.
-        provider_model format: "provider:model_name" (e.g., "gemini:gemini-2.0-flash")
+        Generates text like `generate_text`, but yields it in chunks as the model produces them
+        (see `AsyncAPIClient.stream_text`).
         """
-        provider, model = provider_model.split(":", 1)
+        yield from self.iterate(self.core.stream_text(provider_model, prompt, response_schema, role))
 
-        if provider.lower() == "gemini":
-            return self._call_gemini_api(model, prompt)
-        elif provider.lower() == "ollama":
-            return self._call_ollama_api(model, prompt)
-        else:
-            raise ValueError(f"Proveedor de LLM no soportado: {provider}")
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Returns the shared connection pool counters (new vs. reused connections, evictions, ...).
+        """
+        return self.core.connection_stats()
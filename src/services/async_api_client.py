@@ -0,0 +1,521 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Any, AsyncGenerator, List, Tuple
+
+from src.services.base_api_client import BaseAPIClient, ProviderRequest
+from src.services.connection_pool import ConnectionPool
+from src.services.hedging import SUPERSEDED, HedgeAttempt, current_attempt
+from src.services.prompt_cache import estimate_tokens
+from src.services.rate_limiter import RateLimitError
+from src.services.retry import CircuitBreaker, ProviderTimeout
+from src.services.mock_llm import MockResponder
+from src.services.usage import estimate_usage
+from src.utils.cancellation import CancelToken
+from src.utils.tracing import span
+from src.utils.metrics import HEDGED, RETRIES
+
+logger = logging.getLogger(__name__)
+
+class StaleConnectionError(ConnectionError):
+    """
+    Raised when a pooled keep-alive socket turns out to have been closed by the server.
+    """
+
+class AsyncAPIClient(BaseAPIClient):
+    """
+    Generic API client for interacting with LLM providers like Gemini and Ollama, without blocking
+    the event loop. Speaks HTTP/1.1 over non-blocking sockets (asyncio streams), so a single event loop
+    can keep hundreds of LLM calls in flight without a thread per call. Handles retries, failover and
+    hedging, and reuses keep-alive connections across calls. APIClient runs it for blocking callers.
+    """
+
+    def __init__(self, config: Dict[str, Any], cancel_token: CancelToken | None = None, pool: ConnectionPool | None = None):
+        super().__init__(config)
+        self.cancel_token = cancel_token # The game's token: cancelling it aborts both requests of a hedged call
+        # asyncio sockets belong to the loop that opened them: a client gets its own pool unless it is given one of the same loop
+        self.pool = pool or ConnectionPool(max_size=config.get("pool_max_size", 4), idle_timeout=config.get("pool_idle_timeout", 30.0))
+        self._owns_pool = pool is None
+
+    @staticmethod
+    def _endpoint(request: ProviderRequest) -> Tuple[str, str, int]:
+        return "https" if request.use_https else "http", request.host, request.port
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bool]:
+        """
+        Reads the status line and headers. Returns (status, lowercase headers, keep_alive).
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise StaleConnectionError("El servidor cerró la conexión.")
+        version, status, _ = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return int(status), headers, keep_alive
+
+    @staticmethod
+    async def _iter_body(reader: asyncio.StreamReader, headers: Dict[str, str], timeout: float) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the raw response body as it arrives (chunked, Content-Length or read-until-close).
+        """
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), timeout)
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Skip optional trailers up to the final blank line
+                    while (await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                data = await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+                yield data[:-2]
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                data = await asyncio.wait_for(reader.read(min(remaining, 65536)), timeout)
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await asyncio.wait_for(reader.read(65536), timeout)
+                if not data:
+                    return
+                yield data
+
+    async def _send_request(self, request: ProviderRequest) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, int, Dict[str, str], bool]:
+        """
+        Sends a POST over a pooled connection and returns it with the parsed response head.
+        A request that hits a stale pooled socket is replayed once on a fresh connection.
+        """
+        body = request.body.encode("utf-8")
+        head_lines = [
+            f"POST {request.path} HTTP/1.1",
+            f"Host: {request.host}",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive",
+            "Accept-Encoding: identity",
+        ] + [f"{name}: {value}" for name, value in request.headers.items()]
+        payload = ("\r\n".join(head_lines) + "\r\n\r\n").encode("latin-1") + body
+
+        for attempt in range(2):
+            writer = None
+            reused = False
+            try:
+                with span("http.connect", "http", host=request.host, port=request.port) as connecting:
+                    reader, writer, reused = await self.pool.acquire(*self._endpoint(request), request.timeout)
+                    connecting.set(reused=reused)
+                logger.debug("%s connection to %s:%s", "Reusing" if reused else "Opened", request.host, request.port)
+                with span("http.send", "http", path=request.path, reused=reused):
+                    writer.write(payload)
+                    await writer.drain()
+                with span("http.first_byte", "http") as waiting:
+                    status, headers, keep_alive = await asyncio.wait_for(self._read_head(reader), request.timeout)
+                    waiting.set(status=status)
+                request.retry_after_header = headers.get("retry-after")
+                return reader, writer, status, headers, keep_alive
+            except (StaleConnectionError, ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError) as e:
+                if writer is not None:
+                    self.pool.discard(writer)
+                if reused and attempt == 0:
+                    self.pool.record_stale_retry()
+                    RETRIES.inc(reason="stale_connection")
+                    continue
+                raise ConnectionError(f"Error de conexión con {request.host}: {e}")
+            except asyncio.TimeoutError as e:
+                if writer is not None:
+                    self.pool.discard(writer)
+                raise ProviderTimeout(f"Timeout de conexión o lectura con {request.host}: {e}")
+            except OSError as e:
+                if writer is not None:
+                    self.pool.discard(writer)
+                raise ConnectionError(f"Error de conexión con {request.host}: {e}")
+            except asyncio.CancelledError:
+                # The game was cancelled mid-request: drop the connection so the provider stops working on it
+                if writer is not None:
+                    self.pool.discard(writer)
+                raise
+
+        raise ConnectionError(f"Error de conexión con {request.host}: no se pudo reconectar.")
+
+    async def _make_request(self, request: ProviderRequest) -> Tuple[int, str]:
+        """
+        Makes the request and returns the status and the full decoded response body.
+        """
+        reader, writer, status, headers, keep_alive = await self._send_request(request)
+        chunks: List[bytes] = []
+        try:
+            with span("http.read", "http"):
+                async for data in self._iter_body(reader, headers, request.timeout):
+                    chunks.append(data)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError, ValueError) as e:
+            self.pool.discard(writer)
+            raise ConnectionError(f"Error de lectura con {request.host}: {e}")
+        except asyncio.CancelledError:
+            self.pool.discard(writer)
+            raise
+
+        if keep_alive and ("content-length" in headers or "transfer-encoding" in headers):
+            self.pool.release(*self._endpoint(request), reader, writer)
+        else:
+            self.pool.discard(writer)
+        return status, b"".join(chunks).decode("utf-8")
+
+    async def _stream_request(self, request: ProviderRequest) -> AsyncGenerator[Tuple[int, str], None]:
+        """
+        Makes the request and yields (status, line) pairs as the response body arrives.
+        """
+        reader, writer, status, headers, keep_alive = await self._send_request(request)
+        completed = False
+        buffer = b""
+        try:
+            with span("http.read", "http", stream=True):
+                async for data in self._iter_body(reader, headers, request.timeout):
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        yield status, line.decode("utf-8").rstrip("\r")
+                if buffer:
+                    yield status, buffer.decode("utf-8").rstrip("\r")
+            completed = True
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError, ValueError) as e:
+            raise ConnectionError(f"Error de lectura con {request.host}: {e}")
+        finally:
+            if completed and keep_alive and ("content-length" in headers or "transfer-encoding" in headers):
+                self.pool.release(*self._endpoint(request), reader, writer)
+            else:
+                self.pool.discard(writer)
+
+    async def _replay_completion(self, provider_model: str, prompt: str) -> str:
+        response, _, delay = self._replay(provider_model, prompt)
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    async def _replay_chunks(self, provider_model: str, prompt: str) -> AsyncGenerator[str, None]:
+        _, chunks, delay = self._replay(provider_model, prompt)
+        if delay:
+            await asyncio.sleep(delay)
+        for chunk in chunks:
+            yield chunk
+
+    async def _mock_chunks(self, model: str, prompt: str, response_schema: Dict[str, Any] | None = None) -> AsyncGenerator[str, None]:
+        for chunk in MockResponder.split_chunks(await self._mock_completion(model, prompt, response_schema)):
+            yield chunk
+
+    async def _gemini_cached_content(self, model: str, prefix: str) -> str | None:
+        """
+        Returns the Gemini cache holding `prefix`, creating it on first use when the prefix is large enough.
+        """
+        name = self.gemini_caches.get(model, prefix)
+        if name is None and self._wants_gemini_cache(model, prefix):
+            try:
+                status, response_text = await self._make_request(self._cache_request(model, prefix))
+            except ConnectionError as e:
+                logger.warning("Gemini cache creation failed: %s", e)
+                return None
+            name = self._parse_cache_response(model, prefix, status, response_text)
+        return name
+
+    async def _provider_completion(self, provider: str, model: str, prompt: str, response_schema: Dict[str, Any] | None, prefix: str | None, usage: Dict[str, Any]) -> str:
+        """
+        Gets a non-streamed completion from Gemini or Ollama, serving a Gemini prefix from its cache when possible.
+        The usage the provider reports is stored in `usage`.
+        """
+        cached_content = await self._gemini_cached_content(model, prefix) if provider == "gemini" and prefix else None
+        request = self._build_request(provider, model, prompt, False, response_schema, prefix, cached_content)
+        status, response_text = await self._make_request(request)
+        if status != 200 and cached_content:
+            # The cache expired or was deleted on the server: forget it and send the whole prompt
+            self.gemini_caches.discard(model, prefix)
+            request = self._build_request(provider, model, prompt, False, response_schema, prefix)
+            status, response_text = await self._make_request(request)
+        return self._parse_completion(request, status, response_text, usage)
+
+    async def _provider_chunks(self, provider: str, model: str, prompt: str, response_schema: Dict[str, Any] | None = None, usage: Dict[str, Any] | None = None) -> AsyncGenerator[str, None]:
+        """
+        Streams a completion from Gemini or Ollama, yielding the text of each streamed line.
+        The usage the provider reports is stored in `usage`.
+        """
+        request = self._build_request(provider, model, prompt, stream=True, response_schema=response_schema)
+        status = 200
+        error_lines: List[str] = []
+        async for status, line in self._stream_request(request):
+            if status != 200:
+                error_lines.append(line)
+                continue
+            chunk = self._parse_stream_line(request, line, usage)
+            if chunk:
+                yield chunk
+
+        if error_lines:
+            raise self._stream_error(request, status, error_lines)
+
+    async def generate_text(self, provider_model: str, prompt: str, response_schema: Dict[str, Any] | None = None, prefix: str | None = None, role: str | None = None, parse: Callable[[str], Any] | None = None) -> Any:
+        """
+        Generates text using the specified LLM provider and model.
+        provider_model format: "provider:model_name" (e.g., "gemini:gemini-2.0-flash")
+        `response_schema` (a JSON Schema) constrains the reply to JSON of that shape.
+        `prefix` is a part of the prompt that stays the same across calls (instructions and story); it is
+        sent in front of `prompt` and lets the provider reuse its processing (Gemini cachedContents, Ollama prompt cache).
+        `role` (one of usage.ROLES) attributes the call's tokens, timings and cost in the usage totals.
+        With `parse`, the reply is passed through it and its result returned; a reply it rejects
+        (ParseError) is retried like a transient error.
+        Timeouts, dropped connections, 429 and 5xx responses are retried with backoff (see RetryPolicy)
+        unless the endpoint's circuit breaker is open. With fallbacks configured for the model or role
+        (MODEL_FALLBACKS), retries go round the backends in order, and a call slower than the hedge delay
+        of its backend is duplicated to the next one (see Hedger).
+        """
+        response_schema = self._response_schema(response_schema)
+        prompt, prefix = self._split_prefix(prompt, prefix)
+        backends = self._backends(provider_model, role)
+        attempt = 0
+        while True:
+            backend, breaker = self._choose_backend(backends, attempt, role)
+            try:
+                delay = self._hedge_delay(backends, backend)
+                if delay is None:
+                    return await self._call_backend(backend, breaker, prompt, response_schema, prefix, role, parse)
+                return await self._race(backends, backend, breaker, delay, prompt, response_schema, prefix, role, parse)
+            except Exception as e:
+                delay = self._retry_delay(backend, attempt, e, failover=self._fails_over(backends, attempt))
+                if delay is None:
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _call_backend(self, backend: str, breaker: CircuitBreaker, prompt: str, response_schema: Dict[str, Any] | None, prefix: str | None, role: str | None, parse: Callable[[str], Any] | None) -> Any:
+        """
+        One attempt of `generate_text` on `backend`, reported to its circuit breaker.
+        """
+        provider, model = self._split_provider_model(backend)
+        try:
+            text = await self._generate_once(backend, provider, model, prompt, response_schema, prefix, role)
+            result = text if parse is None else parse(text)
+        except BaseException as e:
+            self._report(breaker, e)
+            raise
+        self._report(breaker)
+        return result
+
+    async def _run_attempt(self, attempt: HedgeAttempt, backend: str, breaker: CircuitBreaker, *args: Any) -> Any:
+        current_attempt.set(attempt) # Only in this task's copy of the context
+        return await self._call_backend(backend, breaker, *args)
+
+    def _start_attempt(self, attempt: HedgeAttempt, backend: str, breaker: CircuitBreaker, *args: Any) -> asyncio.Task:
+        """
+        Runs one request of a hedged call as a task that is cancelled along with the attempt's token.
+        The token may be cancelled from another thread (the game's), hence call_soon_threadsafe.
+        """
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(self._run_attempt(attempt, backend, breaker, *args))
+        attempt.token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        return task
+
+    async def _race(self, backends: List[str], backend: str, breaker: CircuitBreaker, delay: float, *args: Any) -> Any:
+        """
+        Runs `_call_backend(backend, breaker, *args)` as a task. If it is still running after `delay` seconds,
+        the same call is sent to another backend (see _hedge_backend) in a second task. The first valid reply
+        is returned and the other task cancelled; if both fail, the first one's error is raised.
+        Both follow the game's cancel token.
+        """
+        attempt = HedgeAttempt(self.cancel_token)
+        primary = self._start_attempt(attempt, backend, breaker, *args)
+        attempts = {primary: attempt}
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                hedged = self._hedge_backend(backends, backend)
+                if hedged is not None:
+                    attempt = HedgeAttempt(self.cancel_token)
+                    hedge = self._start_attempt(attempt, *hedged, *args)
+                    attempts[hedge] = attempt
+                    pending.add(hedge)
+            winner: asyncio.Future | None = None
+            while winner is None and pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and winner is None:
+                        winner = task
+            if len(attempts) > 1:
+                HEDGED.inc(winner="none" if winner is None else "primary" if winner is primary else "hedge")
+                if winner is not None and winner is not primary:
+                    self.hedger.record_win()
+            if winner is None:
+                if self.cancel_token is not None:
+                    self.cancel_token.raise_if_cancelled()
+                return primary.result() # Raises the error of the first request
+            for task in pending:
+                attempts[task].token.cancel(SUPERSEDED)
+            return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            for attempt in attempts.values():
+                attempt.close()
+
+    async def _generate_once(self, provider_model: str, provider: str, model: str, prompt: str, response_schema: Dict[str, Any] | None, prefix: str | None, role: str | None) -> str:
+        """
+        One attempt of `generate_text`.
+        """
+        full_prompt = (prefix or "") + prompt
+        logger.debug("Calling %s API for model %s", self._provider_label(provider), model)
+        with span("llm.generate", "llm", model=provider_model, role=role) as call:
+            started = time.monotonic()
+            ok = False
+            cancelled = superseded = False
+            usage: Dict[str, Any] = {}
+            try:
+                if self.cassette is not None and self.cassette.replaying:
+                    text = await self._replay_completion(provider_model, full_prompt)
+                else:
+                    if prefix:
+                        self._note_prefix(provider, provider_model, prefix)
+                    ticket = await self.limiter.acquire_async(provider_model, estimate_tokens(full_prompt), self.priority, self.session)
+                    started = time.monotonic() # The latency metrics leave out the wait for admission
+                    try:
+                        if provider == "mock":
+                            text = await self._mock_completion(model, full_prompt, response_schema)
+                        else:
+                            text = await self._provider_completion(provider, model, prompt, response_schema, prefix, usage)
+                    except RateLimitError as e:
+                        self._rate_limited(provider_model, e)
+                        raise
+                    finally:
+                        ticket.release(self._used_tokens(usage))
+                ok = True
+                self.hedger.observe(provider_model, time.monotonic() - started)
+                if not usage:
+                    usage = estimate_usage(full_prompt, text)
+                if self.cassette is not None and self.cassette.recording:
+                    self.cassette.record(provider_model, full_prompt, text, time.monotonic() - started)
+                return text
+            except asyncio.CancelledError:
+                cancelled = True
+                attempt = current_attempt.get()
+                superseded = attempt is not None and attempt.superseded
+                raise
+            finally:
+                self._record_call(provider_model, started, ok, role, usage, cancelled, superseded)
+                call.set(ok=ok, prompt_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+    async def stream_text(self, provider_model: str, prompt: str, response_schema: Dict[str, Any] | None = None, role: str | None = None) -> AsyncGenerator[str, None]:
+        """
+        Generates text like `generate_text`, but yields it in chunks as the model produces them.
+        With `stream_responses` disabled in the config, the whole completion is yielded as one chunk.
+        A failed attempt is only retried, or failed over to a fallback backend, if it had not yielded anything yet.
+        Streams are not hedged: the reader would see the text of both requests.
+        """
+        if not self.config.get("stream_responses", True):
+            yield await self.generate_text(provider_model, prompt, response_schema, role=role)
+            return
+
+        response_schema = self._response_schema(response_schema)
+        backends = self._backends(provider_model, role)
+        attempt = 0
+        while True:
+            backend, breaker = self._choose_backend(backends, attempt, role)
+            provider, model = self._split_provider_model(backend)
+            streaming = False
+            source = self._stream_once(backend, provider, model, prompt, response_schema, role)
+            try:
+                async for chunk in source:
+                    streaming = True
+                    yield chunk
+            except Exception as e:
+                self._report(breaker, e)
+                # Once text has reached the caller the call cannot be replayed transparently
+                delay = self._retry_delay(backend, attempt, e, can_retry=not streaming, failover=self._fails_over(backends, attempt))
+                if delay is None:
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException as e:
+                self._report(breaker, e)
+                raise
+            else:
+                self._report(breaker)
+                return
+            finally:
+                await source.aclose()
+
+    async def _stream_once(self, provider_model: str, provider: str, model: str, prompt: str, response_schema: Dict[str, Any] | None, role: str | None) -> AsyncGenerator[str, None]:
+        """
+        One attempt of `stream_text`.
+        """
+        logger.debug("Streaming %s API for model %s", self._provider_label(provider), model)
+        with span("llm.stream", "llm", model=provider_model, role=role) as call:
+            started = time.monotonic()
+            ok = False
+            cancelled = False
+            chunks: List[str] = []
+            usage: Dict[str, Any] = {}
+            try:
+                if self.cassette is not None and self.cassette.replaying:
+                    async for chunk in self._replay_chunks(provider_model, prompt):
+                        chunks.append(chunk)
+                        yield chunk
+                else:
+                    ticket = await self.limiter.acquire_async(provider_model, estimate_tokens(prompt), self.priority, self.session)
+                    started = time.monotonic()
+                    try:
+                        if provider == "mock":
+                            source = self._mock_chunks(model, prompt, response_schema)
+                        else:
+                            source = self._provider_chunks(provider, model, prompt, response_schema, usage)
+                        async for chunk in source:
+                            chunks.append(chunk)
+                            yield chunk
+                    except RateLimitError as e:
+                        self._rate_limited(provider_model, e)
+                        raise
+                    finally:
+                        ticket.release(self._used_tokens(usage))
+                ok = True
+                if not usage:
+                    usage = estimate_usage(prompt, "".join(chunks))
+                if self.cassette is not None and self.cassette.recording:
+                    self.cassette.record(provider_model, prompt, "".join(chunks), time.monotonic() - started, chunks)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                self._record_call(provider_model, started, ok, role, usage, cancelled)
+                call.set(ok=ok, prompt_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+    async def _mock_completion(self, model: str, prompt: str, response_schema: Dict[str, Any] | None = None) -> str:
+        """
+        Answers a "mock:" model in-process, after the simulated latency.
+        """
+        mock = self._mock_responder()
+        await asyncio.sleep(mock.sample_delay())
+        if mock.should_fail():
+            raise self._mock_error(model)
+        return mock.respond(model, prompt, response_schema)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Returns the counters of this client's connection pool (new vs. reused connections, evictions, ...).
+        """
+        return self.pool.get_stats()
+
+    async def aclose(self) -> None:
+        """
+        Closes every idle connection of the client's own pool (a shared one outlives it).
+        Call it before the owning event loop shuts down.
+        """
+        if self._owns_pool:
+            self.pool.close_all()
@@ -0,0 +1,533 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Set, Tuple
+
+from src.services.mock_llm import MockResponder
+from src.services.cassette import Cassette, get_cassette
+from src.services.prompt_cache import estimate_tokens, get_gemini_cache_registry
+from src.utils.tracing import configure_tracing
+from src.utils.metrics import CANCELLED, FAILOVERS, LLM_CALLS, LLM_LATENCY, LLM_TOKENS, RATE_LIMITED, RETRIES
+from src.services.hedging import get_hedger, parse_fallbacks
+from src.services.rate_limiter import RateLimitError, get_rate_limiter, parse_retry_after
+from src.services.retry import BREAKER_FAILURES, CircuitBreaker, CircuitOpenError, ParseError, ProviderError, RetryPolicy, classify_error, get_circuit_breakers
+from src.services.usage import UsageTracker, call_cost, extract_usage, get_usage_tracker, parse_prices
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_PROVIDERS = ("gemini", "ollama", "mock")
+
+@dataclass
+class ProviderRequest:
+    """
+    A fully built HTTP request to an LLM provider, independent of the transport that sends it.
+    """
+    provider: str
+    model: str
+    host: str
+    port: int
+    path: str
+    headers: Dict[str, str]
+    body: str
+    use_https: bool
+    timeout: int
+    retry_after_header: str | None = None # Retry-After of the response, set by the transport
+
+class BaseAPIClient:
+    """
+    The transport-independent half of an LLM client: builds Gemini/Ollama requests, parses their
+    (streamed) responses, and decides retries, failover and hedging. AsyncAPIClient sends the requests.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.call_log: List[Dict[str, Any]] = [] # One entry per generate/stream call, see _record_call
+        self._mock: MockResponder | None = None # Answers "mock:" models in-process, created on first use
+        self.cassette: Cassette | None = get_cassette(config) # Records or replays every call when enabled
+        configure_tracing(config) # Starts the process-wide tracer on first use when TRACE_PATH is set
+        self.gemini_caches = get_gemini_cache_registry()
+        self.prompt_cache_stats: Dict[str, int] = {"prefixed_calls": 0, "saved_tokens": 0, "caches_created": 0}
+        self._warm_prefixes: Set[Tuple[str, str]] = set() # (provider_model, prefix) already sent by this client
+        self.usage = UsageTracker() # Tokens, timings and cost of this client's calls, per role and model
+        self.prices = parse_prices(config.get("model_prices", ""))
+        self.limiter = get_rate_limiter(config) # Admission control shared by every game of the process
+        self.priority: str = config.get("llm_priority", "background") # Admission class of this client's calls, see rate_limiter.PRIORITIES
+        self.session: str = config.get("llm_session") or f"client-{id(self)}" # Calls of one session take turns with other sessions'
+        self.retry_policy = RetryPolicy.from_config(config)
+        self.breakers = get_circuit_breakers(config) # One per endpoint, shared by every client of the process
+        self.fallbacks = parse_fallbacks(config.get("model_fallbacks", "")) # Backends to fail over to, per model or role
+        self.hedger = get_hedger(config) # Decides when a slow call is duplicated to a fallback backend
+
+    def _record_call(self, provider_model: str, started: float, ok: bool, role: str | None = None, usage: Dict[str, Any] | None = None, cancelled: bool = False, superseded: bool = False) -> None:
+        """
+        Logs one LLM call: its wall-clock latency, measured from `started` (a time.monotonic() value),
+        and the tokens and timings in `usage`. The call is added to this client's and the process-wide usage totals
+        and to the /metrics counters. A `cancelled` call was aborted because its game's client went away,
+        or, if `superseded`, because the other request of a hedged call answered first.
+        """
+        latency = time.monotonic() - started
+        usage = dict(usage or {})
+        usage["cost"] = call_cost(self.prices, provider_model, usage)
+        self.call_log.append({
+            "provider_model": provider_model,
+            "role": role,
+            "latency": round(latency, 4),
+            "ok": ok,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "provider_time": round(usage.get("provider_time", 0.0), 4),
+            "load_time": round(usage.get("load_time", 0.0), 4),
+            "estimated": usage.get("estimated", False),
+            "cancelled": cancelled,
+            "superseded": superseded,
+        })
+        self.usage.record(role, provider_model, usage, latency, ok)
+        if cancelled and not superseded:
+            CANCELLED.inc(kind="llm_call")
+        get_usage_tracker().record(role, provider_model, usage, latency, ok)
+
+        provider, _, model = provider_model.partition(":")
+        LLM_CALLS.inc(provider=provider, model=model, role=role or "other", outcome="superseded" if superseded else "cancelled" if cancelled else "ok" if ok else "error")
+        LLM_LATENCY.observe(latency, provider=provider, model=model, role=role or "other")
+        LLM_TOKENS.inc(usage.get("prompt_tokens", 0), provider=provider, model=model, direction="prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), provider=provider, model=model, direction="output")
+
+    def _rate_limited(self, provider_model: str, error: RateLimitError) -> None:
+        """
+        Counts a 429 and holds back every call to the provider for the wait it asked for.
+        """
+        provider, _, model = provider_model.partition(":")
+        RATE_LIMITED.inc(provider=provider, model=model)
+        self.limiter.pause(provider_model, error.retry_after)
+
+    @staticmethod
+    def _report(breaker: CircuitBreaker, error: BaseException | None = None) -> None:
+        """
+        Tells an endpoint's circuit breaker how a call to it went: `error` is what it raised, None if it succeeded.
+        """
+        if error is None:
+            breaker.record_success()
+        elif classify_error(error) in BREAKER_FAILURES:
+            breaker.record_failure()
+        elif isinstance(error, (ProviderError, ParseError)):
+            breaker.record_success() # The endpoint answered, even if not with what was wanted
+        else:
+            breaker.release_trial()
+
+    def _retry_delay(self, provider_model: str, attempt: int, error: Exception, can_retry: bool = True, failover: bool = False) -> float | None:
+        """
+        Returns how long to wait before trying a failed call again, or None if the error is not worth
+        retrying (see classify_error) or the attempts are used up. With `failover` the next attempt goes
+        to another backend, which is tried at once, whatever the failed one asked to wait.
+        """
+        kind = classify_error(error)
+        if not can_retry:
+            return None
+        if failover:
+            delay = 0.0 if kind is not None and attempt + 1 < self.retry_policy.max_attempts else None
+        else:
+            delay = self.retry_policy.delay(kind, attempt, getattr(error, "retry_after", None))
+        if delay is not None:
+            RETRIES.inc(reason=kind)
+            logger.info("Retrying %s in %.2fs after a %s error (attempt %d/%d): %s", "on another backend" if failover else provider_model, delay, kind, attempt + 1, self.retry_policy.max_attempts, error)
+        return delay
+
+    def _backends(self, provider_model: str, role: str | None) -> List[str]:
+        """
+        The backends a call may use, in order: its own model, then the fallbacks configured for that model,
+        or else for its role (see parse_fallbacks).
+        """
+        fallbacks = self.fallbacks.get(provider_model) or self.fallbacks.get(role or "") or []
+        backends = [provider_model] + [backend for backend in fallbacks if backend != provider_model]
+        for backend in backends:
+            self._split_provider_model(backend)
+        return backends
+
+    def _choose_backend(self, backends: List[str], attempt: int, role: str | None) -> Tuple[str, CircuitBreaker]:
+        """
+        The backend for attempt number `attempt` of a call and its circuit breaker. Attempts go round the
+        backends in order, skipping those whose circuit is open; if every circuit is open, the last
+        CircuitOpenError is raised.
+        """
+        error: CircuitOpenError | None = None
+        for offset in range(len(backends)):
+            backend = backends[(attempt + offset) % len(backends)]
+            breaker = self.breakers.get(backend)
+            try:
+                breaker.allow()
+            except CircuitOpenError as e:
+                error = e
+                continue
+            if backend != backends[0]:
+                FAILOVERS.inc(role=role or "other")
+            return backend, breaker
+        raise error
+
+    @staticmethod
+    def _fails_over(backends: List[str], attempt: int) -> bool:
+        """
+        Whether the attempt after `attempt` goes to another backend rather than back round to the first one.
+        """
+        return (attempt + 1) % len(backends) != 0
+
+    def _hedge_delay(self, backends: List[str], backend: str) -> float | None:
+        """
+        Seconds after which a call to `backend` is duplicated to another backend, None if it is not hedged:
+        there is no other backend, hedging is disabled, or a cassette is recording or replaying the calls in order.
+        """
+        if len(backends) < 2 or self.cassette is not None:
+            return None
+        return self.hedger.start(backend)
+
+    def _hedge_backend(self, backends: List[str], primary: str) -> Tuple[str, CircuitBreaker] | None:
+        """
+        The backend a slow call to `primary` is duplicated to: the next one whose circuit is not open.
+        None if there is none or the hedge budget is spent.
+        """
+        start = backends.index(primary)
+        for offset in range(1, len(backends)):
+            backend = backends[(start + offset) % len(backends)]
+            breaker = self.breakers.get(backend)
+            try:
+                breaker.allow()
+            except CircuitOpenError:
+                continue
+            if not self.hedger.try_hedge():
+                breaker.release_trial()
+                return None
+            logger.info("Hedging a slow call to %s with %s", primary, backend)
+            return backend, breaker
+        return None
+
+    @staticmethod
+    def _split_host(model: str) -> Tuple[str, str | None]:
+        """
+        Splits "model@base URL" (a backend on another host, see parse_fallbacks) into the model and the URL.
+        """
+        model, _, base_url = model.partition("@")
+        return model, base_url or None
+
+    @staticmethod
+    def _used_tokens(usage: Dict[str, Any]) -> int | None:
+        """
+        Tokens a call really used, charged to the rate limiter in place of its estimate (None if unknown).
+        """
+        if not usage:
+            return None
+        return usage.get("prompt_tokens", 0) + usage.get("output_tokens", 0)
+
+    def _split_provider_model(self, provider_model: str) -> Tuple[str, str]:
+        """
+        Splits "provider:model_name" and checks the provider is supported.
+        """
+        provider, model = provider_model.split(":", 1)
+        provider = provider.lower()
+        if provider not in SUPPORTED_PROVIDERS:
+            raise ValueError(f"Proveedor de LLM no soportado: {provider}")
+        return provider, model
+
+    @staticmethod
+    def _parse_base_url(url: str, default_port: int) -> Tuple[str, int, bool]:
+        """
+        Returns (host, port, use_https) parsed from a base URL like http://localhost:11434.
+        """
+        if "://" in url:
+            protocol, rest = url.split("://", 1)
+            host_port = rest.split("/", 1)[0]
+        else:
+            host_port = url.split("/", 1)[0]
+            protocol = "http" # Default to http if no protocol specified
+
+        host, port_str = (host_port.split(":") + [str(default_port)])[:2]
+        return host, int(port_str), protocol == "https"
+
+    def _ollama_endpoint(self, base_url: str | None = None) -> Tuple[str, int, bool]:
+        """
+        Returns (host, port, use_https) parsed from `base_url`, or else from the configured OLLAMA_HOST.
+        """
+        ollama_host = base_url or self.config.get("ollama_host")
+        if not ollama_host:
+            raise ValueError("OLLAMA_HOST no configurada para Ollama.")
+        return self._parse_base_url(ollama_host, 80) # Default port 80 if not specified
+
+    def _gemini_endpoint(self, base_url: str | None = None) -> Tuple[str, int, bool]:
+        """
+        Returns (host, port, use_https) of the Gemini API, which GEMINI_BASE_URL (or `base_url`) can point at a local stand-in.
+        """
+        base_url = base_url or self.config.get("gemini_base_url") or "https://generativelanguage.googleapis.com"
+        return self._parse_base_url(base_url, 443 if base_url.startswith("https") else 80)
+
+    def _mock_responder(self) -> MockResponder:
+        if self._mock is None:
+            self._mock = MockResponder.from_config(self.config)
+        return self._mock
+
+    def _mock_error(self, model: str) -> Exception:
+        return ProviderError(f"Error en la API de Mock (Status: 503): fallo simulado para el modelo {model}", 503)
+
+    def _replay(self, provider_model: str, prompt: str) -> Tuple[str, List[str], float]:
+        """
+        Returns (response, chunks, delay) of the next recorded call. The delay is the recorded latency
+        with `cassette_latency` set to "recorded", and 0 otherwise so replays run at CPU speed.
+        """
+        response, chunks, latency = self.cassette.replay(provider_model, prompt)
+        delay = latency if self.config.get("cassette_latency", "zero") == "recorded" else 0.0
+        return response, chunks, delay
+
+    def _split_prefix(self, prompt: str, prefix: str | None) -> Tuple[str, str | None]:
+        """
+        Returns (prompt, prefix) to send. With `prompt_cache` disabled the prefix is folded into the prompt.
+        """
+        if prefix and not self.config.get("prompt_cache", True):
+            return prefix + prompt, None
+        return prompt, prefix or None
+
+    def _note_prefix(self, provider: str, provider_model: str, prefix: str) -> None:
+        """
+        Counts a call that starts with a stable prefix. Ollama keeps the evaluated prompt of a loaded model
+        and skips the part a new prompt shares with it, so a repeated prefix is estimated as saved tokens;
+        Gemini reports the tokens it served from cache itself (see _record_usage).
+        """
+        self.prompt_cache_stats["prefixed_calls"] += 1
+        if provider == "gemini":
+            return
+        key = (provider_model, prefix)
+        if key in self._warm_prefixes:
+            self.prompt_cache_stats["saved_tokens"] += estimate_tokens(prefix)
+        else:
+            self._warm_prefixes.add(key)
+
+    def _record_usage(self, request: ProviderRequest, response_data: Dict[str, Any], usage: Dict[str, Any] | None) -> None:
+        """
+        Copies the usage reported in a completion into `usage` (the per-call dict passed to _record_call).
+        """
+        reported = extract_usage(request.provider, response_data)
+        if request.provider == "gemini":
+            self.prompt_cache_stats["saved_tokens"] += reported.get("cached_tokens", 0)
+        if usage is not None:
+            usage.update(reported)
+
+    def _wants_gemini_cache(self, model: str, prefix: str) -> bool:
+        """
+        Gemini only caches contents above a minimum size (about 1024 tokens for Flash models),
+        so shorter prefixes are not even offered; implicit caching may still apply to them.
+        """
+        return (
+            estimate_tokens(prefix) >= self.config.get("gemini_cache_min_tokens", 1024)
+            and not self.gemini_caches.refused(model, prefix)
+        )
+
+    def _cache_request(self, model: str, prefix: str) -> ProviderRequest:
+        """
+        Builds the request that stores `prefix` as a Gemini cachedContent for `gemini_cache_ttl` seconds.
+        """
+        api_key = self.config.get("gemini_api_key")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY no configurada para Gemini.")
+        model, base_url = self._split_host(model)
+        host, port, use_https = self._gemini_endpoint(base_url)
+        return ProviderRequest(
+            provider="gemini",
+            model=model,
+            host=host,
+            port=port,
+            path="/v1beta/cachedContents",
+            headers={
+                "Content-Type": "application/json",
+                "x-goog-api-key": api_key,
+            },
+            body=json.dumps({
+                "model": f"models/{model}",
+                "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+                "ttl": f"{self.config.get('gemini_cache_ttl', 600)}s",
+            }),
+            use_https=use_https,
+            timeout=self.config.get("api_timeout", 60),
+        )
+
+    def _parse_cache_response(self, model: str, prefix: str, status: int, response_text: str) -> str | None:
+        """
+        Registers the created cache and returns its name. A client error (prefix too small, model
+        without caching) marks the prefix as refused; other failures are simply not cached this time.
+        """
+        if status == 200:
+            name = json.loads(response_text).get("name")
+            if name:
+                self.gemini_caches.put(model, prefix, name, self.config.get("gemini_cache_ttl", 600))
+                self.prompt_cache_stats["caches_created"] += 1
+                return name
+        elif 400 <= status < 500:
+            logger.info("Gemini cache refused for model %s (status %s), sending the prefix inline", model, status)
+            self.gemini_caches.refuse(model, prefix)
+        return None
+
+    def _response_schema(self, response_schema: Dict[str, Any] | None) -> Dict[str, Any] | None:
+        """
+        Returns the schema to enforce, or None when `structured_output` is disabled in the config
+        (for instance with an Ollama version that predates JSON-schema formats).
+        """
+        return response_schema if self.config.get("structured_output", True) else None
+
+    @classmethod
+    def _gemini_schema(cls, schema: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Converts a JSON Schema into Gemini's OpenAPI-style `responseSchema` (upper-case type names).
+        """
+        converted: Dict[str, Any] = {}
+        for key, value in schema.items():
+            if key == "type":
+                converted[key] = value.upper()
+            elif key == "properties":
+                converted[key] = {name: cls._gemini_schema(sub_schema) for name, sub_schema in value.items()}
+            elif key == "items":
+                converted[key] = cls._gemini_schema(value)
+            else:
+                converted[key] = value
+        return converted
+
+    def _build_request(
+        self,
+        provider: str,
+        model: str,
+        prompt: str,
+        stream: bool,
+        response_schema: Dict[str, Any] | None = None,
+        prefix: str | None = None,
+        cached_content: str | None = None,
+    ) -> ProviderRequest:
+        """
+        Builds the generateContent / streamGenerateContent (Gemini) or /api/generate (Ollama) request.
+        With a `response_schema`, the provider is asked for JSON matching it (Gemini `responseSchema`,
+        Ollama `format`). A Gemini `cached_content` replaces the `prefix`; otherwise the prefix is sent
+        in front of the prompt.
+        """
+        # Get timeout from config, with a default of 60 seconds
+        api_timeout = self.config.get("api_timeout", 60)
+        model, base_url = self._split_host(model)
+
+        if provider == "gemini":
+            api_key = self.config.get("gemini_api_key")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY no configurada para Gemini.")
+            if stream:
+                path = f"/v1beta/models/{model}:streamGenerateContent?alt=sse"
+            else:
+                path = f"/v1beta/models/{model}:generateContent"
+            host, port, use_https = self._gemini_endpoint(base_url)
+            if cached_content:
+                payload: Dict[str, Any] = {
+                    "cachedContent": cached_content,
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                }
+            else:
+                payload = {"contents": [{"parts": [{"text": (prefix or "") + prompt}]}]}
+            if response_schema is not None:
+                payload["generationConfig"] = {
+                    "responseMimeType": "application/json",
+                    "responseSchema": self._gemini_schema(response_schema),
+                }
+            return ProviderRequest(
+                provider=provider,
+                model=model,
+                host=host,
+                port=port,
+                path=path,
+                headers={
+                    "Content-Type": "application/json",
+                    "x-goog-api-key": api_key,
+                },
+                body=json.dumps(payload),
+                use_https=use_https,
+                timeout=api_timeout,
+            )
+
+        host, port, use_https = self._ollama_endpoint(base_url)
+        payload = {
+            "model": model,
+            "prompt": (prefix or "") + prompt,
+            "stream": stream
+        }
+        if response_schema is not None:
+            payload["format"] = response_schema
+        if self.config.get("ollama_keep_alive"):
+            payload["keep_alive"] = self.config["ollama_keep_alive"] # Keeps the model and its prompt cache loaded between turns
+        return ProviderRequest(
+            provider=provider,
+            model=model,
+            host=host,
+            port=port,
+            path="/api/generate",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps(payload),
+            use_https=use_https,
+            timeout=api_timeout,
+        )
+
+    @staticmethod
+    def _gemini_chunk_text(response_data: Dict[str, Any]) -> str:
+        """
+        Extracts the generated text from a Gemini response (or SSE chunk), which may carry no parts.
+        """
+        candidates = response_data.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    def _provider_label(self, provider: str) -> str:
+        return {"gemini": "Gemini", "ollama": "Ollama", "mock": "Mock"}[provider]
+
+    def _parse_completion(self, request: ProviderRequest, status: int, response_text: str, usage: Dict[str, Any] | None = None) -> str:
+        """
+        Extracts the generated text from a non-streamed provider response, and its reported usage into `usage`.
+        """
+        if status != 200:
+            raise self._http_error(request, status, response_text)
+
+        try:
+            response_data = json.loads(response_text)
+            self._record_usage(request, response_data, usage)
+            if request.provider == "gemini":
+                return response_data["candidates"][0]["content"]["parts"][0]["text"]
+            return response_data["response"]
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            raise ParseError(f"Respuesta no válida de {self._provider_label(request.provider)}: {e!r}") from e
+
+    def _parse_stream_line(self, request: ProviderRequest, line: str, usage: Dict[str, Any] | None = None) -> str:
+        """
+        Extracts the text carried by one line of a streamed response ("" if the line carries none).
+        Gemini streams SSE frames ("data: {...}"); Ollama streams one JSON object per line.
+        Usage reported along the way (Gemini on every frame, Ollama on the final one) is copied into `usage`.
+        """
+        try:
+            if request.provider == "gemini":
+                if not line.startswith("data:"):
+                    return ""
+                chunk_data = json.loads(line[len("data:"):].strip())
+            else:
+                if not line.strip():
+                    return ""
+                chunk_data = json.loads(line)
+        except ValueError as e:
+            raise ParseError(f"Fragmento no válido de {self._provider_label(request.provider)}: {e}") from e
+        if request.provider == "ollama" and chunk_data.get("error"):
+            # Ollama reports a failure mid-stream (model crashed or unloaded) in a frame of a 200 response
+            raise ProviderError(f"Error en la API de Ollama (Status: 500): {chunk_data['error']}", 500)
+        if usage is not None:
+            usage.update(extract_usage(request.provider, chunk_data))
+        if request.provider == "gemini":
+            return self._gemini_chunk_text(chunk_data)
+        return chunk_data.get("response", "")
+
+    def _http_error(self, request: ProviderRequest, status: int, response_text: str) -> ProviderError:
+        """
+        The error for a non-200 provider response, with the retry delay it asks for.
+        """
+        message = f"Error en la API de {self._provider_label(request.provider)} (Status: {status}): {response_text}"
+        retry_after = parse_retry_after(response_text, request.retry_after_header)
+        if status == 429:
+            return RateLimitError(message, retry_after)
+        return ProviderError(message, status, retry_after)
+
+    def _stream_error(self, request: ProviderRequest, status: int, error_lines: List[str]) -> Exception:
+        return self._http_error(request, status, " ".join(error_lines))
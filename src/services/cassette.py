@@ -0,0 +1,125 @@
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+from collections import deque
+from typing import Dict, Any, Deque, List, Tuple
+
+CASSETTE_MODES = ("record", "replay")
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode when a call was never recorded on the cassette.
+    """
+
+class Cassette:
+    """
+    On-disk log of LLM calls: one JSON line per call with the response, its streamed chunks and its latency.
+    Prompts are stored as a hash only, which keeps cassettes compact (use a .gz path to compress them further).
+    In replay mode the responses of each (provider_model, prompt) key are served in the order they were recorded;
+    once a key runs out, its last response is repeated.
+    """
+
+    def __init__(self, path: str, mode: str):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Modo de cassette no válido: {mode}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._file = None
+        if mode == "record":
+            self._file = self._open("w") # A recording session starts a fresh cassette
+        else:
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _open(self, file_mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, file_mode + "t", encoding="utf-8")
+        return open(self.path, file_mode, encoding="utf-8")
+
+    @staticmethod
+    def key(provider_model: str, prompt: str) -> str:
+        return hashlib.sha1(f"{provider_model}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        """
+        Reads every recorded call. A cassette cut short by an interrupted recording keeps its complete lines.
+        """
+        with self._open("r") as f:
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._entries.setdefault(entry["key"], deque()).append(entry)
+            except EOFError:
+                pass # Truncated .gz stream
+
+    def record(self, provider_model: str, prompt: str, response: str, latency: float, chunks: List[str] | None = None) -> None:
+        """
+        Appends one call to the cassette. `chunks` holds the pieces of a streamed response.
+        """
+        entry = {
+            "key": self.key(provider_model, prompt),
+            "provider_model": provider_model,
+            "latency": round(latency, 4),
+            "response": response,
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def replay(self, provider_model: str, prompt: str) -> Tuple[str, List[str], float]:
+        """
+        Returns (response, chunks, recorded latency) for the next recorded call with this key.
+        """
+        key = self.key(provider_model, prompt)
+        with self._lock:
+            queue = self._entries.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+            elif key in self._last:
+                entry = self._last[key]
+            else:
+                raise CassetteMissError(f"Llamada no grabada en el cassette {self.path} para {provider_model}")
+        return entry["response"], entry.get("chunks") or [entry["response"]], entry["latency"]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_cassettes: Dict[Tuple[str, str], Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+def get_cassette(config: Dict[str, Any]) -> Cassette | None:
+    """
+    Returns the process-wide cassette selected by `cassette_mode` / `cassette_path`, or None when disabled.
+    Every engine builds its own API client, so the cassette is shared to keep one recording per run.
+    """
+    mode = config.get("cassette_mode")
+    if not mode:
+        return None
+    path = config.get("cassette_path", "logs/cassette.jsonl")
+    with _cassettes_lock:
+        if (path, mode) not in _cassettes:
+            cassette = Cassette(path, mode)
+            atexit.register(cassette.close) # Flushes the end of a compressed recording
+            _cassettes[(path, mode)] = cassette
+        return _cassettes[(path, mode)]
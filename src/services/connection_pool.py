@@ -0,0 +1,112 @@
+import asyncio
+import ssl
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Pool key: (scheme, host, port)
+PoolKey = Tuple[str, str, int]
+
+class ConnectionPool:
+    """
+    Pool of keep-alive HTTP/HTTPS connections (asyncio streams), keyed by (scheme, host, port).
+    Keeps at most `max_size` idle connections per key and evicts the ones that have been
+    idle for longer than `idle_timeout` seconds. asyncio sockets belong to the event loop that
+    opened them, so a pool must only be used from one loop; its stats can be read from any thread.
+    """
+
+    def __init__(self, max_size: int = 4, idle_timeout: float = 30.0):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[PoolKey, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+        self._ssl_context: ssl.SSLContext | None = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "created": 0,       # New TCP (+TLS) connections opened
+            "reused": 0,        # Requests served over an already open connection
+            "evicted": 0,       # Idle connections closed because they expired
+            "discarded": 0,     # Connections closed after an error or a full pool
+            "stale_retries": 0, # Requests replayed because a pooled socket was dead
+        }
+
+    async def acquire(self, scheme: str, host: str, port: int, timeout: float) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """
+        Returns a (reader, writer) pair for the given endpoint and whether it was reused from the pool.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get((scheme, host, port), [])
+            while idle:
+                reader, writer, last_used = idle.pop() # Most recently used first
+                if now - last_used > self.idle_timeout or reader.at_eof() or writer.is_closing():
+                    self._stats["evicted"] += 1
+                    writer.close()
+                    continue
+                self._stats["reused"] += 1
+                return reader, writer, True
+            self._stats["created"] += 1
+
+        ssl_context = None
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl_context), timeout=timeout)
+        return reader, writer, False
+
+    def release(self, scheme: str, host: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Returns a healthy connection to the pool so the next request can reuse it.
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host, port), [])
+            if len(idle) < self.max_size:
+                idle.append((reader, writer, time.monotonic()))
+                return
+        self.discard(writer)
+
+    def discard(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Closes a connection that must not be reused (errors, `Connection: close`, ...).
+        """
+        with self._lock:
+            self._stats["discarded"] += 1
+        writer.close()
+
+    def record_stale_retry(self) -> None:
+        with self._lock:
+            self._stats["stale_retries"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Returns a snapshot of the pool counters plus the number of idle connections.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = sum(len(idle) for idle in self._idle.values())
+        return stats
+
+    def close_all(self) -> None:
+        """
+        Closes every idle connection in the pool. Call it from the pool's loop, before the loop shuts down.
+        """
+        with self._lock:
+            connections = [writer for idle in self._idle.values() for _, writer, _ in idle]
+            self._idle.clear()
+        for writer in connections:
+            writer.close()
+
+_shared_pool: ConnectionPool | None = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool(max_size: int = 4, idle_timeout: float = 30.0) -> ConnectionPool:
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    Every engine builds its own APIClient, whose calls all run on the background loop,
+    so the pool is shared to keep sockets warm across games.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ConnectionPool(max_size=max_size, idle_timeout=idle_timeout)
+        return _shared_pool
@@ -1,8 +1,10 @@
 from typing import List, Tuple
 from src.services.api_client import APIClient
+from src.services.async_api_client import AsyncAPIClient
 from src.models.story import Story
-from src.utils.display import display_error_and_retry
-from src.config.prompts import get_detective_prompt, get_detective_final_solution_prompt
+from src.models.history import ContextBudget
+from src.utils.tracing import traced
+from src.config.prompts import get_detective_prompt_parts, get_detective_final_solution_prompt
 
 class Detective:
     """
@@ -14,6 +16,7 @@ class Detective:
         self.api_client = api_client
         self.detective_model = detective_model
         self.mystery_situation = mystery_situation
+        self.context_budget = ContextBudget.from_config(api_client.config) # Bounds the history rendered into each prompt
         self.ready_to_solve_phrases = [
             "creo que ya lo tengo",
             "voy a resolver",
@@ -23,31 +26,37 @@ class Detective:
             "solución final"
         ]
 
-    def _get_detective_prompt(self, qa_history: List[Tuple[str, str]]) -> str:
+    @traced("prompt.detective", "prompt")
+    def _get_detective_prompt(self, qa_history: List[Tuple[str, str]]) -> Tuple[str, str]:
         """
-        Constructs the prompt for the Detective AI to ask a question or attempt a solution.
+        Constructs the prompt for the Detective AI to ask a question or attempt a solution,
+        as (instructions prefix, per-turn suffix).
         """
-        return get_detective_prompt(self.mystery_situation, qa_history)
+        return get_detective_prompt_parts(self.mystery_situation, qa_history, self.context_budget)
 
     def ask_question_or_solve(self, qa_history: List[Tuple[str, str]]) -> str:
         """
         Gets a question or a solution attempt from the Detective AI.
         The response will be cleaned to remove any leading "Detective: " if present.
-        Gets a question or a solution attempt from the Detective AI.
-        The response will be cleaned to remove any leading "Detective: " if present.
-        Handles connection errors with retry mechanism.
-        """
-        prompt = self._get_detective_prompt(qa_history)
-        while True:
-            try:
-                response = self.api_client.generate_text(self.detective_model, prompt).strip()
-                # Clean the response to remove any leading "Detective: "
-                if response.lower().startswith("detective:"):
-                    response = response[len("detective:"):].strip()
-                return response
-            except ConnectionError as e:
-                if not display_error_and_retry(f"Error de conexión con el Detective: {e}"):
-                    raise
+        Transient errors are retried by the API client; what still fails is raised to the engine.
+        """
+        prefix, prompt = self._get_detective_prompt(qa_history)
+        try:
+            response = self.api_client.generate_text(self.detective_model, prompt, prefix=prefix, role="detective")
+        except ConnectionError as e:
+            raise ConnectionError(f"Error de conexión con el Detective: {e}")
+        return self._clean_question(response)
+
+    @staticmethod
+    @traced("parse.question", "parse")
+    def _clean_question(response: str) -> str:
+        """
+        Strips whitespace and any leading "Detective: " the model may have added.
+        """
+        response = response.strip()
+        if response.lower().startswith("detective:"):
+            response = response[len("detective:"):].strip()
+        return response
 
     def is_ready_to_solve(self, response: str) -> bool:
         """
@@ -55,22 +64,51 @@ class Detective:
         """
         return any(phrase in response.lower() for phrase in self.ready_to_solve_phrases)
 
+    @traced("prompt.detective", "prompt")
     def get_final_solution_prompt(self, qa_history: List[Tuple[str, str]]) -> str:
         """
         Constructs a prompt specifically for the Detective to provide the final solution.
         """
-        return get_detective_final_solution_prompt(self.mystery_situation, qa_history)
+        return get_detective_final_solution_prompt(self.mystery_situation, qa_history, self.context_budget)
 
     def provide_final_solution(self, qa_history: List[Tuple[str, str]]) -> str:
         """
         Gets the final solution from the Detective AI.
-        Handles connection errors with retry mechanism.
+        Transient errors are retried by the API client; what still fails is raised to the engine.
+        """
+        prompt = self.get_final_solution_prompt(qa_history)
+        try:
+            response = self.api_client.generate_text(self.detective_model, prompt, role="detective")
+        except ConnectionError as e:
+            raise ConnectionError(f"Error de conexión al obtener la solución final del Detective: {e}")
+        return response.strip()
+
+class AsyncDetective(Detective):
+    """
+    asyncio variant of the Detective, backed by an AsyncAPIClient.
+    """
+
+    def __init__(self, api_client: AsyncAPIClient, detective_model: str, mystery_situation: str):
+        super().__init__(api_client, detective_model, mystery_situation)
+
+    async def ask_question_or_solve(self, qa_history: List[Tuple[str, str]]) -> str:
+        """
+        Gets a question or a solution attempt from the Detective AI.
+        """
+        prefix, prompt = self._get_detective_prompt(qa_history)
+        try:
+            response = await self.api_client.generate_text(self.detective_model, prompt, prefix=prefix, role="detective")
+        except ConnectionError as e:
+            raise ConnectionError(f"Error de conexión con el Detective: {e}")
+        return self._clean_question(response)
+
+    async def provide_final_solution(self, qa_history: List[Tuple[str, str]]) -> str:
+        """
+        Gets the final solution from the Detective AI.
         """
         prompt = self.get_final_solution_prompt(qa_history)
-        while True:
-            try:
-                response = self.api_client.generate_text(self.detective_model, prompt).strip()
-                return response
-            except ConnectionError as e:
-                if not display_error_and_retry(f"Error de conexión al obtener la solución final del Detective: {e}"):
-                    raise
+        try:
+            response = await self.api_client.generate_text(self.detective_model, prompt, role="detective")
+        except ConnectionError as e:
+            raise ConnectionError(f"Error de conexión al obtener la solución final del Detective: {e}")
+        return response.strip()
@@ -0,0 +1,152 @@
+import math
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List
+
+from src.utils.cancellation import CancelToken
+
+SUPERSEDED = "superseded" # Cancel reason of the request that lost a hedged race
+LATENCY_WINDOW = 200 # Latest successful call latencies kept per backend for the hedge delay
+BUDGET_WINDOW = 1000 # Past this many calls, the budget counters are halved so the budget follows recent traffic
+
+def parse_fallbacks(spec: str) -> Dict[str, List[str]]:
+    """
+    Parses MODEL_FALLBACKS, "key=backend,backend;..." where a key is a role (narrator, detective, story, ...)
+    or a "provider:model", and each backend a "provider:model", optionally followed by "@base URL" to reach
+    another host, e.g. "narrator=ollama:llama3@http://gpu2:11434,gemini:gemini-2.0-flash".
+    Backends are tried in the order given. Malformed entries are ignored.
+    """
+    fallbacks: Dict[str, List[str]] = {}
+    for entry in spec.split(";"):
+        key, _, values = entry.partition("=")
+        backends = [backend.strip() for backend in values.split(",") if ":" in backend]
+        if key.strip() and backends:
+            fallbacks[key.strip()] = backends
+    return fallbacks
+
+class HedgeAttempt:
+    """
+    One of the concurrent requests of a hedged call. Its token is cancelled with the SUPERSEDED reason
+    when the other request wins, and with the game's reason when the game is cancelled.
+    Call `close` once the race is over to unlink the attempt from the game's token.
+    """
+
+    def __init__(self, parent: CancelToken | None = None):
+        self.token = CancelToken()
+        self._unlink: Callable[[], None] | None = None
+        if parent is not None:
+            self._unlink = parent.on_cancel(lambda: self.token.cancel(parent.reason or "cancelled"))
+
+    def close(self) -> None:
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    @property
+    def superseded(self) -> bool:
+        return self.token.reason == SUPERSEDED
+
+# The attempt the current thread or asyncio task is running, if it belongs to a hedged call
+current_attempt: ContextVar[HedgeAttempt | None] = ContextVar("current_attempt", default=None)
+
+class Hedger:
+    """
+    Decides when a slow LLM call is duplicated to a second backend. A call still unanswered after
+    the `quantile` (e.g. p95) of its backend's recent latencies, and never sooner than `min_delay`,
+    is sent again elsewhere and the first valid reply is kept. Only about 1 call in 20 is that slow,
+    so this cuts the tail without doubling the load; `budget` caps the fraction of calls hedged
+    when a backend slows down as a whole and every call would be.
+    """
+
+    def __init__(self, quantile: float = 0.95, min_delay: float = 0.5, min_samples: int = 20, budget: float = 0.1):
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.min_samples = max(1, min_samples)
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._calls = 0
+        self._hedges = 0
+        self.stats: Dict[str, int] = {"calls": 0, "hedged": 0, "won": 0, "over_budget": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.quantile < 1 and self.budget > 0
+
+    def observe(self, backend: str, latency: float) -> None:
+        """
+        Adds the latency of a successful call to `backend`.
+        """
+        with self._lock:
+            window = self._latencies.get(backend)
+            if window is None:
+                window = self._latencies[backend] = deque(maxlen=LATENCY_WINDOW)
+            window.append(latency)
+
+    def start(self, backend: str) -> float | None:
+        """
+        Counts a hedgeable call to `backend` and returns after how many seconds it should be hedged,
+        or None while hedging is disabled or the backend has too few latencies to know what is slow.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._calls += 1
+            self.stats["calls"] += 1
+            if self._calls > BUDGET_WINDOW:
+                self._calls //= 2
+                self._hedges //= 2
+            window = self._latencies.get(backend)
+            if window is None or len(window) < self.min_samples:
+                return None
+            latencies = sorted(window)
+        return self._delay_of(latencies)
+
+    def _delay_of(self, latencies: List[float]) -> float:
+        index = min(len(latencies) - 1, math.ceil(self.quantile * len(latencies)) - 1)
+        return max(self.min_delay, latencies[index])
+
+    def try_hedge(self) -> bool:
+        """
+        Takes one hedge from the budget; False if the fraction of hedged calls is already at the budget.
+        """
+        with self._lock:
+            if self._hedges >= self.budget * self._calls:
+                self.stats["over_budget"] += 1
+                return False
+            self._hedges += 1
+            self.stats["hedged"] += 1
+            return True
+
+    def record_win(self) -> None:
+        """
+        Counts a hedged call answered first by its duplicate.
+        """
+        with self._lock:
+            self.stats["won"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.stats)
+            latencies = {backend: sorted(window) for backend, window in self._latencies.items()}
+        stats["delays"] = {backend: round(self._delay_of(window), 4) for backend, window in latencies.items() if len(window) >= self.min_samples}
+        return stats
+
+_hedger: Hedger | None = None
+_hedger_lock = threading.Lock()
+
+def get_hedger(config: Dict[str, Any]) -> Hedger:
+    """
+    Returns the process-wide hedger, set up from the `hedge_*` settings on first use.
+    """
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(
+                quantile=config.get("hedge_quantile", 0.95),
+                min_delay=config.get("hedge_min_delay", 0.5),
+                min_samples=config.get("hedge_min_samples", 20),
+                budget=config.get("hedge_budget", 0.1),
+            )
+        return _hedger
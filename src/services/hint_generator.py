@@ -1,5 +1,7 @@
 from typing import List, Tuple
 from src.services.api_client import APIClient
+from src.services.async_api_client import AsyncAPIClient
+from src.models.history import ContextBudget
 from src.config.prompts import get_hint_prompt
 
 class HintGenerator:
@@ -10,19 +12,46 @@ class HintGenerator:
     def __init__(self, api_client: APIClient, model: str):
         self.api_client = api_client
         self.model = model
+        self.context_budget = ContextBudget.from_config(api_client.config)
 
     def generate_hint(self, mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]]) -> str:
         """
         Generates a hint based on the current game state.
         """
-        prompt = get_hint_prompt(mystery_situation, hidden_solution, qa_history)
+        prompt = get_hint_prompt(mystery_situation, hidden_solution, qa_history, self.context_budget)
         try:
-            hint = self.api_client.generate_text(self.model, prompt).strip()
-            # Clean up if the model adds quotes or prefixes
-            if hint.startswith('"') and hint.endswith('"'):
-                hint = hint[1:-1]
-            if hint.lower().startswith("pista:"):
-                hint = hint[6:].strip()
-            return hint
+            hint = self.api_client.generate_text(self.model, prompt, role="hint")
+            return self._clean_hint(hint)
+        except Exception as e:
+            return f"Lo siento, no puedo generar una pista en este momento. Error: {e}"
+
+    @staticmethod
+    def _clean_hint(hint: str) -> str:
+        """
+        Cleans up if the model adds quotes or prefixes.
+        """
+        hint = hint.strip()
+        if hint.startswith('"') and hint.endswith('"'):
+            hint = hint[1:-1]
+        if hint.lower().startswith("pista:"):
+            hint = hint[6:].strip()
+        return hint
+
+class AsyncHintGenerator(HintGenerator):
+    """
+    asyncio variant of the HintGenerator, backed by an AsyncAPIClient.
+    """
+
+    def __init__(self, api_client: AsyncAPIClient, model: str):
+        super().__init__(api_client, model)
+
+    async def generate_hint(self, mystery_situation: str, hidden_solution: str, qa_history: List[Tuple[str, str]]) -> str:
+        """
+        Generates a hint based on the current game state.
+        """
+        prompt = get_hint_prompt(mystery_situation, hidden_solution, qa_history, self.context_budget)
+        try:
+            hint = await self.api_client.generate_text(self.model, prompt, role="hint")
+            return self._clean_hint(hint)
         except Exception as e:
             return f"Lo siento, no puedo generar una pista en este momento. Error: {e}"
@@ -0,0 +1,217 @@
+import itertools
+import json
+import random
+import re
+import zlib
+from typing import Dict, Any, List
+
+# A small fixed catalogue, so mock games are reproducible and validation has a real solution to compare with.
+# Each entry: (situacion_misteriosa, solucion_oculta, a wrong but plausible guess)
+MOCK_STORIES = [
+    (
+        "Un hombre yace muerto en medio de un campo. A su lado hay un paquete sin abrir.",
+        "El hombre saltó de un avión y su paracaídas, que iba en el paquete, no se abrió.",
+        "El hombre fue asesinado por un ladrón que buscaba el paquete.",
+    ),
+    (
+        "Una mujer entra en un bar y pide un vaso de agua. El camarero le apunta con una pistola y ella le da las gracias.",
+        "La mujer tenía hipo. El susto de la pistola se lo quitó, así que ya no necesitaba el agua.",
+        "El camarero la confundió con una ladrona y luego se disculpó.",
+    ),
+    (
+        "Un hombre vuelve a casa, ve las luces apagadas y se echa a llorar.",
+        "Era el farero. Al volver comprendió que había dejado el faro apagado y que un barco había naufragado por su culpa.",
+        "Le habían cortado la luz por no pagar las facturas.",
+    ),
+    (
+        "Dos hermanos nacen el mismo día, del mismo padre y de la misma madre, pero no son gemelos.",
+        "Son dos de los bebés de un parto de trillizos.",
+        "Uno de ellos es adoptado y celebran el mismo cumpleaños.",
+    ),
+    (
+        "Un hombre muere en su habitación después de apagar la luz.",
+        "Era el farero y, al apagar la luz del faro para dormir, provocó un naufragio en el que murió su familia; se quitó la vida.",
+        "Le dio un infarto en la oscuridad.",
+    ),
+]
+
+MOCK_QUESTIONS = [
+    "¿Murió de forma violenta?",
+    "¿Había alguien más presente?",
+    "¿Es importante el lugar donde ocurrió?",
+    "¿Tuvo algo que ver un objeto que llevaba consigo?",
+    "¿Fue un accidente?",
+    "¿Ocurrió de noche?",
+    "¿Influye su profesión en lo que pasó?",
+    "¿Podría haberse evitado?",
+]
+
+MOCK_THEORIES = [
+    "Quizá todo fue un malentendido y nadie tuvo la culpa.",
+    "Puede que el objeto clave esté a la vista desde el principio.",
+    "Tal vez la profesión del protagonista lo explique todo.",
+]
+
+MOCK_CRITIQUES = [
+    "No tenemos pruebas de eso; deberíamos preguntar por el lugar.",
+    "Es posible, pero primero hay que confirmar si fue un accidente.",
+]
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Process-wide, because every engine builds its own API client (and so its own responder)
+_stories_served = itertools.count()
+
+class MockResponder:
+    """
+    Deterministic stand-in for an LLM. Recognizes the game's prompts (story, Narrator answers,
+    Detective questions, validation, Council, hints) and returns well-formed replies for each.
+    The same (seed, model, prompt) always produces the same reply, whatever the call order;
+    only new stories rotate through the catalogue, so repeated games do not all replay the same case.
+    Latency, jitter and error rate are sampled separately so both the `mock:` provider and
+    the mock HTTP server can simulate slow or failing providers.
+    """
+
+    def __init__(self, seed: int = 0, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, questions_before_solving: int = 5):
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.questions_before_solving = questions_before_solving
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "MockResponder":
+        return cls(
+            seed=config.get("mock_seed", 0),
+            latency=config.get("mock_latency", 0.0),
+            jitter=config.get("mock_jitter", 0.0),
+            error_rate=config.get("mock_error_rate", 0.0),
+        )
+
+    def sample_delay(self) -> float:
+        """
+        Returns how long the simulated call should take: `latency` +/- up to `jitter` seconds.
+        """
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self) -> bool:
+        return self._random.random() < self.error_rate
+
+    def _rng(self, model: str, prompt: str) -> random.Random:
+        return random.Random(zlib.crc32(f"{self.seed}|{model}|{prompt}".encode("utf-8")))
+
+    @staticmethod
+    def _field(prompt: str, label: str) -> str:
+        """
+        Reads a single-line field such as "Solución oculta: ..." from a prompt.
+        """
+        match = re.search(rf"{label}:\s*(.+)", prompt)
+        return match.group(1).strip() if match else ""
+
+    @staticmethod
+    def _story_for(situation: str):
+        for story in MOCK_STORIES:
+            if story[0] == situation:
+                return story
+        return None
+
+    def respond(self, model: str, prompt: str, response_schema: Dict[str, Any] | None = None) -> str:
+        """
+        Returns the reply to `prompt`, as JSON matching `response_schema` when one is given.
+        """
+        text = self._reply(model, prompt)
+        return self._conform(text, response_schema) if response_schema else text
+
+    @staticmethod
+    def _conform(text: str, schema: Dict[str, Any]) -> str:
+        """
+        Shapes a scripted reply like a schema-constrained provider would: JSON replies pass through,
+        and plain text fills the schema's single property (snapped to its enum, if it has one).
+        """
+        try:
+            json.loads(text)
+            return text
+        except json.JSONDecodeError:
+            pass
+        properties = schema.get("properties", {})
+        if schema.get("type", "").lower() != "object" or len(properties) != 1:
+            return json.dumps(text, ensure_ascii=False)
+        name, property_schema = next(iter(properties.items()))
+        value = text.strip()
+        allowed = property_schema.get("enum")
+        if allowed:
+            cleaned = value.lower().rstrip(".,!?;")
+            value = next((option for option in allowed if option.lower() == cleaned), allowed[0])
+        return json.dumps({name: value}, ensure_ascii=False)
+
+    def _reply(self, model: str, prompt: str) -> str:
+        rng = self._rng(model, prompt)
+
+        if "experto creador de Black Stories" in prompt:
+            situation, solution, _ = MOCK_STORIES[(self.seed + next(_stories_served)) % len(MOCK_STORIES)]
+            return json.dumps({"situacion_misteriosa": situation, "solucion_oculta": solution}, ensure_ascii=False)
+
+        if "tu tarea es validar la solución" in prompt:
+            return self._validate(prompt)
+
+        if "Eres la IA Narrador" in prompt:
+            return rng.choices(["Sí.", "No.", "No es relevante."], weights=[4, 4, 2])[0]
+
+        if "ÚNICA oportunidad para dar la solución final" in prompt:
+            story = self._story_for(self._field(prompt, "Situación misteriosa"))
+            if story is None:
+                return "Creo que todo fue un trágico accidente."
+            return story[1] if rng.random() < 0.5 else story[2]
+
+        if "Eres la IA Detective" in prompt:
+            asked = prompt.count("\nNarrador: ")
+            if asked >= self.questions_before_solving or (asked >= 2 and rng.random() < 0.2):
+                return "Creo que ya lo tengo."
+            return MOCK_QUESTIONS[(asked + rng.randrange(len(MOCK_QUESTIONS))) % len(MOCK_QUESTIONS)]
+
+        if "Eres \"El Visionario\"" in prompt:
+            return rng.choice(MOCK_THEORIES)
+
+        if "Eres \"El Escéptico\"" in prompt:
+            return rng.choice(MOCK_CRITIQUES)
+
+        if "SE HA ALCANZADO EL LÍMITE DE PREGUNTAS" in prompt or "Eres \"El Líder\"" in prompt:
+            asked = prompt.count("\nRespuesta: ")
+            if "SE HA ALCANZADO EL LÍMITE DE PREGUNTAS" in prompt or asked >= self.questions_before_solving:
+                story = self._story_for(self._field(prompt, "Caso"))
+                return f"SOLUCIÓN: {story[1] if story else 'Fue un trágico accidente.'}"
+            return MOCK_QUESTIONS[asked % len(MOCK_QUESTIONS)]
+
+        if "Eres \"Watson\"" in prompt:
+            return "¿Has considerado qué llevaba encima el protagonista?"
+
+        return "Respuesta simulada."
+
+    def _validate(self, prompt: str) -> str:
+        """
+        Judges the proposed solution by how many key words of the hidden solution it mentions.
+        """
+        solution = self._field(prompt, "Solución oculta")
+        match = re.search(r"El Detective ha propuesto la siguiente solución:\s*\"(.*?)\"\s*\n", prompt, re.DOTALL)
+        proposed = match.group(1) if match else ""
+
+        key_words = self._key_words(solution)
+        found = key_words & self._key_words(proposed)
+        correct = bool(key_words) and len(found) / len(key_words) >= 0.5
+        return json.dumps({
+            "veredicto": "Correcto" if correct else "Incorrecto",
+            "analisis": f"La solución menciona {len(found)} de {len(key_words)} elementos clave de la historia.",
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _key_words(text: str) -> set:
+        return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 4}
+
+    @staticmethod
+    def split_chunks(text: str, words_per_chunk: int = 3) -> List[str]:
+        """
+        Splits a reply into the small pieces a streaming provider would send.
+        """
+        pieces = re.findall(r"\S+\s*", text)
+        return ["".join(pieces[i:i + words_per_chunk]) for i in range(0, len(pieces), words_per_chunk)] or [text]
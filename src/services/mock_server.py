@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from src.services.mock_llm import MockResponder
+from src.services.prompt_cache import estimate_tokens
+
+GEMINI_PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)")
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers Ollama `/api/generate` and Gemini `generateContent` / `streamGenerateContent?alt=sse`
+    requests with the MockResponder, over keep-alive HTTP/1.1 like the real providers.
+    Gemini `cachedContents` can be created and referenced, and usage reports the cached tokens.
+    """
+    protocol_version = "HTTP/1.1"
+    server: "MockLLMServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, content_type: str, pieces: List[bytes]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            self.wfile.flush()
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+
+        gemini_match = GEMINI_PATH_RE.match(self.path)
+        if self.path.startswith("/api/generate"):
+            self._handle_ollama(payload)
+        elif self.path.startswith("/v1beta/cachedContents"):
+            self._handle_gemini_cache(payload)
+        elif gemini_match:
+            self._handle_gemini(gemini_match.group("model"), gemini_match.group("method") == "streamGenerateContent", payload)
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _simulate(self) -> bool:
+        """
+        Waits the sampled latency and returns False if this request should fail.
+        """
+        mock = self.server.responder
+        with self.server.lock:
+            delay = mock.sample_delay()
+            fail = mock.should_fail()
+        time.sleep(delay)
+        return not fail
+
+    @staticmethod
+    def _ollama_schema(payload: Dict[str, Any]) -> Dict[str, Any] | None:
+        """
+        Ollama's `format` is either a JSON Schema or the plain string "json".
+        """
+        response_format = payload.get("format")
+        return response_format if isinstance(response_format, dict) else None
+
+    def _handle_ollama(self, payload: Dict[str, Any]) -> None:
+        model = payload.get("model", "mock")
+        if not self._simulate():
+            self._send_json(503, {"error": f"fallo simulado para el modelo {model}"})
+            return
+
+        started = time.monotonic()
+        prompt = payload.get("prompt", "")
+        text = self.server.responder.respond(model, prompt, self._ollama_schema(payload))
+
+        def final(response: str) -> Dict[str, Any]:
+            return {
+                "model": model,
+                "response": response,
+                "done": True,
+                "prompt_eval_count": estimate_tokens(prompt),
+                "eval_count": estimate_tokens(text),
+                "total_duration": int((time.monotonic() - started) * 1e9),
+                "load_duration": 0,
+            }
+
+        if not payload.get("stream", True):
+            self._send_json(200, final(text))
+            return
+
+        pieces = [
+            (json.dumps({"model": model, "response": chunk, "done": False}, ensure_ascii=False) + "\n").encode("utf-8")
+            for chunk in MockResponder.split_chunks(text)
+        ]
+        pieces.append((json.dumps(final("")) + "\n").encode("utf-8"))
+        self._send_chunked("application/x-ndjson", pieces)
+
+    @staticmethod
+    def _contents_text(payload: Dict[str, Any]) -> str:
+        return "".join(
+            part.get("text", "")
+            for content in payload.get("contents", [])
+            for part in content.get("parts", [])
+        )
+
+    def _handle_gemini_cache(self, payload: Dict[str, Any]) -> None:
+        text = self._contents_text(payload)
+        with self.server.lock:
+            name = f"cachedContents/mock-{next(self.server.cache_ids)}"
+            self.server.cached_contents[name] = text
+        self._send_json(200, {"name": name, "model": payload.get("model"), "usageMetadata": {"totalTokenCount": estimate_tokens(text)}})
+
+    def _handle_gemini(self, model: str, stream: bool, payload: Dict[str, Any]) -> None:
+        cached_text = ""
+        if payload.get("cachedContent"):
+            cached_text = self.server.cached_contents.get(payload["cachedContent"])
+            if cached_text is None:
+                self._send_json(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+                return
+
+        if not self._simulate():
+            self._send_json(503, {"error": {"code": 503, "message": f"fallo simulado para el modelo {model}", "status": "UNAVAILABLE"}})
+            return
+
+        prompt = cached_text + self._contents_text(payload)
+        text = self.server.responder.respond(model, prompt, payload.get("generationConfig", {}).get("responseSchema"))
+
+        def candidate(chunk: str) -> Dict[str, Any]:
+            return {"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]}
+
+        usage = {
+            "promptTokenCount": estimate_tokens(prompt),
+            "cachedContentTokenCount": estimate_tokens(cached_text),
+            "candidatesTokenCount": estimate_tokens(text),
+        }
+        if not stream:
+            self._send_json(200, {**candidate(text), "usageMetadata": usage})
+            return
+
+        frames = [candidate(chunk) for chunk in MockResponder.split_chunks(text)]
+        if frames:
+            frames[-1]["usageMetadata"] = usage # The last frame carries the totals of the whole reply
+        pieces = [f"data: {json.dumps(frame, ensure_ascii=False)}\r\n\r\n".encode("utf-8") for frame in frames]
+        self._send_chunked("text/event-stream", pieces)
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Gemini and Ollama. Point OLLAMA_HOST and/or GEMINI_BASE_URL at it
+    to load-test the engines, connection pool and web streaming without network access or quota.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, responder: MockResponder, chunk_delay: float = 0.0, verbose: bool = False):
+        super().__init__((host, port), MockLLMHandler)
+        self.responder = responder
+        self.chunk_delay = chunk_delay
+        self.verbose = verbose
+        self.lock = threading.Lock() # Guards the responder's shared latency/error RNG and the cache names
+        self.cached_contents: Dict[str, str] = {}
+        self.cache_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, responder: MockResponder | None = None, chunk_delay: float = 0.0) -> MockLLMServer:
+    """
+    Starts the mock server on a background thread (port 0 picks a free port) and returns it.
+    Call `shutdown()` on the result to stop it.
+    """
+    server = MockLLMServer(host, port, responder or MockResponder(), chunk_delay=chunk_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    """
+    Runs the mock LLM server in the foreground: python -m src.services.mock_server --port 11435
+    """
+    parser = argparse.ArgumentParser(description="Black Stories AI - Servidor LLM simulado (Gemini + Ollama)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the scripted replies")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each reply starts")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    responder = MockResponder(seed=args.seed, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    server = MockLLMServer(args.host, args.port, responder, chunk_delay=args.chunk_delay, verbose=args.verbose)
+    print(f"Servidor LLM simulado escuchando en {server.base_url}")
+    print(f"  OLLAMA_HOST={server.base_url}")
+    print(f"  GEMINI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
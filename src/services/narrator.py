@@ -1,11 +1,23 @@
+import asyncio
 import json
+import logging
 import os
 from json_repair import repair_json
 from datetime import datetime
-from typing import List, Tuple
+from typing import AsyncGenerator, Dict, Generator, List, Tuple
 from src.services.api_client import APIClient
+from src.services.async_api_client import AsyncAPIClient
 from src.models.story import Story
-from src.config.prompts import get_narrator_prompt, get_narrator_validation_prompt
+from src.models.history import ContextBudget
+from src.services.answer_cache import AnswerCache, normalize_question
+from src.services.retry import ParseError
+from src.utils.tracing import traced
+from src.utils.metrics import RETRIES
+from src.config.prompts import get_narrator_prompt_parts, get_narrator_validation_prompt
+from src.config.schemas import NARRATOR_ANSWER_SCHEMA, VALIDATION_SCHEMA
+
+logger = logging.getLogger(__name__)
+
 class Narrator:
     """
     Manages the Narrator AI's role in the Black Stories game.
@@ -19,41 +31,88 @@ class Narrator:
         self.difficulty = difficulty
         self.log_dir = "logs" # Directory to save conversation logs
         self.conversation_history: List[str] = [] # Stores the full conversation history
+        config = api_client.config
+        self.context_budget = ContextBudget.from_config(config) # Bounds the history rendered into each prompt
+        # One cache per narrator, i.e. per story: engines that share a narrator (Fight, Tournament) share its answers
+        self.answer_cache = AnswerCache(config.get("answer_cache_similarity", 0.0)) if config.get("answer_cache", True) else None
 
-    def _get_narrator_prompt(self, question: str, qa_history: List[Tuple[str, str]]) -> str:
+    @traced("prompt.narrator", "prompt")
+    def _get_narrator_prompt(self, question: str, qa_history: List[Tuple[str, str]]) -> Tuple[str, str]:
         """
-        Constructs the prompt for the Narrator AI to answer a question.
+        Constructs the prompt for the Narrator AI to answer a question, as (story prefix, per-turn suffix).
         """
-        return get_narrator_prompt(
+        return get_narrator_prompt_parts(
             self.story.mystery_situation,
             self.story.hidden_solution,
             qa_history,
-            question
+            question,
+            self.context_budget,
         )
 
+    @traced("parse.answer", "parse")
+    def _parse_answer(self, response: str) -> str:
+        """
+        Normalizes the Narrator's raw reply and checks it is one of the allowed answers.
+        Accepts both the schema-constrained {"respuesta": ...} JSON and a plain-text reply.
+        It has no side effects: with hedging, both requests of a call may be parsed (see `_remember_answer`).
+        """
+        response = response.strip()
+        if response.startswith("{"):
+            try:
+                response = str(json.loads(response).get("respuesta", response))
+            except (json.JSONDecodeError, AttributeError):
+                pass # Not the expected object; validated as plain text below
+        response = response.lower()
+        # Clean the response to remove any leading "narrador:" and punctuation
+        if response.startswith("narrador:"):
+            response = response[len("narrador:"):].strip()
+        response = response.rstrip('.,!?;')
+
+        if response in ["sí", "si", "no", "no es relevante"]:
+            return response
+        # If the AI doesn't follow the rules, try again with a stricter prompt
+        # In web context, we'll just raise an error to be caught by the game engine
+        raise ParseError(f"Narrator gave an invalid response: '{response}'. Expected 'sí', 'no', or 'no es relevante'.")
+
+    def _log_answer(self, question: str, answer: str) -> None:
+        self.conversation_history.append(f"Detective: {question}\nNarrador: {answer}")
+
+    def _remember_answer(self, question: str, answer: str) -> str:
+        """
+        Logs a freshly generated answer and caches it for equivalent questions.
+        """
+        self._log_answer(question, answer)
+        if self.answer_cache is not None:
+            self.answer_cache.put(question, answer)
+        return answer
+
+    def _cached_answer(self, question: str) -> str | None:
+        """
+        Returns the cached answer to an equivalent question already asked about this story, if any.
+        """
+        if self.answer_cache is None:
+            return None
+        answer = self.answer_cache.get(question)
+        if answer is not None:
+            self._log_answer(question, answer)
+        return answer
+
     def answer_question(self, question: str, qa_history: List[Tuple[str, str]]) -> str:
         """
         Gets an answer from the Narrator AI for a given question.
-        Handles connection errors with retry mechanism.
+        Transient errors and replies that are not a valid answer are retried by the API client.
         """
-        prompt = self._get_narrator_prompt(question, qa_history)
-        while True:
-            try:
-                response = self.api_client.generate_text(self.narrator_model, prompt).strip().lower()
-                # Clean the response to remove any leading "narrador:" and punctuation
-                if response.startswith("narrador:"):
-                    response = response[len("narrador:"):].strip()
-                response = response.rstrip('.,!?;')
-
-                if response in ["sí", "si", "no", "no es relevante"]:
-                    self.conversation_history.append(f"Detective: {question}\nNarrador: {response}")
-                    return response
-                else:
-                    # If the AI doesn't follow the rules, try again with a stricter prompt
-                    # In web context, we'll just raise an error to be caught by the game engine
-                    raise ValueError(f"Narrator gave an invalid response: '{response}'. Expected 'sí', 'no', or 'no es relevante'.")
-            except ConnectionError as e:
-                raise ConnectionError(f"Error de conexión con el Narrador: {e}")
+        cached = self._cached_answer(question)
+        if cached is not None:
+            return cached
+        prefix, prompt = self._get_narrator_prompt(question, qa_history)
+        try:
+            answer = self.api_client.generate_text(
+                self.narrator_model, prompt, NARRATOR_ANSWER_SCHEMA, prefix=prefix, role="narrator", parse=self._parse_answer,
+            )
+        except ConnectionError as e:
+            raise ConnectionError(f"Error de conexión con el Narrador: {e}")
+        return self._remember_answer(question, answer)
 
     def _get_validation_prompt(self, detective_solution: str) -> str:
         """
@@ -66,53 +125,97 @@ class Narrator:
             self.difficulty
         )
 
+    def parse_validation(self, detective_solution: str, response_text: str) -> Tuple[str, str]:
+        """
+        Parses the Narrator's validation JSON into (verdict, analysis) and logs it to the conversation history.
+        """
+        return self._log_validation(detective_solution, self._read_validation(response_text))
+
+    @traced("parse.validation", "parse")
+    def _read_validation(self, response_text: str) -> Tuple[str, str]:
+        """
+        Parses the Narrator's validation JSON into (verdict, analysis), without side effects (see `_parse_answer`).
+        """
+        # Clean the response to remove markdown code blocks if present
+        if response_text.strip().startswith("```json"):
+            response_text = response_text.strip()[len("```json"):].strip()
+            if response_text.endswith("```"):
+                response_text = response_text[:-len("```")].strip()
+
+        try:
+            validation_data = json.loads(response_text)
+        except json.JSONDecodeError:
+            # If standard parsing fails, try to repair it
+            try:
+                validation_data = json.loads(repair_json(response_text))
+            except json.JSONDecodeError as e:
+                # In web context, we'll just raise an error to be caught by the game engine
+                raise ParseError(f"Narrator gave an invalid JSON response during validation. Raw response: '{response_text}'. Error: {e}")
+        if not isinstance(validation_data, dict):
+            raise ParseError(f"Narrator gave a validation that is not a JSON object. Raw response: '{response_text}'")
+
+        verdict = validation_data.get("veredicto", "Incorrecto")
+        analysis = validation_data.get("analisis", "No se pudo generar un análisis detallado.")
+        return verdict, analysis
+
+    def _log_validation(self, detective_solution: str, validation: Tuple[str, str]) -> Tuple[str, str]:
+        verdict, analysis = validation
+        validation_log = (
+            f"Detective's Solution: {detective_solution}\n"
+            f"Narrator's Verdict: {verdict}\n"
+            f"Narrator's Analysis: {analysis}"
+        )
+        self.conversation_history.append(validation_log)
+        
+        return verdict, analysis
+
     def validate_solution(self, detective_solution: str) -> Tuple[str, str]:
         """
         Validates the detective's final solution using the Narrator AI.
         Returns a tuple: (verdict, analysis).
-        Handles connection errors with retry mechanism.
+        Transient errors and unreadable verdicts are retried by the API client.
         """
         prompt = self._get_validation_prompt(detective_solution)
-        while True:
-            try:
-                response_text = self.api_client.generate_text(self.narrator_model, prompt)
-                
-                # Clean the response to remove markdown code blocks if present
-                if response_text.strip().startswith("```json"):
-                    response_text = response_text.strip()[len("```json"):].strip()
-                    if response_text.endswith("```"):
-                        response_text = response_text[:-len("```")].strip()
-
-                try:
-                    validation_data = json.loads(response_text)
-                except json.JSONDecodeError:
-                     # If standard parsing fails, try to repair it
-                    repaired_json = repair_json(response_text)
-                    validation_data = json.loads(repaired_json)
-
-                verdict = validation_data.get("veredicto", "Incorrecto")
-                analysis = validation_data.get("analisis", "No se pudo generar un análisis detallado.")
-                
-                validation_log = (
-                    f"Detective's Solution: {detective_solution}\n"
-                    f"Narrator's Verdict: {verdict}\n"
-                    f"Narrator's Analysis: {analysis}"
-                )
-                self.conversation_history.append(validation_log)
-                
-                return verdict, analysis
-            except json.JSONDecodeError as e:
-                # In web context, we'll just raise an error to be caught by the game engine
-                raise ValueError(f"Narrator gave an invalid JSON response during validation. Raw response: '{response_text}'. Error: {e}")
-            except (ConnectionError, ValueError, KeyError) as e:
-                raise type(e)(f"Error al validar la solución con el Narrador: {e}")
+        try:
+            validation = self.api_client.generate_text(self.narrator_model, prompt, VALIDATION_SCHEMA, role="narrator", parse=self._read_validation)
+        except (ConnectionError, ValueError, KeyError) as e:
+            raise type(e)(f"Error al validar la solución con el Narrador: {e}")
+        return self._log_validation(detective_solution, validation)
+
+    def stream_validation(self, detective_solution: str) -> Generator[str, None, Tuple[str, str]]:
+        """
+        Streaming variant of `validate_solution`: yields the raw analysis text as it is generated
+        and returns (verdict, analysis) once the response is complete.
+        Use it as `verdict, analysis = yield from narrator.stream_validation(solution)`.
+        """
+        prompt = self._get_validation_prompt(detective_solution)
+        chunks: List[str] = []
+        try:
+            for chunk in self.api_client.stream_text(self.narrator_model, prompt, VALIDATION_SCHEMA, role="narrator"):
+                chunks.append(chunk)
+                yield chunk
+        except (ConnectionError, ValueError, KeyError) as e:
+            raise type(e)(f"Error al validar la solución con el Narrador: {e}")
+        return self.parse_streamed_validation(detective_solution, "".join(chunks))
+
+    def parse_streamed_validation(self, detective_solution: str, response_text: str) -> Tuple[str, str]:
+        """
+        Parses a streamed verdict. Text already shown cannot be streamed again, so an unreadable one
+        is replaced by a non-streamed `validate_solution`, which retries under the API client's policy.
+        """
+        try:
+            return self.parse_validation(detective_solution, response_text)
+        except ParseError as e:
+            RETRIES.inc(reason="parse")
+            logger.info("Streamed verdict could not be parsed (%s), validating again without streaming", e)
+            return self.validate_solution(detective_solution)
 
     def save_full_conversation(self) -> None:
         """
         Saves the entire accumulated conversation history to a single file.
         """
         if not self.conversation_history:
-            print("No hay conversación para guardar.")
+            logger.info("No hay conversación para guardar.")
             return
 
         os.makedirs(self.log_dir, exist_ok=True)
@@ -121,7 +224,93 @@ class Narrator:
         try:
             with open(filename, "w", encoding="utf-8") as f:
                 f.write("\n\n".join(self.conversation_history))
-            print(f"Conversación completa guardada en {filename}")
+            logger.info("Conversación completa guardada en %s", filename)
             self.conversation_history = [] # Clear history after saving
         except IOError as e:
-            print(f"Error al guardar la conversación completa en {filename}: {e}")
+            logger.error("Error al guardar la conversación completa en %s: %s", filename, e)
+
+class AsyncNarrator(Narrator):
+    """
+    asyncio variant of the Narrator, backed by an AsyncAPIClient.
+    Prompts, answer parsing and conversation logging are shared with the synchronous Narrator.
+    """
+
+    def __init__(self, api_client: AsyncAPIClient, narrator_model: str, story: Story, difficulty: str):
+        super().__init__(api_client, narrator_model, story, difficulty)
+        self._in_flight: Dict[Tuple[str, ...], asyncio.Future] = {}
+
+    async def answer_question(self, question: str, qa_history: List[Tuple[str, str]]) -> str:
+        """
+        Gets an answer from the Narrator AI for a given question.
+        When the same normalized question is already being answered for another detective
+        (concurrent Fight rounds, tournaments), it waits for that call instead of making its own.
+        """
+        cached = self._cached_answer(question)
+        if cached is not None:
+            return cached
+
+        key = normalize_question(question) if self.answer_cache is not None else ()
+        if key in self._in_flight:
+            answer = await asyncio.shield(self._in_flight[key])
+            self.answer_cache.count_shared()
+            self._log_answer(question, answer)
+            return answer
+
+        future = asyncio.get_running_loop().create_future() if key else None
+        if future is not None:
+            self._in_flight[key] = future
+        try:
+            prefix, prompt = self._get_narrator_prompt(question, qa_history)
+            try:
+                answer = await self.api_client.generate_text(
+                    self.narrator_model, prompt, NARRATOR_ANSWER_SCHEMA, prefix=prefix, role="narrator", parse=self._parse_answer,
+                )
+            except ConnectionError as e:
+                raise ConnectionError(f"Error de conexión con el Narrador: {e}")
+            self._remember_answer(question, answer)
+            if future is not None:
+                future.set_result(answer)
+            return answer
+        except BaseException as e:
+            if future is not None:
+                future.set_exception(e)
+                future.exception() # Waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            if future is not None:
+                del self._in_flight[key]
+
+    async def validate_solution(self, detective_solution: str) -> Tuple[str, str]:
+        """
+        Validates the detective's final solution using the Narrator AI.
+        Returns a tuple: (verdict, analysis).
+        """
+        prompt = self._get_validation_prompt(detective_solution)
+        try:
+            validation = await self.api_client.generate_text(self.narrator_model, prompt, VALIDATION_SCHEMA, role="narrator", parse=self._read_validation)
+        except (ConnectionError, ValueError, KeyError) as e:
+            raise type(e)(f"Error al validar la solución con el Narrador: {e}")
+        return self._log_validation(detective_solution, validation)
+
+    async def stream_validation(self, detective_solution: str) -> AsyncGenerator[str, None]:
+        """
+        Yields the raw validation text as it is generated.
+        Async generators cannot return a value, so pass the joined chunks to `parse_streamed_validation` afterwards.
+        """
+        prompt = self._get_validation_prompt(detective_solution)
+        try:
+            async for chunk in self.api_client.stream_text(self.narrator_model, prompt, VALIDATION_SCHEMA, role="narrator"):
+                yield chunk
+        except ConnectionError as e:
+            raise ConnectionError(f"Error al validar la solución con el Narrador: {e}")
+
+    async def parse_streamed_validation(self, detective_solution: str, response_text: str) -> Tuple[str, str]:
+        """
+        Async variant of `Narrator.parse_streamed_validation`.
+        """
+        try:
+            return self.parse_validation(detective_solution, response_text)
+        except ParseError as e:
+            RETRIES.inc(reason="parse")
+            logger.info("Streamed verdict could not be parsed (%s), validating again without streaming", e)
+            return await self.validate_solution(detective_solution)
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+MAX_CACHE_ENTRIES = 1024 # Caches and refused prefixes remembered per process; the least recently used are forgotten first
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of a Spanish prompt (about four characters per token), for budgeting and reporting.
+    """
+    return (len(text) + 3) // 4
+
+class GeminiCacheRegistry:
+    """
+    Names of the Gemini `cachedContents` created for prompt prefixes, shared by every client in the process,
+    so all the calls of a game (and of concurrent games on the same story) reuse one cache.
+    Prefixes Gemini refused to cache are remembered too, to avoid asking again on every turn.
+    Both are bounded to `max_entries`, least recently used first, and expired caches are dropped on every put,
+    so a long-running server does not accumulate one entry per story it ever played.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict() # (model, prefix hash) -> (name, expires_at)
+        self._refused: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+    @staticmethod
+    def _key(model: str, prefix: str) -> Tuple[str, str]:
+        return model, hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prefix: str) -> str | None:
+        """
+        Returns the cache name for this prefix, unless it is about to expire.
+        """
+        key = self._key(model, prefix)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            name, expires_at = entry
+            if time.time() > expires_at - 30: # Leave a margin for the request in flight
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return name
+
+    def put(self, model: str, prefix: str, name: str, ttl: int) -> None:
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+            key = self._key(model, prefix)
+            self._entries[key] = (name, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, model: str, prefix: str) -> None:
+        with self._lock:
+            self._entries.pop(self._key(model, prefix), None)
+
+    def refuse(self, model: str, prefix: str) -> None:
+        key = self._key(model, prefix)
+        with self._lock:
+            self._refused[key] = None
+            self._refused.move_to_end(key)
+            while len(self._refused) > self.max_entries:
+                self._refused.popitem(last=False)
+
+    def refused(self, model: str, prefix: str) -> bool:
+        key = self._key(model, prefix)
+        with self._lock:
+            if key not in self._refused:
+                return False
+            self._refused.move_to_end(key)
+            return True
+
+_gemini_caches = GeminiCacheRegistry()
+
+def get_gemini_cache_registry() -> GeminiCacheRegistry:
+    return _gemini_caches
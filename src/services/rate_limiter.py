@@ -0,0 +1,406 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from src.services.retry import ProviderError
+from src.utils.cancellation import CancelToken
+from src.utils.metrics import QUEUE_WAIT, get_metrics
+from src.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Admission classes, most urgent first: a player waiting for an answer, AI-vs-AI games, story pool refills
+PRIORITIES = ("interactive", "background", "prefetch")
+
+RATE_LIMIT_COOLDOWN = 5.0 # Seconds a provider is left alone after a 429 that says nothing about when to retry
+MAX_SESSION_TAGS = 1000 # Past this many, the fairness tags of sessions already caught up are forgotten
+
+class RateLimitError(ProviderError):
+    """
+    The provider refused a call for exceeding its quota (HTTP 429).
+    `retry_after` is the wait it asked for, in seconds, if it gave one.
+    """
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message, 429, retry_after)
+
+def parse_retry_after(response_text: str, header: str | None = None) -> float | None:
+    """
+    Reads the wait a provider asks for before retrying: the Retry-After header (seconds or an HTTP date),
+    else Gemini's RetryInfo `"retryDelay": "17s"` in the error body.
+    """
+    if header:
+        try:
+            return max(float(header), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(header).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    match = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', response_text)
+    return float(match.group(1)) if match else None
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    Limits of one provider or model; 0 means unlimited.
+    """
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+    concurrency: int = 0
+
+def parse_rate_limits(spec: str) -> Dict[str, RateLimit]:
+    """
+    Parses RATE_LIMITS, "provider[:model]=requests/tokens/concurrency;..." with requests and tokens per minute,
+    e.g. "gemini=15/1000000;ollama=0/0/2". Missing or 0 values are unlimited. Malformed entries are ignored.
+    """
+    limits: Dict[str, RateLimit] = {}
+    for entry in spec.split(";"):
+        key, _, values = entry.strip().rpartition("=")
+        parts = (values.split("/") + ["", "", ""])[:3]
+        try:
+            requests, tokens, concurrency = (float(part or 0) for part in parts)
+        except ValueError:
+            continue
+        if key.strip():
+            limits[key.strip()] = RateLimit(requests, tokens, int(concurrency))
+    return limits
+
+class _Bucket:
+    """
+    A token bucket holding up to one minute's worth of `per_minute`, refilled continuously.
+    It may go negative when a call turns out to use more than was reserved for it.
+    """
+
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """
+        Seconds until `amount` (at most a full bucket) is available; 0 if it is now.
+        """
+        if self.capacity <= 0:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.level -= amount
+
+class _Waiter:
+    """
+    A call waiting for admission. `wake` is replaced by each wait so the limiter can signal the current one.
+    """
+    __slots__ = ("tokens", "priority", "enqueued", "admitted", "wake")
+
+    def __init__(self, tokens: int, priority: str, enqueued: float):
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued = enqueued
+        self.admitted = False
+        self.wake: Callable[[], None] = lambda: None
+
+class _Lane:
+    """
+    The buckets, calls in flight and admission queue of one rate-limited provider or model.
+    """
+
+    def __init__(self, key: str, limit: RateLimit, now: float):
+        self.key = key
+        self.limit = limit
+        self.requests = _Bucket(limit.requests_per_minute, now)
+        self.tokens = _Bucket(limit.tokens_per_minute, now)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.queue: List[Tuple[int, float, int, _Waiter]] = [] # (priority, fairness tag, arrival, waiter) heap
+        self.virtual_time = 0.0 # Fairness tag of the last admitted call
+        self.session_tags: Dict[str, float] = {} # Fairness tag of each session's last queued call
+        self.stats: Dict[str, Any] = {"admitted": 0, "queued": 0, "rate_limited": 0, "wait_seconds": 0.0, "max_wait": 0.0}
+
+    def delay(self, tokens: int, now: float) -> float | None:
+        """
+        Seconds until a call of `tokens` can start, or None if it must wait for a call in flight to end.
+        """
+        if self.limit.concurrency and self.in_flight >= self.limit.concurrency:
+            return None
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.paused_until - now, self.requests.delay(1), self.tokens.delay(tokens), 0.0)
+
+    def tag(self, session: str) -> float:
+        """
+        Start-time fair queueing: a session's calls are tagged one after the other, starting no earlier than
+        the call admitted last, so a session with many queued calls takes turns with the others instead of going first.
+        """
+        tag = max(self.session_tags.get(session, 0.0), self.virtual_time) + 1
+        self.session_tags[session] = tag
+        if len(self.session_tags) > MAX_SESSION_TAGS:
+            self.session_tags = {name: last for name, last in self.session_tags.items() if last > self.virtual_time}
+        return tag
+
+class Ticket:
+    """
+    An admitted call. `release` it when the call ends, with the tokens it actually used.
+    """
+
+    def __init__(self, limiter: "RateLimiter | None" = None, lane: _Lane | None = None, reserved: int = 0):
+        self._limiter = limiter
+        self._lane = lane
+        self._reserved = reserved
+
+    def release(self, used_tokens: int | None = None) -> None:
+        if self._limiter is not None and self._lane is not None:
+            self._limiter._release(self._lane, self._reserved, used_tokens)
+            self._lane = None
+
+_UNLIMITED = Ticket()
+
+class RateLimiter:
+    """
+    Admission control for LLM calls shared by every game of the process. Each rate-limited provider
+    (or model) has a token bucket for requests and one for tokens per minute, an optional cap on calls
+    in flight, and a queue ordered by priority (PRIORITIES) and then fairly across sessions.
+    Blocking clients wait in `acquire`, asyncio clients in `acquire_async`; calls to providers
+    without limits are admitted at once.
+    """
+
+    def __init__(self, limits: Dict[str, RateLimit], clock: Callable[[], float] = time.monotonic):
+        self.limits = limits
+        self.clock = clock # Seconds, monotonic; the buckets refill and waits are measured with it
+        self._lock = threading.Lock()
+        self._lanes: Dict[str, _Lane] = {}
+        self._arrivals = itertools.count()
+
+    def _lane(self, provider_model: str) -> _Lane | None:
+        """
+        The lane of a call: its model's limits if it has any, else its provider's (one bucket for every model
+        of a provider, e.g. a single local Ollama). Called with the lock held.
+        """
+        key = provider_model if provider_model in self.limits else provider_model.partition(":")[0]
+        limit = self.limits.get(key)
+        if limit is None:
+            return None
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(key, limit, self.clock())
+        return lane
+
+    def _enqueue(self, lane: _Lane, tokens: int, priority: str, session: str) -> _Waiter:
+        now = self.clock()
+        waiter = _Waiter(tokens, priority if priority in PRIORITIES else "background", now)
+        rank = PRIORITIES.index(waiter.priority)
+        heapq.heappush(lane.queue, (rank, lane.tag(session), next(self._arrivals), waiter))
+        return waiter
+
+    def _dispatch(self, lane: _Lane) -> float | None:
+        """
+        Admits the calls at the head of the queue while the limits allow, waking them.
+        Returns how long the next one has to wait (None: until a call ends). Called with the lock held.
+        """
+        now = self.clock()
+        while lane.queue:
+            _, tag, _, waiter = lane.queue[0]
+            delay = lane.delay(waiter.tokens, now)
+            if delay != 0.0:
+                if delay is not None:
+                    waiter.wake() # Its wait may have no timeout; it has to come back when the buckets have refilled
+                return delay
+            heapq.heappop(lane.queue)
+            lane.requests.take(1)
+            lane.tokens.take(waiter.tokens)
+            lane.in_flight += 1
+            lane.virtual_time = tag
+            waiter.admitted = True
+            waited = now - waiter.enqueued
+            lane.stats["admitted"] += 1
+            lane.stats["wait_seconds"] += waited
+            lane.stats["max_wait"] = max(lane.stats["max_wait"], waited)
+            if waited > 0.001:
+                lane.stats["queued"] += 1
+            QUEUE_WAIT.observe(waited, key=lane.key, priority=waiter.priority)
+            waiter.wake()
+        return None
+
+    def _abandon(self, lane: _Lane, waiter: _Waiter) -> None:
+        """
+        Takes a waiter that gave up (cancelled) out of the queue, or gives back its slot if it was admitted meanwhile.
+        """
+        with self._lock:
+            if waiter.admitted:
+                admitted = True
+            else:
+                admitted = False
+                lane.queue = [entry for entry in lane.queue if entry[3] is not waiter]
+                heapq.heapify(lane.queue)
+                self._dispatch(lane)
+        if admitted:
+            self._release(lane, waiter.tokens, 0)
+
+    def _release(self, lane: _Lane, reserved: int, used_tokens: int | None) -> None:
+        with self._lock:
+            lane.in_flight -= 1
+            if used_tokens is not None:
+                lane.tokens.take(used_tokens - reserved) # Charge what the call really used, output included
+            self._dispatch(lane)
+
+    def acquire(self, provider_model: str, tokens: int, priority: str = "background", session: str = "", cancel_token: CancelToken | None = None) -> Ticket:
+        """
+        Waits (blocking) until a call of about `tokens` prompt tokens may be sent to `provider_model`.
+        Returns early, raising GameCancelled, if `cancel_token` is cancelled while waiting.
+        """
+        woken = threading.Event()
+        with self._lock:
+            lane = self._lane(provider_model)
+            if lane is None:
+                return _UNLIMITED
+            waiter = self._enqueue(lane, tokens, priority, session)
+            waiter.wake = woken.set
+            delay = self._dispatch(lane)
+        if waiter.admitted:
+            return Ticket(self, lane, tokens)
+
+        unlink = cancel_token.on_cancel(woken.set) if cancel_token is not None else None
+        with span("llm.queue", "llm", key=lane.key, priority=waiter.priority):
+            try:
+                while True:
+                    woken.wait(delay)
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    with self._lock:
+                        woken.clear()
+                        if not waiter.admitted:
+                            delay = self._dispatch(lane)
+                        if waiter.admitted:
+                            return Ticket(self, lane, tokens)
+            except BaseException:
+                self._abandon(lane, waiter)
+                raise
+            finally:
+                if unlink is not None:
+                    unlink() # The game's token outlives this call
+
+    async def acquire_async(self, provider_model: str, tokens: int, priority: str = "background", session: str = "") -> Ticket:
+        """
+        Like `acquire`, without blocking the event loop; cancelling the awaiting task leaves the queue.
+        """
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+        with self._lock:
+            lane = self._lane(provider_model)
+            if lane is None:
+                return _UNLIMITED
+            waiter = self._enqueue(lane, tokens, priority, session)
+            waiter.wake = functools.partial(loop.call_soon_threadsafe, _set_result, woken)
+            delay = self._dispatch(lane)
+        if waiter.admitted:
+            return Ticket(self, lane, tokens)
+
+        with span("llm.queue", "llm", key=lane.key, priority=waiter.priority):
+            try:
+                while True:
+                    await asyncio.wait((woken,), timeout=delay)
+                    woken = loop.create_future()
+                    with self._lock:
+                        waiter.wake = functools.partial(loop.call_soon_threadsafe, _set_result, woken)
+                        if not waiter.admitted:
+                            delay = self._dispatch(lane)
+                        if waiter.admitted:
+                            return Ticket(self, lane, tokens)
+            except BaseException:
+                self._abandon(lane, waiter)
+                raise
+
+    def pause(self, provider_model: str, retry_after: float | None) -> None:
+        """
+        Stops admitting calls to the provider (or model) for `retry_after` seconds after it answered 429.
+        """
+        with self._lock:
+            lane = self._lane(provider_model)
+            if lane is None:
+                return
+            lane.paused_until = max(lane.paused_until, self.clock() + (retry_after or RATE_LIMIT_COOLDOWN))
+            lane.stats["rate_limited"] += 1
+            if lane.queue:
+                lane.queue[0][3].wake() # The head re-checks and sleeps until the pause ends
+        logger.warning("%s is rate limited, pausing it for %.1fs", lane.key, retry_after or RATE_LIMIT_COOLDOWN)
+
+    def queue_depths(self) -> Dict[Tuple[str, str], float]:
+        """
+        Calls waiting for admission by (lane, priority), for the /metrics gauge.
+        """
+        with self._lock:
+            depths: Dict[Tuple[str, str], float] = {}
+            for lane in self._lanes.values():
+                for priority in PRIORITIES:
+                    depths[(lane.key, priority)] = 0
+                for _, _, _, waiter in lane.queue:
+                    depths[(lane.key, waiter.priority)] += 1
+            return depths
+
+    def in_flight(self) -> Dict[Tuple[str], float]:
+        with self._lock:
+            return {(lane.key,): lane.in_flight for lane in self._lanes.values()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns, per rate-limited provider or model, its limits, calls in flight and queued,
+        the capacity left in its buckets and how long admitted calls have waited.
+        """
+        now = self.clock()
+        stats: Dict[str, Any] = {}
+        with self._lock:
+            for lane in self._lanes.values():
+                lane.requests.refill(now)
+                lane.tokens.refill(now)
+                lane_stats = dict(lane.stats)
+                lane_stats["wait_seconds"] = round(lane_stats["wait_seconds"], 3)
+                lane_stats["max_wait"] = round(lane_stats["max_wait"], 3)
+                lane_stats.update({
+                    "requests_per_minute": lane.limit.requests_per_minute,
+                    "tokens_per_minute": lane.limit.tokens_per_minute,
+                    "concurrency": lane.limit.concurrency,
+                    "in_flight": lane.in_flight,
+                    "waiting": len(lane.queue),
+                    "requests_available": round(lane.requests.level, 1) if lane.requests.capacity else None,
+                    "tokens_available": round(lane.tokens.level) if lane.tokens.capacity else None,
+                    "paused_for": round(max(lane.paused_until - now, 0.0), 1),
+                })
+                stats[lane.key] = lane_stats
+        return stats
+
+def _set_result(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+_rate_limiter: RateLimiter | None = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter(config: Dict[str, Any]) -> RateLimiter:
+    """
+    Returns the process-wide rate limiter, built from `rate_limits` on first use.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            limiter = RateLimiter(parse_rate_limits(config.get("rate_limits", "")))
+            get_metrics().gauge("blackstories_llm_queue_depth", "LLM calls waiting for admission by rate-limited provider and priority.", ("key", "priority"), limiter.queue_depths)
+            get_metrics().gauge("blackstories_llm_in_flight", "LLM calls in flight by rate-limited provider.", ("key",), limiter.in_flight)
+            _rate_limiter = limiter
+        return _rate_limiter
@@ -0,0 +1,197 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from src.utils.cancellation import GameCancelled
+from src.utils.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Error kinds that count against an endpoint's circuit breaker; the others say nothing about its health
+BREAKER_FAILURES = ("timeout", "connection", "server")
+
+class ProviderError(Exception):
+    """
+    An LLM provider answered with an HTTP error. `retry_after` is the wait it asked for (Retry-After), if any.
+    """
+
+    def __init__(self, message: str, status: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class ParseError(ValueError):
+    """
+    A provider reply that could not be understood: malformed JSON, a missing field, or an answer
+    the caller's `parse` callback rejected. Asking again may well get a usable reply.
+    """
+
+class ProviderTimeout(ConnectionError):
+    """
+    Connecting to a provider or reading its response timed out.
+    """
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised without calling an endpoint whose circuit breaker is open after repeated failures.
+    """
+
+def classify_error(error: BaseException) -> str | None:
+    """
+    The kind of a failed LLM call: "timeout", "connection", "rate_limit" (429), "server" (5xx) or "parse"
+    (a ParseError). None for errors a retry cannot fix: cancellations, an open circuit, other 4xx
+    responses (bad request, bad API key), configuration errors (a missing API key or host, an unknown
+    provider) and unexpected errors.
+    """
+    if isinstance(error, (GameCancelled, CircuitOpenError)):
+        return None
+    if isinstance(error, ProviderTimeout):
+        return "timeout"
+    if isinstance(error, ProviderError):
+        if error.status == 429:
+            return "rate_limit"
+        if error.status is not None and error.status >= 500:
+            return "server"
+        return None
+    if isinstance(error, ConnectionError):
+        return "connection"
+    if isinstance(error, ParseError):
+        return "parse"
+    return None
+
+class RetryPolicy:
+    """
+    How often and how long to wait before retrying a failed LLM call: exponential backoff with full jitter
+    (a random wait between 0 and base_delay * 2^attempt, capped at max_delay), so clients that failed
+    together do not retry together. A provider's Retry-After is honored when it is within max_delay;
+    a longer one is not waited for.
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, kind: str | None, attempt: int, retry_after: float | None = None) -> float | None:
+        """
+        Seconds to wait before retrying after failed attempt number `attempt` (0-based) of kind `kind`,
+        or None if the call should not be retried.
+        """
+        if kind is None or attempt + 1 >= self.max_attempts:
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None
+            return retry_after + backoff / 4 # A little jitter so the callers told the same wait spread out
+        return backoff
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RetryPolicy":
+        return cls(
+            max_attempts=config.get("retry_max_attempts", 4),
+            base_delay=config.get("retry_base_delay", 0.5),
+            max_delay=config.get("retry_max_delay", 20.0),
+        )
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint that keeps failing. After `failure_threshold` failures in a row it opens:
+    calls fail at once with CircuitOpenError for `reset_timeout` seconds. Then it lets one trial call
+    through (half-open); the breaker closes if that call succeeds and opens again if it fails.
+    """
+    STATES = ("closed", "half_open", "open")
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.endpoint = endpoint
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock # Seconds, monotonic; `reset_timeout` is measured with it
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """
+        Raises CircuitOpenError if the endpoint must not be called now.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return
+            wait = max(self.reset_timeout - (self.clock() - self.opened_at), 0.0)
+        raise CircuitOpenError(f"{self.endpoint} no está disponible tras varios fallos seguidos; se reintentará en {wait:.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Circuit of %s closed", self.endpoint)
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = self.clock()
+                logger.warning("Circuit of %s opened after %d failures", self.endpoint, self.failures)
+
+    def release_trial(self) -> None:
+        """
+        Ends a half-open trial call that neither succeeded nor failed (cancelled, or an error not about the endpoint).
+        """
+        with self._lock:
+            self._trial_running = False
+
+class CircuitBreakers:
+    """
+    One circuit breaker per endpoint ("provider:model"), shared by every client of the process.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def states(self) -> Dict[Tuple[str], float]:
+        """
+        0 (closed), 1 (half-open) or 2 (open) per endpoint, for the /metrics gauge.
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {(breaker.endpoint,): CircuitBreaker.STATES.index(breaker.state) for breaker in breakers}
+
+_breakers: CircuitBreakers | None = None
+_breakers_lock = threading.Lock()
+
+def get_circuit_breakers(config: Dict[str, Any]) -> CircuitBreakers:
+    """
+    Returns the process-wide circuit breakers, set up from `circuit_failure_threshold` and `circuit_reset_timeout` on first use.
+    """
+    global _breakers
+    with _breakers_lock:
+        if _breakers is None:
+            breakers = CircuitBreakers(config.get("circuit_failure_threshold", 5), config.get("circuit_reset_timeout", 30.0))
+            get_metrics().gauge("blackstories_circuit_state", "Circuit breaker state by endpoint: 0 closed, 1 half-open, 2 open.", ("endpoint",), breakers.states)
+            _breakers = breakers
+        return _breakers
@@ -0,0 +1,183 @@
+import asyncio
+import socket
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Tuple
+
+from src.services.cassette import Cassette
+from src.services.connection_pool import ConnectionPool
+from src.services.prompt_cache import GeminiCacheRegistry
+from src.services.story_pool import StoryPool
+from src.services.story_store import StoryStore
+from src.utils.tracing import Tracer
+
+# Objects shared by every game (or not owned by any); the memory estimate of a game stops at them
+SHARED_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    socket.socket, asyncio.AbstractEventLoop, type(threading.Lock()), type(threading.RLock()), threading.Thread,
+    ConnectionPool, StoryPool, StoryStore, GeminiCacheRegistry, Cassette, Tracer,
+)
+
+def estimate_memory(obj: Any) -> int:
+    """
+    Approximate bytes held by a game: the sizes of the objects reachable from it through containers
+    and instance attributes, each counted once, excluding the process-wide services in SHARED_TYPES.
+    """
+    seen = set()
+    pending = [obj]
+    total = 0
+    while pending:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0)
+        if isinstance(current, (str, bytes, int, float, bool)) or current is None:
+            continue
+        try:
+            if isinstance(current, dict):
+                pending.extend(current.keys())
+                pending.extend(current.values())
+            elif isinstance(current, (list, tuple, set, frozenset, deque)):
+                pending.extend(current)
+        except RuntimeError: # Resized by a game still running in another thread; the estimate can miss it
+            pass
+        attributes = getattr(current, "__dict__", None)
+        if attributes is not None:
+            pending.append(attributes)
+        for slot in getattr(type(current), "__slots__", ()):
+            if hasattr(current, slot):
+                pending.append(getattr(current, slot))
+    return total
+
+class SessionStore:
+    """
+    The game engines of the web sessions, keyed by session id, bounded in size and idle time.
+    Every lookup refreshes a session; once `max_size` sessions are held, the least recently used
+    one is evicted to make room, and sessions idle for more than `idle_ttl` seconds expire.
+    A finished game stays reachable for `finished_ttl` seconds (to save its conversation) and is then dropped.
+    """
+
+    def __init__(self, max_size: int = 200, idle_ttl: float = 1800.0, finished_ttl: float = 300.0):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict() # id -> (game, last used, ttl), LRU first
+        self._stats: Dict[str, int] = {
+            "started": 0,  # Games stored
+            "evicted": 0,  # Sessions dropped to stay within max_size
+            "expired": 0,  # Sessions dropped after their TTL
+            "released": 0, # Sessions ended explicitly
+        }
+
+    def _expire(self, now: float) -> None:
+        """
+        Drops the expired sessions. Called with the lock held.
+        """
+        expired = [session_id for session_id, (_, last_used, ttl) in self._sessions.items() if now - last_used > ttl]
+        for session_id in expired:
+            del self._sessions[session_id]
+        self._stats["expired"] += len(expired)
+
+    def put(self, session_id: str, game: Any) -> None:
+        """
+        Stores the game of a session, replacing (and releasing) the session's previous game.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._sessions.pop(session_id, None)
+            while len(self._sessions) >= self.max_size:
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+            self._sessions[session_id] = (game, now, self.idle_ttl)
+            self._stats["started"] += 1
+
+    def get(self, session_id: str) -> Any | None:
+        """
+        Returns the session's game, or None if there is none or it expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            game, last_used, ttl = entry
+            if now - last_used > ttl:
+                del self._sessions[session_id]
+                self._stats["expired"] += 1
+                return None
+            self._sessions[session_id] = (game, now, ttl)
+            self._sessions.move_to_end(session_id)
+            return game
+
+    def finish(self, session_id: str, game: Any) -> None:
+        """
+        Marks the session's game as over: it expires `finished_ttl` seconds after its last use.
+        Does nothing if the session has started another game since.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[0] is game:
+                self._sessions[session_id] = (entry[0], entry[1], min(entry[2], self.finished_ttl))
+
+    def release(self, session_id: str, game: Any | None = None) -> bool:
+        """
+        Drops the session's game now; with `game`, only if the session still holds that game.
+        Returns whether a game was dropped.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or (game is not None and entry[0] is not game):
+                return False
+            del self._sessions[session_id]
+            self._stats["released"] += 1
+            return True
+
+    def games(self) -> List[Any]:
+        """
+        Returns the games of the live sessions, dropping the expired ones first.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return [game for game, _, _ in self._sessions.values()]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get_stats(self, memory: bool = False) -> Dict[str, Any]:
+        """
+        Returns the session counters and the number of live sessions.
+        With `memory`, also the estimated bytes held by the live games (walks every game, so keep it off hot paths).
+        """
+        games = self.games()
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["active"] = len(games)
+        stats["max_size"] = self.max_size
+        if memory:
+            stats["memory_bytes"] = sum(estimate_memory(game) for game in games)
+        return stats
+
+_session_store: SessionStore | None = None
+_session_store_lock = threading.Lock()
+
+def get_session_store(config: Dict[str, Any]) -> SessionStore:
+    """
+    Returns the process-wide session store, sized from `session_max_games`, `session_idle_ttl`
+    and `session_finished_ttl` on first use.
+    """
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = SessionStore(
+                max_size=max(1, config.get("session_max_games", 200)),
+                idle_ttl=config.get("session_idle_ttl", 1800.0),
+                finished_ttl=config.get("session_finished_ttl", 300.0),
+            )
+        return _session_store
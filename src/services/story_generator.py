@@ -1,10 +1,24 @@
 import json
+import logging
 import re # Import the re module for regex operations
+import time
 from json_repair import repair_json
 from typing import Dict, Any
 from src.services.api_client import APIClient
+from src.services.async_api_client import AsyncAPIClient
 from src.models.story import Story
+from src.services.retry import ParseError
+from src.services.story_store import get_story_store
+from src.utils.tracing import traced
+from src.utils.metrics import RETRIES, STORY_GENERATION
 from src.config.prompts import get_story_generation_prompt
+from src.config.schemas import STORY_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+# Extra generations requested when the LLM repeats a stored plot and the policy is "reject"
+DUPLICATE_RETRIES = 2
+
 class StoryGenerator:
     """
     Generates Black Stories using an LLM.
@@ -13,6 +27,8 @@ class StoryGenerator:
     def __init__(self, api_client: APIClient, narrator_model: str):
         self.api_client = api_client
         self.narrator_model = narrator_model
+        self.story_store = get_story_store(api_client.config)
+        self.duplicate_policy = api_client.config.get("story_duplicate_policy", "reuse")
 
     def _get_story_generation_prompt(self, difficulty: str) -> str:
         """
@@ -23,35 +39,72 @@ class StoryGenerator:
     def generate_story(self, difficulty: str) -> Story:
         """
         Generates a new Black Story using the Narrator AI.
-        Handles connection errors with retry mechanism.
+        Transient errors and unreadable stories are retried by the API client.
         """
         prompt = self._get_story_generation_prompt(difficulty)
-        while True:
+        started = time.monotonic()
+        try:
+            for attempt in range(DUPLICATE_RETRIES + 1):
+                story = self.api_client.generate_text(self.narrator_model, prompt, STORY_SCHEMA, role="story", parse=self._parse_story)
+                story = self._keep_story(story, difficulty, attempt == DUPLICATE_RETRIES)
+                if story is not None:
+                    STORY_GENERATION.observe(time.monotonic() - started, model=self.narrator_model)
+                    return story
+        except (ConnectionError, ValueError) as e:
+            raise type(e)(f"Error al generar la historia: {e}")
+
+    def _keep_story(self, story: Story, difficulty: str, last_attempt: bool) -> Story | None:
+        """
+        Saves a freshly generated story in the story store and decides what to play.
+        A near-duplicate of a stored story is either replaced by the stored original ("reuse")
+        or rejected so a new one is generated ("reject", returns None). After the last attempt
+        the repeat is played anyway rather than failing the game.
+        """
+        if self.story_store is None:
+            return story
+        story_id, is_new = self.story_store.add(story, difficulty, self.narrator_model)
+        if is_new:
+            return story
+        logger.info("Generated story is a near-duplicate of stored story %s", story_id)
+        if self.duplicate_policy == "reuse":
+            return self.story_store.get(story_id) or story
+        if last_attempt:
+            return story
+        RETRIES.inc(reason="duplicate_story")
+        return None
+
+    @traced("parse.story", "parse")
+    def _parse_story(self, response_text: str) -> Story:
+        """
+        Extracts and repairs the story JSON from the raw response and builds the Story.
+        """
+        json_string = ""
+        story_data = None
+        try:
             try:
-                response_text = self.api_client.generate_text(self.narrator_model, prompt)
-                
+                # Schema-constrained replies are already clean JSON
+                story_data = json.loads(response_text)
+            except json.JSONDecodeError:
                 # Attempt to find and extract JSON from the response
                 json_string = self._extract_json_from_response(response_text)
                 json_string = repair_json(json_string)
                 story_data = json.loads(json_string)
-                mystery_situation = story_data["situacion_misteriosa"]
-                hidden_solution = story_data.get("solucion_oculta")
+            mystery_situation = story_data["situacion_misteriosa"]
+            hidden_solution = story_data.get("solucion_oculta")
+            if hidden_solution is None:
+                # Handle potential misspelling from LLM
+                hidden_solution = story_data.get("solucion_ocruta")
                 if hidden_solution is None:
-                    # Handle potential misspelling from LLM
-                    hidden_solution = story_data.get("solucion_ocruta")
-                    if hidden_solution is None:
-                        raise KeyError("Neither 'solucion_oculta' nor 'solucion_ocruta' found in response.")
+                    raise KeyError("Neither 'solucion_oculta' nor 'solucion_ocruta' found in response.")
 
-                return Story(
-                    mystery_situation=mystery_situation,
-                    hidden_solution=hidden_solution
-                )
-            except json.JSONDecodeError as e:
-                raise ValueError(f"Error de formato JSON al generar la historia: {e}. Raw response: {json_string}")
-            except KeyError as e:
-                raise ValueError(f"Error al generar la historia: Falta la clave esperada en el JSON: {e}. Received data: {story_data}")
-            except (ConnectionError, ValueError) as e:
-                raise type(e)(f"Error al generar la historia: {e}")
+            return Story(
+                mystery_situation=mystery_situation,
+                hidden_solution=hidden_solution
+            )
+        except json.JSONDecodeError as e:
+            raise ParseError(f"Error de formato JSON al generar la historia: {e}. Raw response: {json_string}")
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ParseError(f"Error al generar la historia: Falta la clave esperada en el JSON: {e}. Received data: {story_data}")
 
     def _extract_json_from_response(self, response_text: str) -> str:
         """
@@ -87,3 +140,27 @@ class StoryGenerator:
         json_string = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F]', '', json_string)
 
         return json_string
+
+class AsyncStoryGenerator(StoryGenerator):
+    """
+    asyncio variant of the StoryGenerator, backed by an AsyncAPIClient.
+    """
+
+    def __init__(self, api_client: AsyncAPIClient, narrator_model: str):
+        super().__init__(api_client, narrator_model)
+
+    async def generate_story(self, difficulty: str) -> Story:
+        """
+        Generates a new Black Story using the Narrator AI.
+        """
+        prompt = self._get_story_generation_prompt(difficulty)
+        started = time.monotonic()
+        try:
+            for attempt in range(DUPLICATE_RETRIES + 1):
+                story = await self.api_client.generate_text(self.narrator_model, prompt, STORY_SCHEMA, role="story", parse=self._parse_story)
+                story = self._keep_story(story, difficulty, attempt == DUPLICATE_RETRIES)
+                if story is not None:
+                    STORY_GENERATION.observe(time.monotonic() - started, model=self.narrator_model)
+                    return story
+        except (ConnectionError, ValueError) as e:
+            raise type(e)(f"Error al generar la historia: {e}")
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, Any, Deque, List, Set, Tuple
+
+from src.models.story import Story
+from src.services.api_client import APIClient
+from src.services.story_generator import StoryGenerator
+
+logger = logging.getLogger(__name__)
+
+# Pool key: (difficulty, narrator_model)
+PoolKey = Tuple[str, str]
+
+# Unplayable stories a refill tolerates in a row before giving up until the next take()
+MAX_INVALID_STORIES = 3
+
+class StoryPool:
+    """
+    Keeps up to `size` ready-made stories per (difficulty, narrator_model) so a game can start
+    without waiting for story generation. Taking a story schedules a background refill, and the
+    pool is saved to `path` so ready stories survive restarts.
+    """
+
+    def __init__(self, config: Dict[str, Any], size: int = 3, path: str = "logs/story_pool.json"):
+        self.config = config
+        self.size = size
+        self.path = path
+        self._stories: Dict[PoolKey, Deque[Story]] = {}
+        self._refilling: Set[PoolKey] = set()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # Held for a whole save; never taken while holding `_lock`
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "generated": 0, "failed_refills": 0}
+        self._load()
+
+    @staticmethod
+    def _key_name(key: PoolKey) -> str:
+        return f"{key[0]}|{key[1]}"
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("No se pudo leer el pool de historias %s: %s", self.path, e)
+            return
+        for key_name, stories in data.items():
+            difficulty, narrator_model = key_name.split("|", 1)
+            self._stories[(difficulty, narrator_model)] = deque(
+                Story(story["mystery_situation"], story["hidden_solution"]) for story in stories
+            )
+
+    def _save(self) -> None:
+        """
+        Writes the pool to a temporary file and renames it over `path`, so an interrupted save never
+        leaves a corrupt file behind. Saves are serialized: concurrent refills and takes share the
+        temporary file, and the last snapshot taken must be the last one written.
+        """
+        with self._save_lock:
+            with self._lock:
+                data = {
+                    self._key_name(key): [{"mystery_situation": s.mystery_situation, "hidden_solution": s.hidden_solution} for s in stories]
+                    for key, stories in self._stories.items()
+                }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning("No se pudo guardar el pool de historias %s: %s", self.path, e)
+
+    @staticmethod
+    def _is_valid(story: Story) -> bool:
+        """
+        Rejects stories that would make an unplayable game (empty or self-revealing).
+        """
+        situation = story.mystery_situation.strip()
+        solution = story.hidden_solution.strip()
+        return bool(situation) and bool(solution) and situation != solution
+
+    def take(self, difficulty: str, narrator_model: str) -> Story | None:
+        """
+        Returns a ready story, or None when the pool is empty and the caller must generate one live.
+        Either way a background refill is scheduled.
+        """
+        key = (difficulty, narrator_model)
+        with self._lock:
+            stories = self._stories.get(key)
+            story = stories.popleft() if stories else None
+            self._stats["hits" if story else "misses"] += 1
+        if story is not None:
+            self._save()
+        self.refill(difficulty, narrator_model)
+        return story
+
+    def refill(self, difficulty: str, narrator_model: str) -> None:
+        """
+        Starts a background thread that generates stories until the pool for this key is full.
+        At most one refill runs per key.
+        """
+        key = (difficulty, narrator_model)
+        with self._lock:
+            if key in self._refilling or len(self._stories.get(key, ())) >= self.size:
+                return
+            self._refilling.add(key)
+        threading.Thread(target=self._refill, args=(key,), daemon=True).start()
+
+    def _refill(self, key: PoolKey) -> None:
+        difficulty, narrator_model = key
+        # Lowest admission priority: a refill must not delay the games being played. Nobody waits for it either,
+        # so a repeated plot is regenerated instead of queueing a story players have seen
+        story_generator = StoryGenerator(APIClient({**self.config, "llm_priority": "prefetch", "llm_session": "story-pool", "story_duplicate_policy": "reject"}), narrator_model)
+        invalid = 0
+        try:
+            while True:
+                with self._lock:
+                    if len(self._stories.get(key, ())) >= self.size:
+                        return
+                try:
+                    story = story_generator.generate_story(difficulty)
+                except Exception as e:
+                    # Stop here; the next take() schedules another attempt
+                    logger.warning("Refill for %s failed: %s", self._key_name(key), e)
+                    with self._lock:
+                        self._stats["failed_refills"] += 1
+                    return
+                if not self._is_valid(story):
+                    invalid += 1
+                    if invalid >= MAX_INVALID_STORIES:
+                        # The narrator keeps producing unplayable stories: stop rather than spin on it
+                        logger.warning("Refill for %s gave up after %d unplayable stories", self._key_name(key), invalid)
+                        with self._lock:
+                            self._stats["failed_refills"] += 1
+                        return
+                    continue
+                invalid = 0
+                with self._lock:
+                    self._stories.setdefault(key, deque()).append(story)
+                    self._stats["generated"] += 1
+                self._save()
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns hit/miss counters and the number of ready stories per key.
+        """
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["ready"] = {self._key_name(key): len(stories) for key, stories in self._stories.items()}
+        return stats
+
+    def keys(self) -> List[PoolKey]:
+        with self._lock:
+            return list(self._stories.keys())
+
+_shared_pool: StoryPool | None = None
+_shared_pool_lock = threading.Lock()
+
+def get_story_pool(config: Dict[str, Any]) -> StoryPool | None:
+    """
+    Returns the process-wide story pool, or None when it is disabled (`story_pool_size` 0).
+    It is also disabled while a cassette is recording or replaying, since background generation
+    would interleave unpredictably with the game's own calls.
+    On first use, keys restored from disk are topped up in the background.
+    """
+    global _shared_pool
+    if config.get("story_pool_size", 0) <= 0 or config.get("cassette_mode"):
+        return None
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = StoryPool(config, size=config["story_pool_size"], path=config.get("story_pool_path", "logs/story_pool.json"))
+            for difficulty, narrator_model in _shared_pool.keys():
+                _shared_pool.refill(difficulty, narrator_model)
+        return _shared_pool
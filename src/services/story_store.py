@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, Any, List, Tuple
+
+from src.models.story import Story
+
+# MinHash signature of NUM_PERM values, split into BANDS bands of ROWS values for LSH bucketing.
+# With 16 x 4, stories sharing ~60% of their shingles collide in at least one band ~90% of the time,
+# while unrelated stories (~10% shared) almost never do, so only real candidates are compared.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_perm_rng = random.Random(1) # Fixed, so signatures stay comparable across runs
+_PERMUTATIONS = [(_perm_rng.randrange(1, _MERSENNE_PRIME), _perm_rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercases, strips accents and punctuation, and collapses whitespace.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """
+    Character shingles of the normalized text (short texts become a single shingle).
+    """
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash(text: str) -> List[int]:
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def estimate_similarity(signature_a: List[int], signature_b: List[int]) -> float:
+    """
+    Estimated Jaccard similarity of two MinHash signatures.
+    """
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+def _band_buckets(signature: List[int]) -> List[int]:
+    return [zlib.crc32(struct.pack(f"<{ROWS}Q", *signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+def _pack(signature: List[int]) -> bytes:
+    return struct.pack(f"<{NUM_PERM}Q", *signature)
+
+def _unpack(blob: bytes) -> List[int]:
+    return list(struct.unpack(f"<{NUM_PERM}Q", blob))
+
+class StoryStore:
+    """
+    Durable SQLite repository of generated stories, indexed by difficulty and narrator model.
+    Near-duplicates of `mystery_situation` are found with MinHash + LSH banding, so a story
+    can be checked against the whole corpus without scanning it, and random stories are
+    fetched through the primary key index without loading the corpus into memory.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.6):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS stories (
+                id INTEGER PRIMARY KEY,
+                difficulty TEXT NOT NULL,
+                narrator_model TEXT NOT NULL,
+                mystery_situation TEXT NOT NULL,
+                hidden_solution TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS stories_by_key ON stories (difficulty, narrator_model, id);
+            CREATE TABLE IF NOT EXISTS story_bands (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                story_id INTEGER NOT NULL REFERENCES stories (id)
+            );
+            CREATE INDEX IF NOT EXISTS story_bands_by_bucket ON story_bands (band, bucket);
+            """
+        )
+        self._conn.commit()
+
+    def find_duplicate(self, mystery_situation: str) -> Tuple[int, float] | None:
+        """
+        Returns (story_id, similarity) of the most similar stored story at or above the threshold, or None.
+        """
+        signature = minhash(mystery_situation)
+        with self._lock:
+            return self._find_duplicate(signature)
+
+    def _find_duplicate(self, signature: List[int]) -> Tuple[int, float] | None:
+        """
+        The lookup behind `find_duplicate`; the caller holds `self._lock`.
+        """
+        buckets = _band_buckets(signature)
+        clauses = " OR ".join("(band = ? AND bucket = ?)" for _ in buckets)
+        params = [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        rows = self._conn.execute(
+            f"SELECT id, signature FROM stories WHERE id IN (SELECT story_id FROM story_bands WHERE {clauses})",
+            params,
+        ).fetchall()
+
+        best: Tuple[int, float] | None = None
+        for story_id, blob in rows:
+            similarity = estimate_similarity(signature, _unpack(blob))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (story_id, similarity)
+        return best
+
+    def add(self, story: Story, difficulty: str, narrator_model: str, source: str = "generated") -> Tuple[int, bool]:
+        """
+        Stores a story unless it is a near-duplicate of a stored one.
+        Returns (story_id, is_new); for a duplicate, story_id is the id of the existing story.
+        The check and the insert hold the lock together, so concurrent refills cannot both add the same story.
+        """
+        signature = minhash(story.mystery_situation)
+        with self._lock:
+            duplicate = self._find_duplicate(signature)
+            if duplicate is not None:
+                return duplicate[0], False
+            cursor = self._conn.execute(
+                "INSERT INTO stories (difficulty, narrator_model, mystery_situation, hidden_solution, source, created_at, signature) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (difficulty, narrator_model, story.mystery_situation, story.hidden_solution, source, time.time(), _pack(signature)),
+            )
+            story_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO story_bands (band, bucket, story_id) VALUES (?, ?, ?)",
+                [(band, bucket, story_id) for band, bucket in enumerate(_band_buckets(signature))],
+            )
+            self._conn.commit()
+        return story_id, True
+
+    def get(self, story_id: int) -> Story | None:
+        with self._lock:
+            row = self._conn.execute("SELECT mystery_situation, hidden_solution FROM stories WHERE id = ?", (story_id,)).fetchone()
+        return Story(*row) if row else None
+
+    def random(self, difficulty: str | None = None, narrator_model: str | None = None) -> Story | None:
+        """
+        Returns a random stored story, optionally restricted to a difficulty and narrator model.
+        Picks a random id in the key's id range and seeks to the next existing row through the index,
+        so the cost does not grow with the size of the corpus.
+        """
+        conditions, params = [], []
+        if difficulty is not None:
+            conditions.append("difficulty = ?")
+            params.append(difficulty)
+        if narrator_model is not None:
+            conditions.append("narrator_model = ?")
+            params.append(narrator_model)
+        where = " AND ".join(conditions) or "1"
+
+        with self._lock:
+            low, high = self._conn.execute(f"SELECT MIN(id), MAX(id) FROM stories WHERE {where}", params).fetchone()
+            if low is None:
+                return None
+            row = self._conn.execute(
+                f"SELECT mystery_situation, hidden_solution FROM stories WHERE {where} AND id >= ? ORDER BY id LIMIT 1",
+                params + [random.randint(low, high)],
+            ).fetchone()
+        return Story(*row)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the number of stored stories per difficulty and narrator model.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT difficulty, narrator_model, COUNT(*) FROM stories GROUP BY difficulty, narrator_model"
+            ).fetchall()
+        return {f"{difficulty}|{narrator_model}": count for difficulty, narrator_model, count in rows}
+
+    def ingest_markdown(self, path: str, difficulty: str = "media", narrator_model: str = "seed") -> Tuple[int, int]:
+        """
+        Imports seed stories from a markdown file. Two shapes are recognized: JSON objects with
+        "situacion_misteriosa"/"solucion_oculta" keys, and "Situación misteriosa: ..." lines followed
+        by a "Solución oculta: ..." line. Returns (stories found, stories added).
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+        found: List[Story] = []
+        for match in re.finditer(r"\{[^{}]*\"situacion_misteriosa\"[^{}]*\}", text, re.DOTALL):
+            try:
+                data = json.loads(match.group(0))
+                found.append(Story(data["situacion_misteriosa"], data["solucion_oculta"]))
+            except (json.JSONDecodeError, KeyError):
+                continue
+        for match in re.finditer(r"Situaci[oó]n misteriosa\**:\**\s*(.+?)\s*\n\s*[-*]?\s*\**Soluci[oó]n oculta\**:\**\s*(.+)", text, re.IGNORECASE):
+            found.append(Story(match.group(1).strip(), match.group(2).strip()))
+
+        added = sum(1 for story in found if self.add(story, difficulty, narrator_model, source=f"seed:{path}")[1])
+        return len(found), added
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_shared_store: StoryStore | None = None
+_shared_store_lock = threading.Lock()
+
+def get_story_store(config: Dict[str, Any]) -> StoryStore | None:
+    """
+    Returns the process-wide story store, or None when `story_store_path` is empty.
+    It is also disabled while a cassette is recording or replaying: rejecting a duplicate
+    triggers extra generations, which would make the replay depend on the store's contents.
+    """
+    global _shared_store
+    path = config.get("story_store_path")
+    if not path or config.get("cassette_mode"):
+        return None
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = StoryStore(path, threshold=config.get("story_dedup_threshold", 0.6))
+        return _shared_store
+
+def main():
+    """
+    Story store maintenance: python -m src.services.story_store {stats,ingest,random}
+    """
+    from src.utils.config import Config
+
+    config = Config(parse_cli=False).get_config()
+    parser = argparse.ArgumentParser(description="Black Stories AI - Almacén de historias")
+    parser.add_argument("--db", type=str, default=config.get("story_store_path") or "logs/stories.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Stories stored per difficulty and narrator model")
+    ingest = subparsers.add_parser("ingest", help="Import seed stories from a markdown file")
+    ingest.add_argument("path", nargs="?", default="prompt/black_stories_prompt.md")
+    ingest.add_argument("--dificultad", type=str, default="media")
+    pick = subparsers.add_parser("random", help="Print a random stored story")
+    pick.add_argument("--dificultad", type=str, default=None)
+    args = parser.parse_args()
+
+    store = StoryStore(args.db, threshold=config.get("story_dedup_threshold", 0.6))
+    if args.command == "stats":
+        print(f"Historias almacenadas: {store.count()}")
+        for key, count in store.get_stats().items():
+            print(f"  {key}: {count}")
+    elif args.command == "ingest":
+        found, added = store.ingest_markdown(args.path, difficulty=args.dificultad)
+        print(f"{args.path}: {found} historias encontradas, {added} nuevas, {found - added} duplicadas.")
+    else:
+        story = store.random(difficulty=args.dificultad)
+        if story is None:
+            print("No hay historias almacenadas.")
+        else:
+            print(f"Misterio: {story.mystery_situation}\nSolución: {story.hidden_solution}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
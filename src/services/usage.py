@@ -0,0 +1,148 @@
+import threading
+from typing import Dict, Any, Tuple
+
+from src.services.prompt_cache import estimate_tokens
+
+# Roles a call is attributed to; calls made without a role are counted as "other"
+ROLES = ("narrator", "detective", "visionary", "skeptic", "leader", "hint", "story")
+
+# Names shown in the end-of-game summaries
+ROLE_LABELS = {
+    "narrator": "Narrador",
+    "detective": "Detective",
+    "visionary": "Visionario",
+    "skeptic": "Escéptico",
+    "leader": "Líder",
+    "hint": "Pistas",
+    "story": "Historia",
+    "other": "Otros",
+}
+
+# Counters kept for every role, every model and the total
+USAGE_FIELDS = ("calls", "failed", "estimated", "prompt_tokens", "output_tokens", "cached_tokens", "latency", "provider_time", "load_time", "cost")
+
+def extract_usage(provider: str, response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalizes the usage reported in a provider response (or in the last chunk of a stream):
+    Gemini `usageMetadata` token counts, Ollama `prompt_eval_count` / `eval_count` and its
+    `total_duration` / `load_duration` timings (nanoseconds). Returns {} if the response reports none.
+    """
+    if provider == "gemini":
+        usage = response_data.get("usageMetadata")
+        if not usage:
+            return {}
+        return {
+            "prompt_tokens": usage.get("promptTokenCount", 0),
+            "output_tokens": usage.get("candidatesTokenCount", 0) + usage.get("thoughtsTokenCount", 0),
+            "cached_tokens": usage.get("cachedContentTokenCount", 0),
+        }
+
+    if "eval_count" not in response_data and "prompt_eval_count" not in response_data:
+        return {}
+    return {
+        "prompt_tokens": response_data.get("prompt_eval_count", 0),
+        "output_tokens": response_data.get("eval_count", 0),
+        "provider_time": response_data.get("total_duration", 0) / 1e9,
+        "load_time": response_data.get("load_duration", 0) / 1e9,
+    }
+
+def estimate_usage(prompt: str, text: str) -> Dict[str, Any]:
+    """
+    Token counts for a call whose provider reported none (mock models, cassette replays).
+    """
+    return {"prompt_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text), "estimated": True}
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Parses MODEL_PRICES, "provider:model=input/output;..." in USD per million tokens,
+    e.g. "gemini:gemini-2.0-flash=0.10/0.40". Malformed entries are ignored.
+    """
+    prices: Dict[str, Tuple[float, float]] = {}
+    for entry in spec.split(";"):
+        model, _, price = entry.strip().rpartition("=")
+        input_price, _, output_price = price.partition("/")
+        try:
+            prices[model.strip()] = (float(input_price), float(output_price or 0))
+        except ValueError:
+            continue
+    return prices
+
+def call_cost(prices: Dict[str, Tuple[float, float]], provider_model: str, usage: Dict[str, Any]) -> float:
+    input_price, output_price = prices.get(provider_model, (0.0, 0.0))
+    return (usage.get("prompt_tokens", 0) * input_price + usage.get("output_tokens", 0) * output_price) / 1e6
+
+class UsageTracker:
+    """
+    Token counts, timings and cost of LLM calls, aggregated per role and per model.
+    Every API client keeps one for its own calls and also reports to the process-wide tracker
+    (see get_usage_tracker), whose running totals cover every game served by the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_role: Dict[str, Dict[str, float]] = {}
+        self._by_model: Dict[str, Dict[str, float]] = {}
+        self._total: Dict[str, float] = dict.fromkeys(USAGE_FIELDS, 0)
+
+    @staticmethod
+    def _add(totals: Dict[str, float], usage: Dict[str, Any], latency: float, ok: bool) -> None:
+        totals["calls"] += 1
+        totals["failed"] += 0 if ok else 1
+        totals["estimated"] += 1 if usage.get("estimated") else 0
+        totals["latency"] += latency
+        for key in ("prompt_tokens", "output_tokens", "cached_tokens", "provider_time", "load_time", "cost"):
+            totals[key] += usage.get(key, 0)
+
+    def record(self, role: str | None, provider_model: str, usage: Dict[str, Any], latency: float, ok: bool) -> None:
+        """
+        Adds one call. `usage` holds the normalized counts of extract_usage/estimate_usage and its `cost`.
+        """
+        with self._lock:
+            for totals in (
+                self._by_role.setdefault(role or "other", dict.fromkeys(USAGE_FIELDS, 0)),
+                self._by_model.setdefault(provider_model, dict.fromkeys(USAGE_FIELDS, 0)),
+                self._total,
+            ):
+                self._add(totals, usage, latency, ok)
+
+    @staticmethod
+    def _rounded(totals: Dict[str, float]) -> Dict[str, Any]:
+        return {
+            key: round(value, 6 if key == "cost" else 3) if isinstance(value, float) else value
+            for key, value in totals.items()
+        }
+
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        Returns {"total": {...}, "by_role": {role: {...}}, "by_model": {provider_model: {...}}}.
+        Latency is wall-clock seconds; provider_time and load_time are the seconds Ollama reports spending
+        on the calls and on loading the model for them.
+        """
+        with self._lock:
+            return {
+                "total": self._rounded(self._total),
+                "by_role": {role: self._rounded(totals) for role, totals in self._by_role.items()},
+                "by_model": {model: self._rounded(totals) for model, totals in self._by_model.items()},
+            }
+
+def describe_usage(summary: Dict[str, Any]) -> str:
+    """
+    One-line description of a usage summary (see UsageTracker.get_summary) for the end-of-game screens.
+    """
+    total = summary["total"]
+    roles = ", ".join(
+        f"{ROLE_LABELS.get(role, role)}: {totals['prompt_tokens'] + totals['output_tokens']}"
+        for role, totals in summary["by_role"].items()
+    )
+    text = f"{total['prompt_tokens']} de entrada y {total['output_tokens']} de salida en {total['calls']} llamadas ({roles})"
+    if total["cost"]:
+        text += f", coste estimado {total['cost']:.4f} USD"
+    return text
+
+_usage_tracker = UsageTracker()
+
+def get_usage_tracker() -> UsageTracker:
+    """
+    Returns the process-wide tracker with the running totals of every call, for capacity planning.
+    """
+    return _usage_tracker
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, AsyncIterator, Coroutine, Generator, TypeVar
+
+from src.utils.cancellation import CancelToken
+
+T = TypeVar("T")
+
+STREAM_BUFFER = 32 # Lines a stream may run ahead of its reader before the game waits for it
+
+class _StreamEnd:
+    """
+    Queued after the last line of a stream, with the exception that ended it, if any.
+    """
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException | None = None):
+        self.error = error
+
+class BackgroundLoop:
+    """
+    One asyncio event loop running in a daemon thread, shared by every async game of the process.
+    Synchronous code (Flask's streaming responses) hands it coroutines and async generators,
+    so concurrent games interleave their I/O on one loop instead of each creating and tearing down its own.
+    """
+
+    def __init__(self, name: str = "game-loop"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The running loop, started on first use.
+        """
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+                threading.Thread(target=run, name=self.name, daemon=True).start()
+                started.wait()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> "Future[T]":
+        """
+        Schedules a coroutine on the loop from any thread; cancelling the returned future cancels it.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def iterate(self, stream: AsyncIterator[T], name: str | None = None, cancel_token: CancelToken | None = None) -> Generator[T, None, None]:
+        """
+        Runs an async generator on the loop as a task (named `name`, which labels its lane in traces)
+        and yields its items to the calling thread. The task runs up to STREAM_BUFFER items ahead of
+        the reader. Closing the returned generator or cancelling `cancel_token` (the client disconnected)
+        cancels the task, which aborts the LLM requests it has in flight; the generator then just ends.
+        """
+        loop = self.loop
+        buffer: asyncio.Queue = asyncio.Queue(STREAM_BUFFER)
+
+        async def pump() -> None:
+            if name:
+                asyncio.current_task().set_name(name)
+            try:
+                async for item in stream:
+                    await buffer.put(item)
+            except asyncio.CancelledError:
+                # Wake the reader even if the buffer is full; whatever it had not read is not wanted anymore
+                while not buffer.empty():
+                    buffer.get_nowait()
+                buffer.put_nowait(_StreamEnd())
+                raise
+            except BaseException as e:
+                await buffer.put(_StreamEnd(e))
+            else:
+                await buffer.put(_StreamEnd())
+            finally:
+                aclose = getattr(stream, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+        task = asyncio.run_coroutine_threadsafe(pump(), loop)
+        unlink = cancel_token.on_cancel(task.cancel) if cancel_token is not None else None
+        try:
+            while True:
+                get = asyncio.run_coroutine_threadsafe(buffer.get(), loop)
+                wait((get, task), return_when=FIRST_COMPLETED)
+                if not get.done() and task.cancelled(): # Cancelled, possibly before it could queue its end
+                    get.cancel()
+                    return
+                item = get.result()
+                if isinstance(item, _StreamEnd):
+                    if item.error is not None:
+                        raise item.error
+                    return
+                yield item
+        finally:
+            task.cancel()
+            if unlink is not None:
+                unlink() # The game's token outlives this stream (e.g. one LLM call of a game)
+
+_background_loop = BackgroundLoop()
+
+def get_background_loop() -> BackgroundLoop:
+    """
+    Returns the process-wide loop the web routes run their async games on.
+    """
+    return _background_loop
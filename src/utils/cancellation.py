@@ -0,0 +1,154 @@
+import logging
+import selectors
+import socket
+import threading
+import time
+from typing import Callable, Dict, List
+
+from src.utils.metrics import CANCELLED
+
+logger = logging.getLogger(__name__)
+
+WATCH_INTERVAL = 0.25 # Seconds between checks for newly watched sockets
+
+class GameCancelled(Exception):
+    """
+    Raised inside a game whose client has gone away, so the game stops instead of finishing for nobody.
+    """
+
+class CancelToken:
+    """
+    Set once when the work it belongs to should stop. Callbacks registered with `on_cancel`
+    run (once) in the thread that cancels, so they must be quick and thread-safe.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: str | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Cancellation callback failed")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Runs `callback` when the token is cancelled, or right away if it already is.
+        Returns a function that unregisters it: work that ends before the token (one LLM call of a game)
+        must call it, or the token keeps the callback, and whatever it references, until it is cancelled.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            for index, registered in enumerate(self._callbacks):
+                if registered is callback:
+                    del self._callbacks[index]
+                    return
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Sleeps up to `timeout` seconds; returns True (early) if the token is cancelled meanwhile.
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise GameCancelled(f"Partida cancelada: {self.reason}")
+
+class DisconnectWatcher:
+    """
+    Watches the client sockets of streaming responses from one background thread and cancels
+    a response's token as soon as its client closes the connection. A WSGI server only notices
+    a closed connection on its next write, which may be a whole LLM call away.
+    The check peeks at the socket without consuming anything: readable with no data means the peer hung up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._pending: List[tuple] = [] # (socket, token) registered by request threads, picked up by the watcher
+        self._watched: Dict[int, CancelToken] = {} # fd -> token
+        self._thread: threading.Thread | None = None
+
+    def watch(self, sock: socket.socket, token: CancelToken) -> None:
+        with self._lock:
+            self._pending.append((sock, token))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="disconnect-watcher", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, token: CancelToken) -> None:
+        """
+        Stops watching the socket of `token` (the response has ended).
+        """
+        with self._lock:
+            self._pending = [(sock, pending) for sock, pending in self._pending if pending is not token]
+            for fd, watched in list(self._watched.items()):
+                if watched is token:
+                    self._drop(fd)
+
+    def _drop(self, fd: int) -> None:
+        self._watched.pop(fd, None)
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                for sock, token in pending:
+                    try:
+                        fd = sock.fileno()
+                        if fd in self._watched:
+                            self._drop(fd)
+                        self._selector.register(fd, selectors.EVENT_READ, sock)
+                        self._watched[fd] = token
+                    except (OSError, ValueError): # Already closed
+                        token.cancel("client disconnected")
+                watching = bool(self._watched)
+            if not watching:
+                time.sleep(WATCH_INTERVAL)
+                continue
+            for key, _ in self._selector.select(WATCH_INTERVAL):
+                self._check(key.fd, key.data)
+
+    def _check(self, fd: int, sock: socket.socket) -> None:
+        try:
+            data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        with self._lock:
+            token = self._watched.get(fd)
+            self._drop(fd) # Either way there is nothing more to learn from this socket
+        if token is not None and not data:
+            CANCELLED.inc(kind="game")
+            token.cancel("client disconnected")
+
+_watcher = DisconnectWatcher()
+
+def get_disconnect_watcher() -> DisconnectWatcher:
+    return _watcher
@@ -1,7 +1,12 @@
 import os
 import argparse
+import logging
 from typing import Dict, Any
 
+from src.utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
 class Config:
     """
     Handles configuration loading from environment variables and CLI arguments.
@@ -18,7 +23,56 @@ class Config:
         }
         self.gemini_api_key: str | None = None
         self.ollama_host: str = "http://localhost:11434" # Changed to ollama_host
+        self.gemini_base_url: str = "https://generativelanguage.googleapis.com" # Point at a local stand-in for offline tests
+        self.pool_max_size: int = 4 # Idle keep-alive connections kept per host
+        self.pool_idle_timeout: float = 30.0 # Seconds before an idle connection is closed
+        self.stream_responses: bool = True # Stream long generations to the UI as NDJSON deltas
+        self.fight_concurrent_rounds: bool = True # Run both detectives' turns of a round at the same time
+        self.fight_turn_delay: float = 0.0 # Cosmetic pause after each fight turn, in seconds
+        self.tournament_concurrency: int = 10 # Interrogations run at the same time in a tournament
+        self.mock_seed: int = 0 # Seed of the scripted replies of "mock:" models
+        self.mock_latency: float = 0.0 # Simulated seconds per "mock:" call
+        self.mock_jitter: float = 0.0 # Random +/- seconds added to mock_latency
+        self.mock_error_rate: float = 0.0 # Fraction of "mock:" calls that fail
+        self.cassette_mode: str = "" # "record" or "replay" every LLM call; empty disables the cassette
+        self.cassette_path: str = "logs/cassette.jsonl" # Cassette file (.gz to compress it)
+        self.cassette_latency: str = "zero" # Replay at "zero" latency or at the "recorded" one
+        self.story_pool_size: int = 3 # Ready stories kept per (difficulty, narrator model); 0 disables the pool
+        self.story_pool_path: str = "logs/story_pool.json" # Where ready stories are kept across restarts
+        self.story_store_path: str = "logs/stories.db" # SQLite archive of every generated story; empty disables it
+        self.story_dedup_threshold: float = 0.6 # Similarity above which a new story counts as a repeat
+        self.story_duplicate_policy: str = "reuse" # "reuse" (play the stored one) or "reject" (generate another); story pool refills always reject
+        self.answer_cache: bool = True # Reuse the Narrator's answer when a question is repeated or reworded
+        self.answer_cache_similarity: float = 0.0 # Overlap (Jaccard over words and ordered word pairs) needed for a reworded question to hit; 0 = exact match only
+        self.structured_output: bool = True # Ask providers for schema-constrained JSON (Gemini responseSchema, Ollama format)
+        self.prompt_cache: bool = True # Send the stable story prefix apart so providers can cache it
+        self.gemini_cache_ttl: int = 600 # Seconds a Gemini cachedContent for a story prefix is kept
+        self.gemini_cache_min_tokens: int = 1024 # Smaller prefixes are not offered to Gemini's explicit cache
+        self.ollama_keep_alive: str = "30m" # How long Ollama keeps the model (and its prompt cache) loaded
+        self.context_budget_tokens: int = 1000 # Past this size the prompt history is compacted into a fact sheet; 0 = no limit
+        self.context_recent_turns: int = 8 # Turns always kept verbatim at the end of a compacted history
+        self.model_prices: str = "" # "provider:model=input/output;..." USD per million tokens, for cost accounting
+        self.trace_path: str = "" # Chrome trace file of the game, service and HTTP spans; empty disables tracing
+        self.log_level: str = "INFO" # Default level of every logger
+        self.log_levels: str = "" # "logger=LEVEL;..." per-module overrides, e.g. "src.services.api_client=DEBUG"
+        self.log_format: str = "text" # "text" or "json" (one object per line)
+        self.log_stream_sample: float = 0.0 # Fraction (0-1) of per-line stream debug logs written; 0 = none
+        self.session_max_games: int = 200 # Web games kept in memory; the least recently used one is dropped past it
+        self.session_idle_ttl: float = 1800.0 # Seconds an unused web game is kept
+        self.session_finished_ttl: float = 300.0 # Seconds a finished web game is kept (to save its conversation)
+        self.retry_max_attempts: int = 4 # Tries per LLM call, counting the first, on timeouts, connection errors, 429/5xx and unreadable replies
+        self.retry_base_delay: float = 0.5 # Seconds of the first backoff; it doubles each retry and is randomized (full jitter)
+        self.retry_max_delay: float = 20.0 # Longest backoff; a longer Retry-After is not waited for
+        self.circuit_failure_threshold: int = 5 # Failures in a row after which an endpoint is not called for a while
+        self.circuit_reset_timeout: float = 30.0 # Seconds before a tripped endpoint gets a trial call
+        self.rate_limits: str = "" # "provider[:model]=requests/tokens/concurrency;..." per minute, e.g. "gemini=15/1000000;ollama=0/0/2"; empty = unlimited
+        self.model_fallbacks: str = "" # "role|provider:model=backend,backend;..." tried in order when a call fails, e.g. "narrator=ollama:llama3@http://gpu2:11434,gemini:gemini-2.0-flash"
+        self.hedge_quantile: float = 0.95 # Duplicate a call to the next fallback once it is slower than this quantile of its backend's latencies; 0 disables
+        self.hedge_min_delay: float = 0.5 # Never hedge a call sooner than this many seconds
+        self.hedge_min_samples: int = 20 # Latencies a backend needs before its calls are hedged
+        self.hedge_budget: float = 0.1 # Most calls that may be hedged, as a fraction of all hedgeable calls
         self._load_env_vars()
+        setup_logging(self.get_config())
         if parse_cli:
             self._parse_cli_args()
 
@@ -30,10 +84,58 @@ class Config:
             from dotenv import load_dotenv
             load_dotenv()
         except ImportError:
-            print("Warning: python-dotenv not installed. Environment variables must be set manually.")
+            logger.warning("python-dotenv not installed. Environment variables must be set manually.")
 
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
         self.ollama_host = os.getenv("OLLAMA_HOST", self.ollama_host) # Changed to OLLAMA_HOST
+        self.gemini_base_url = os.getenv("GEMINI_BASE_URL", self.gemini_base_url)
+        self.pool_max_size = int(os.getenv("POOL_MAX_SIZE", self.pool_max_size))
+        self.pool_idle_timeout = float(os.getenv("POOL_IDLE_TIMEOUT", self.pool_idle_timeout))
+        self.stream_responses = os.getenv("STREAM_RESPONSES", "true").lower() not in ("0", "false", "no")
+        self.fight_concurrent_rounds = os.getenv("FIGHT_CONCURRENT_ROUNDS", "true").lower() not in ("0", "false", "no")
+        self.fight_turn_delay = float(os.getenv("FIGHT_TURN_DELAY", self.fight_turn_delay))
+        self.tournament_concurrency = int(os.getenv("TOURNAMENT_CONCURRENCY", self.tournament_concurrency))
+        self.mock_seed = int(os.getenv("MOCK_SEED", self.mock_seed))
+        self.mock_latency = float(os.getenv("MOCK_LATENCY", self.mock_latency))
+        self.mock_jitter = float(os.getenv("MOCK_JITTER", self.mock_jitter))
+        self.mock_error_rate = float(os.getenv("MOCK_ERROR_RATE", self.mock_error_rate))
+        self.cassette_mode = os.getenv("CASSETTE_MODE", self.cassette_mode).lower()
+        self.cassette_path = os.getenv("CASSETTE_PATH", self.cassette_path)
+        self.cassette_latency = os.getenv("CASSETTE_LATENCY", self.cassette_latency).lower()
+        self.story_pool_size = int(os.getenv("STORY_POOL_SIZE", self.story_pool_size))
+        self.story_pool_path = os.getenv("STORY_POOL_PATH", self.story_pool_path)
+        self.story_store_path = os.getenv("STORY_STORE_PATH", self.story_store_path)
+        self.story_dedup_threshold = float(os.getenv("STORY_DEDUP_THRESHOLD", self.story_dedup_threshold))
+        self.story_duplicate_policy = os.getenv("STORY_DUPLICATE_POLICY", self.story_duplicate_policy).lower()
+        self.answer_cache = os.getenv("ANSWER_CACHE", "true").lower() not in ("0", "false", "no")
+        self.answer_cache_similarity = float(os.getenv("ANSWER_CACHE_SIMILARITY", self.answer_cache_similarity))
+        self.structured_output = os.getenv("STRUCTURED_OUTPUT", "true").lower() not in ("0", "false", "no")
+        self.prompt_cache = os.getenv("PROMPT_CACHE", "true").lower() not in ("0", "false", "no")
+        self.gemini_cache_ttl = int(os.getenv("GEMINI_CACHE_TTL", self.gemini_cache_ttl))
+        self.gemini_cache_min_tokens = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", self.gemini_cache_min_tokens))
+        self.ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", self.ollama_keep_alive)
+        self.context_budget_tokens = int(os.getenv("CONTEXT_BUDGET_TOKENS", self.context_budget_tokens))
+        self.context_recent_turns = int(os.getenv("CONTEXT_RECENT_TURNS", self.context_recent_turns))
+        self.model_prices = os.getenv("MODEL_PRICES", self.model_prices)
+        self.trace_path = os.getenv("TRACE_PATH", self.trace_path)
+        self.log_level = os.getenv("LOG_LEVEL", self.log_level).upper()
+        self.log_levels = os.getenv("LOG_LEVELS", self.log_levels)
+        self.log_format = os.getenv("LOG_FORMAT", self.log_format).lower()
+        self.log_stream_sample = float(os.getenv("LOG_STREAM_SAMPLE", self.log_stream_sample))
+        self.session_max_games = int(os.getenv("SESSION_MAX_GAMES", self.session_max_games))
+        self.session_idle_ttl = float(os.getenv("SESSION_IDLE_TTL", self.session_idle_ttl))
+        self.session_finished_ttl = float(os.getenv("SESSION_FINISHED_TTL", self.session_finished_ttl))
+        self.retry_max_attempts = int(os.getenv("RETRY_MAX_ATTEMPTS", self.retry_max_attempts))
+        self.retry_base_delay = float(os.getenv("RETRY_BASE_DELAY", self.retry_base_delay))
+        self.retry_max_delay = float(os.getenv("RETRY_MAX_DELAY", self.retry_max_delay))
+        self.circuit_failure_threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", self.circuit_failure_threshold))
+        self.circuit_reset_timeout = float(os.getenv("CIRCUIT_RESET_TIMEOUT", self.circuit_reset_timeout))
+        self.rate_limits = os.getenv("RATE_LIMITS", self.rate_limits)
+        self.model_fallbacks = os.getenv("MODEL_FALLBACKS", self.model_fallbacks)
+        self.hedge_quantile = float(os.getenv("HEDGE_QUANTILE", self.hedge_quantile))
+        self.hedge_min_delay = float(os.getenv("HEDGE_MIN_DELAY", self.hedge_min_delay))
+        self.hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", self.hedge_min_samples))
+        self.hedge_budget = float(os.getenv("HEDGE_BUDGET", self.hedge_budget))
 
     def _parse_cli_args(self) -> None:
         """
@@ -64,21 +166,21 @@ class Config:
 
         if args.narrador != self.narrator_model:
             self.narrator_model = args.narrador
-            print(f"INFO: Narrator model set to: {self.narrator_model}")
+            logger.info("Narrator model set to: %s", self.narrator_model)
         else:
-            print(f"INFO: Using default Narrator model: {self.narrator_model}")
+            logger.info("Using default Narrator model: %s", self.narrator_model)
 
         if args.detective != self.detective_model:
             self.detective_model = args.detective
-            print(f"INFO: Detective model set to: {self.detective_model}")
+            logger.info("Detective model set to: %s", self.detective_model)
         else:
-            print(f"INFO: Using default Detective model: {self.detective_model}")
+            logger.info("Using default Detective model: %s", self.detective_model)
 
         if args.dificultad != self.difficulty:
             self.difficulty = args.dificultad
-            print(f"INFO: Difficulty set to: {self.difficulty}")
+            logger.info("Difficulty set to: %s", self.difficulty)
         else:
-            print(f"INFO: Using default difficulty: {self.difficulty}")
+            logger.info("Using default difficulty: %s", self.difficulty)
 
     def get_config(self) -> Dict[str, Any]:
         """
@@ -91,4 +193,52 @@ class Config:
             "question_limits": self.question_limits,
             "gemini_api_key": self.gemini_api_key,
             "ollama_host": self.ollama_host,
+            "gemini_base_url": self.gemini_base_url,
+            "pool_max_size": self.pool_max_size,
+            "pool_idle_timeout": self.pool_idle_timeout,
+            "stream_responses": self.stream_responses,
+            "fight_concurrent_rounds": self.fight_concurrent_rounds,
+            "fight_turn_delay": self.fight_turn_delay,
+            "tournament_concurrency": self.tournament_concurrency,
+            "mock_seed": self.mock_seed,
+            "mock_latency": self.mock_latency,
+            "mock_jitter": self.mock_jitter,
+            "mock_error_rate": self.mock_error_rate,
+            "cassette_mode": self.cassette_mode,
+            "cassette_path": self.cassette_path,
+            "cassette_latency": self.cassette_latency,
+            "story_pool_size": self.story_pool_size,
+            "story_pool_path": self.story_pool_path,
+            "story_store_path": self.story_store_path,
+            "story_dedup_threshold": self.story_dedup_threshold,
+            "story_duplicate_policy": self.story_duplicate_policy,
+            "answer_cache": self.answer_cache,
+            "answer_cache_similarity": self.answer_cache_similarity,
+            "structured_output": self.structured_output,
+            "prompt_cache": self.prompt_cache,
+            "gemini_cache_ttl": self.gemini_cache_ttl,
+            "gemini_cache_min_tokens": self.gemini_cache_min_tokens,
+            "ollama_keep_alive": self.ollama_keep_alive,
+            "context_budget_tokens": self.context_budget_tokens,
+            "context_recent_turns": self.context_recent_turns,
+            "model_prices": self.model_prices,
+            "trace_path": self.trace_path,
+            "log_level": self.log_level,
+            "log_levels": self.log_levels,
+            "log_format": self.log_format,
+            "log_stream_sample": self.log_stream_sample,
+            "session_max_games": self.session_max_games,
+            "session_idle_ttl": self.session_idle_ttl,
+            "session_finished_ttl": self.session_finished_ttl,
+            "retry_max_attempts": self.retry_max_attempts,
+            "retry_base_delay": self.retry_base_delay,
+            "retry_max_delay": self.retry_max_delay,
+            "circuit_failure_threshold": self.circuit_failure_threshold,
+            "circuit_reset_timeout": self.circuit_reset_timeout,
+            "rate_limits": self.rate_limits,
+            "model_fallbacks": self.model_fallbacks,
+            "hedge_quantile": self.hedge_quantile,
+            "hedge_min_delay": self.hedge_min_delay,
+            "hedge_min_samples": self.hedge_min_samples,
+            "hedge_budget": self.hedge_budget,
         }
@@ -64,18 +64,3 @@ def display_final_screen(
     print("════════════════════════════════════════════")
     print("\nFin del juego. Presiona ENTER para salir.")
     input()
-
-def display_error_and_retry(message: str) -> bool:
-    """
-    Displays an error message and asks the user if they want to retry.
-    Returns True if the user wants to retry, False otherwise.
-    """
-    print(f"\nError: {message}")
-    while True:
-        response = input("¿Desea reintentar? (s/n): ").lower().strip()
-        if response in ["s", "si"]:
-            return True
-        elif response in ["n", "no"]:
-            return False
-        else:
-            print("Respuesta inválida. Por favor, ingrese 's' o 'n'.")
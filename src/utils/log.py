@@ -0,0 +1,96 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any
+
+# Pass as `extra=STREAM_LINE` on per-line stream logs: only LOG_STREAM_SAMPLE of them are written
+STREAM_LINE = {"stream_line": True}
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: timestamp, level, logger, message, any `extra` fields and the exception.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class StreamSampleFilter(logging.Filter):
+    """
+    Lets through one in every 1/`rate` records marked with STREAM_LINE (none at rate 0), and every other record.
+    Counting instead of drawing random numbers keeps the sampled lines evenly spread.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = round(1 / rate) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "stream_line", False):
+            return True
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """
+    Parses LOG_LEVELS, "logger=LEVEL;..." (e.g. "src.services.api_client=DEBUG;web=WARNING").
+    """
+    levels: Dict[str, str] = {}
+    for entry in spec.split(";"):
+        name, _, level = entry.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+_listener: logging.handlers.QueueListener | None = None
+_setup_lock = threading.Lock()
+
+def setup_logging(config: Dict[str, Any]) -> None:
+    """
+    Configures the root logger once per process: records go through a queue to a background thread
+    that writes them to stderr, so logging never blocks a request on terminal or pipe I/O.
+    `log_level` is the default level, `log_levels` overrides it per logger, `log_format` is "text" or "json".
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(sys.stderr)
+        if config.get("log_format", "text") == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(StreamSampleFilter(config.get("log_stream_sample", 0.0)))
+
+        root = logging.getLogger()
+        root.handlers[:] = [queue_handler]
+        root.setLevel(config.get("log_level", "INFO").upper())
+        for name, level in parse_levels(config.get("log_levels", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop) # Drains the queue before the process exits
@@ -0,0 +1,161 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    """
+    A named metric with a fixed set of label names; one series per combination of label values.
+    Updates take the metric's lock once, so they are cheap enough for every LLM call and every streamed line.
+    """
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+class Counter(_Metric):
+    """
+    A monotonically increasing total, e.g. `LLM_CALLS.inc(provider="ollama", model="llama3", role="narrator", outcome="ok")`.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}" for key, value in values]
+
+class Histogram(_Metric):
+    """
+    Bucketed observations (seconds) with their count and sum, in the cumulative Prometheus layout.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self._series: Dict[LabelValues, List[float]] = {} # key -> per-bucket counts (+Inf last), then count and sum
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound is None else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {_number(cumulative)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {_number(values[-2])}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(values[-1])}")
+        return lines
+
+class Gauge(_Metric):
+    """
+    A value read when the metrics are scraped: `collect` returns {label values: value}.
+    Used for state the app already holds (active games, idle connections), so nothing is updated per call.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}" for key, value in sorted(self.collect().items())]
+
+class MetricsRegistry:
+    """
+    The metrics of the process, rendered in the Prometheus text exposition format for `GET /metrics`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Adds a metric; registering a name again returns the metric registered first.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[LabelValues, float]]) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, collect))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+_registry = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+# Metrics updated by the services and engines; the web app adds the gauges of its own state
+LLM_CALLS = _registry.counter("blackstories_llm_calls_total", "LLM calls by provider, model, role and outcome (ok/error).", ("provider", "model", "role", "outcome"))
+LLM_LATENCY = _registry.histogram("blackstories_llm_call_seconds", "Wall-clock latency of LLM calls.", ("provider", "model", "role"))
+LLM_TOKENS = _registry.counter("blackstories_llm_tokens_total", "Tokens sent (prompt) and received (output) by provider and model.", ("provider", "model", "direction"))
+RETRIES = _registry.counter("blackstories_retries_total", "Retried operations by reason.", ("reason",))
+STORY_GENERATION = _registry.histogram("blackstories_story_generation_seconds", "Time to generate a story, including duplicate regenerations.", ("model",))
+STREAM_BYTES = _registry.counter("blackstories_stream_bytes_total", "Bytes streamed to clients by game mode.", ("mode",))
+HINT_REQUESTS = _registry.counter("blackstories_hint_requests_total", "Hint requests by outcome.", ("outcome",))
+CANCELLED = _registry.counter("blackstories_cancelled_total", "Work abandoned because its client disconnected: games and in-flight LLM calls.", ("kind",))
+QUEUE_WAIT = _registry.histogram("blackstories_llm_queue_wait_seconds", "Time LLM calls waited for admission by the rate limiter.", ("key", "priority"))
+RATE_LIMITED = _registry.counter("blackstories_rate_limited_total", "Calls refused by their provider for exceeding its quota (HTTP 429).", ("provider", "model"))
+HEDGED = _registry.counter("blackstories_hedged_calls_total", "Slow LLM calls duplicated to a second backend, by which request answered first (primary/hedge/none).", ("winner",))
+FAILOVERS = _registry.counter("blackstories_failovers_total", "LLM call attempts sent to a fallback backend instead of the configured model, by role.", ("role",))
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, List, Tuple
+
+# Upper bounds (milliseconds) of the span duration histogram buckets; the last bucket is open-ended
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+MAX_EVENTS = 200_000 # Events kept for the trace file; past it only the histograms are updated
+FLUSH_INTERVAL = 5.0 # Minimum seconds between rewrites of the trace file when a top-level span ends
+
+class Histogram:
+    """
+    Bucketed durations of one span name, with count, total and maximum.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile (the maximum for the open-ended bucket).
+        """
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return HISTOGRAM_BUCKETS_MS[index] if index < len(HISTOGRAM_BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": {
+                (f"<={bound}" if index < len(HISTOGRAM_BUCKETS_MS) else f">{HISTOGRAM_BUCKETS_MS[-1]}"): count
+                for index, (bound, count) in enumerate(zip(HISTOGRAM_BUCKETS_MS + (None,), self.counts))
+            },
+        }
+
+class _NoopSpan:
+    """
+    What `span` returns while tracing is disabled: entering and leaving it does nothing.
+    """
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """
+    One timed section, recorded as a Chrome "complete" event when it exits.
+    Spans opened inside another one on the same thread (or asyncio task) nest under it.
+    """
+    __slots__ = ("tracer", "name", "category", "args", "lane", "started")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        self.lane = self.tracer._enter()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._finish(self, duration)
+        return False
+
+    def set(self, **args: Any) -> None:
+        """
+        Adds arguments known only once the span is running (status codes, sizes, results).
+        """
+        self.args.update(args)
+
+class Tracer:
+    """
+    Collects spans into a Chrome trace file (open it in chrome://tracing or https://ui.perfetto.dev)
+    and keeps a duration histogram per span name. Each thread and each asyncio task gets its own
+    lane, so the spans of concurrent games do not overlap.
+    """
+
+    def __init__(self, path: str, max_events: int = MAX_EVENTS):
+        self.path = path
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # One writer at a time for the temporary file
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events: List[Dict[str, Any]] = []
+        self._dropped = 0
+        self._histograms: Dict[str, Histogram] = {}
+        self._lanes: Dict[Tuple[int, int], int] = {} # (thread id, task id) -> tid in the trace
+        self._depth: Dict[int, int] = {} # tid -> spans currently open in it
+        self._last_flush = time.monotonic()
+
+    def _lane_key(self) -> Tuple[int, int, str]:
+        thread = threading.current_thread()
+        try:
+            task = asyncio.current_task()
+        except RuntimeError: # No event loop running in this thread
+            task = None
+        if task is None:
+            return thread.ident or 0, 0, thread.name
+        return thread.ident or 0, id(task), task.get_name()
+
+    def _enter(self) -> int:
+        thread_id, task_id, name = self._lane_key()
+        with self._lock:
+            lane = self._lanes.get((thread_id, task_id))
+            if lane is None:
+                lane = self._lanes[(thread_id, task_id)] = len(self._lanes) + 1
+                self._events.append({"ph": "M", "name": "thread_name", "pid": self._pid, "tid": lane, "args": {"name": name}})
+            self._depth[lane] = self._depth.get(lane, 0) + 1
+            return lane
+
+    def _finish(self, span: Span, duration: float) -> None:
+        with self._lock:
+            self._histograms.setdefault(span.name, Histogram()).add(duration * 1000)
+            if len(self._events) < self.max_events:
+                self._events.append({
+                    "ph": "X",
+                    "name": span.name,
+                    "cat": span.category,
+                    "ts": round((span.started - self._origin) * 1e6, 1),
+                    "dur": round(duration * 1e6, 1),
+                    "pid": self._pid,
+                    "tid": span.lane,
+                    "args": span.args,
+                })
+            else:
+                self._dropped += 1
+            self._depth[span.lane] -= 1
+            flush = self._depth[span.lane] == 0 and time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+        if flush:
+            self.write()
+
+    def span(self, name: str, category: str, args: Dict[str, Any]) -> Span:
+        return Span(self, name, category, args)
+
+    def get_histograms(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the duration histogram of every span name, slowest total first.
+        """
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[1].total, reverse=True)
+            return {name: histogram.to_dict() for name, histogram in histograms}
+
+    def write(self) -> None:
+        """
+        Rewrites the trace file with every event so far; the file is always a complete trace.
+        """
+        histograms = self.get_histograms()
+        with self._lock:
+            events = list(self._events)
+            dropped = self._dropped
+            self._last_flush = time.monotonic()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with self._write_lock:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "traceEvents": events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"dropped_events": dropped},
+                    "histograms": histograms,
+                }, f, ensure_ascii=False, default=str)
+            os.replace(temp_path, self.path)
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+def configure_tracing(config: Dict[str, Any]) -> Tracer | None:
+    """
+    Starts the process-wide tracer when `trace_path` is set; the trace is written at exit too.
+    """
+    global _tracer
+    path = config.get("trace_path")
+    if not path:
+        return _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(path)
+            atexit.register(_tracer.write)
+    return _tracer
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+def span(name: str, category: str = "game", **args: Any) -> Span | _NoopSpan:
+    """
+    Times a section as a trace span: `with span("llm.generate", model=...) as s: ...`.
+    Without a configured tracer it returns a shared no-op span, so disabled tracing costs one check.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.span(name, category, args)
+
+def traced(name: str, category: str = "game") -> Callable[[Callable], Callable]:
+    """
+    Decorator form of `span` for plain (non-generator, non-async) functions.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(name, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def main():
+    """
+    Prints the span duration histograms stored in a trace file.
+    """
+    parser = argparse.ArgumentParser(description="Black Stories AI - Resumen de una traza")
+    parser.add_argument("traza", type=str, nargs="?", default="logs/trace.json", help="Trace file written with TRACE_PATH")
+    args = parser.parse_args()
+
+    with open(args.traza, "r", encoding="utf-8") as f:
+        histograms = json.load(f).get("histograms", {})
+
+    print(f"{'Span':<28} {'N':>7} {'Total (ms)':>12} {'Media':>9} {'p50':>7} {'p95':>7} {'Máx':>9}")
+    for name, histogram in histograms.items():
+        print(
+            f"{name:<28} {histogram['count']:>7} {histogram['total_ms']:>12.1f} {histogram['mean_ms']:>9.1f} "
+            f"{histogram['p50_ms']:>7} {histogram['p95_ms']:>7} {histogram['max_ms']:>9.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, AsyncGenerator, Dict, List, Tuple
+
+import pytest
+
+from src.services.api_client import APIClient
+from src.services.async_api_client import AsyncAPIClient
+from src.services.base_api_client import ProviderRequest
+from src.services.hedging import Hedger
+from src.services.retry import CircuitBreakers, RetryPolicy
+from src.utils.cancellation import CancelToken
+from src.utils.config import Config
+
+class FakeBackend:
+    """
+    Scripted replies for "mock:" models, in place of the in-process mock provider. `script` maps a model
+    to the outcomes of its successive calls (or a single one): a reply, an exception to raise, or
+    (delay, outcome) to answer after `delay` seconds. A model's last outcome repeats once its script is used up.
+    Streamed calls to real providers (Ollama, Gemini) are answered too, the reply being the raw response body.
+    """
+
+    def __init__(self, script: Dict[str, Any]):
+        self.script = {model: list(outcomes) if isinstance(outcomes, list) else [outcomes] for model, outcomes in script.items()}
+        self.calls: List[str] = []
+
+    def _next(self, model: str) -> Tuple[float, Any]:
+        self.calls.append(model)
+        outcomes = self.script[model]
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        return outcome if isinstance(outcome, tuple) else (0.0, outcome)
+
+    @staticmethod
+    def _answer(outcome: Any) -> str:
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def reply(self, model: str, prompt: str, response_schema: Dict[str, Any] | None = None) -> str:
+        delay, outcome = self._next(model)
+        await asyncio.sleep(delay)
+        return self._answer(outcome)
+
+    async def stream_request(self, request: ProviderRequest) -> AsyncGenerator[Tuple[int, str], None]:
+        delay, outcome = self._next(request.model)
+        await asyncio.sleep(delay)
+        for line in self._answer(outcome).splitlines():
+            yield 200, line
+
+def _setup(client: AsyncAPIClient, backend: FakeBackend, hedger: Hedger | None) -> AsyncAPIClient:
+    # Fresh breakers and hedger: the process-wide ones would carry state from test to test
+    client.breakers = CircuitBreakers(failure_threshold=3, reset_timeout=60.0)
+    client.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+    client.hedger = hedger or Hedger(quantile=0)
+    client._mock_completion = backend.reply
+    client._stream_request = backend.stream_request
+    return client
+
+@pytest.fixture
+def make_client():
+    """
+    Builds an APIClient whose "mock:" models answer from a FakeBackend, with retries that do not wait,
+    breakers that open after 3 failures and, unless a Hedger is given, no hedging. `cancel_token` is the game's.
+    """
+
+    def make(backend: FakeBackend, hedger: Hedger | None = None, cancel_token: CancelToken | None = None, **settings: Any) -> APIClient:
+        config = dict(Config(parse_cli=False).get_config(), **settings)
+        client = APIClient(config, cancel_token)
+        _setup(client.core, backend, hedger)
+        return client
+
+    return make
+
+@pytest.fixture
+def make_async_client():
+    """
+    Like `make_client`, for an AsyncAPIClient.
+    """
+
+    def make(backend: FakeBackend, hedger: Hedger | None = None, cancel_token: CancelToken | None = None, **settings: Any) -> AsyncAPIClient:
+        config = dict(Config(parse_cli=False).get_config(), **settings)
+        return _setup(AsyncAPIClient(config, cancel_token), backend, hedger)
+
+    return make
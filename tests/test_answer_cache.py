@@ -0,0 +1,41 @@
+import pytest
+
+from src.services.answer_cache import AnswerCache, jaccard, normalize_question
+
+def test_normalize_question_keeps_content_words_in_order():
+    assert normalize_question("¿Murió el HOMBRE antes que la mujer?") == ("murio", "hombre", "antes", "mujer")
+    assert normalize_question("¿Es, acaso, verdad?") == ()
+
+def test_swapped_words_are_not_the_same_question():
+    before = normalize_question("¿Murió el hombre antes que la mujer?")
+    after = normalize_question("¿Murió la mujer antes que el hombre?")
+    assert jaccard(before, before) == 1.0
+    assert jaccard(before, after) < 0.5
+
+def test_an_extra_word_keeps_questions_similar():
+    assert jaccard(normalize_question("¿Murió el hombre?"), normalize_question("¿Murió el hombre joven?")) == pytest.approx(0.6)
+
+def test_exact_cache_matches_the_normalized_question_only():
+    cache = AnswerCache()
+    cache.put("¿Murió el hombre?", "sí")
+    assert cache.get("murio EL hombre") == "sí"
+    assert cache.get("¿Murió el hombre joven?") is None
+    assert cache.get_stats() == {"hits": 1, "misses": 1, "shared": 0, "size": 1, "hit_rate": 0.5}
+
+def test_similar_question_hits_above_the_threshold():
+    cache = AnswerCache(similarity=0.5)
+    cache.put("¿Murió el hombre antes que la mujer?", "sí")
+    cache.put("¿Había un arma?", "no")
+    assert cache.get("¿Murió el hombre antes que la mujer joven?") == "sí"
+    assert cache.get("¿Murió la mujer antes que el hombre?") is None
+
+def test_stopword_only_questions_are_not_cached():
+    cache = AnswerCache(similarity=0.5)
+    cache.put("¿Es algo?", "no es relevante")
+    assert cache.get("¿Es algo?") is None and cache.get_stats()["size"] == 0
+
+def test_shared_answers_count_towards_the_hit_rate():
+    cache = AnswerCache()
+    cache.get("¿Había un arma?")
+    cache.count_shared()
+    assert cache.get_stats()["hit_rate"] == 1.0
@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+
+from conftest import FakeBackend
+from src.services.cassette import Cassette, CassetteMissError
+
+def test_replay_serves_each_key_in_recorded_order_then_repeats_the_last(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    recorder = Cassette(path, "record")
+    recorder.record("mock:n", "¿A?", "sí", 0.5)
+    recorder.record("mock:n", "¿B?", "no", 0.1)
+    recorder.record("mock:n", "¿A?", "no es relevante", 0.2, chunks=["no es ", "relevante"])
+    recorder.close()
+
+    player = Cassette(path, "replay")
+    assert player.replay("mock:n", "¿A?") == ("sí", ["sí"], 0.5)
+    assert player.replay("mock:n", "¿A?") == ("no es relevante", ["no es ", "relevante"], 0.2)
+    assert player.replay("mock:n", "¿A?") == ("no es relevante", ["no es ", "relevante"], 0.2)
+    assert player.replay("mock:n", "¿B?")[0] == "no"
+    with pytest.raises(CassetteMissError):
+        player.replay("mock:d", "¿A?") # Same prompt, another model
+
+def test_prompts_are_stored_as_hashes(tmp_path):
+    path = tmp_path / "calls.jsonl"
+    recorder = Cassette(str(path), "record")
+    recorder.record("mock:n", "La solución secreta", "sí", 0.1)
+    recorder.close()
+    assert "La solución secreta" not in path.read_text(encoding="utf-8")
+
+def test_interrupted_recordings_keep_their_complete_lines(tmp_path):
+    path = tmp_path / "calls.jsonl.gz"
+    recorder = Cassette(str(path), "record")
+    recorder.record("mock:n", "¿A?", "sí", 0.1)
+    recorder.record("mock:n", "¿B?", "no", 0.1)
+    recorder.close()
+    data = gzip.decompress(path.read_bytes())
+    path.write_bytes(gzip.compress(data[:-10])[:-8]) # Cut inside the last line and drop the gzip trailer
+    player = Cassette(str(path), "replay")
+    assert player.replay("mock:n", "¿A?")[0] == "sí"
+    with pytest.raises(CassetteMissError):
+        player.replay("mock:n", "¿B?")
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "calls.jsonl"), "rewind")
+
+def test_client_replays_a_recorded_game_without_calling_the_backend(make_client, tmp_path):
+    path = str(tmp_path / "game.jsonl")
+    backend = FakeBackend({"n": ["sí", "no"]})
+    recorder = make_client(backend, cassette_mode="record", cassette_path=path)
+    assert recorder.generate_text("mock:n", "¿A?", prefix="Historia. ") == "sí"
+    assert "".join(recorder.stream_text("mock:n", "¿B?")) == "no"
+    recorder.core.cassette.close()
+
+    silent = FakeBackend({})
+    player = make_client(silent, cassette_mode="replay", cassette_path=path)
+    assert player.generate_text("mock:n", "¿A?", prefix="Historia. ") == "sí"
+    assert list(player.stream_text("mock:n", "¿B?")) == ["no"]
+    assert silent.calls == []
+    with pytest.raises(CassetteMissError):
+        player.generate_text("mock:n", "¿C?")
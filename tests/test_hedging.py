@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import FakeBackend
+from src.services.hedging import Hedger, HedgeAttempt, parse_fallbacks
+from src.services.retry import ParseError, ProviderError
+from src.utils.cancellation import CancelToken, GameCancelled
+
+FALLBACKS = "narrator=mock:spare"
+
+def warmed_hedger(delay: float = 0.05) -> Hedger:
+    """
+    A hedger that duplicates calls to mock:main still unanswered after `delay` seconds, with no budget limit.
+    """
+    hedger = Hedger(quantile=0.5, min_delay=delay, min_samples=1, budget=1.0)
+    hedger.observe("mock:main", delay)
+    return hedger
+
+def strict(reply: str) -> str:
+    if reply not in ("sí", "no"):
+        raise ParseError(reply)
+    return reply
+
+def test_parse_fallbacks():
+    fallbacks = parse_fallbacks("narrator=ollama:llama3@http://gpu2:11434, gemini:flash;gemini:pro=gemini:flash;bad=;=mock:x")
+    assert fallbacks == {
+        "narrator": ["ollama:llama3@http://gpu2:11434", "gemini:flash"],
+        "gemini:pro": ["gemini:flash"],
+    }
+
+def test_hedge_delay_is_the_latency_quantile():
+    hedger = Hedger(quantile=0.9, min_delay=0.0, min_samples=10)
+    for latency in range(1, 11):
+        assert hedger.start("mock:a") is None # Too few latencies yet
+        hedger.observe("mock:a", latency / 10)
+    assert hedger.start("mock:a") == 0.9
+    assert hedger.start("mock:b") is None
+
+def test_hedge_delay_is_never_below_min_delay():
+    hedger = Hedger(quantile=0.5, min_delay=0.5, min_samples=1)
+    hedger.observe("mock:a", 0.01)
+    assert hedger.start("mock:a") == 0.5
+
+def test_hedging_is_disabled_without_quantile_or_budget():
+    for hedger in (Hedger(quantile=0), Hedger(quantile=1), Hedger(budget=0)):
+        hedger.observe("mock:a", 1.0)
+        assert not hedger.enabled and hedger.start("mock:a") is None
+
+def test_budget_caps_the_fraction_of_hedged_calls():
+    hedger = Hedger(quantile=0.5, min_samples=1, budget=0.1)
+    hedger.observe("mock:a", 1.0)
+    hedged = 0
+    for _ in range(100):
+        hedger.start("mock:a")
+        hedged += hedger.try_hedge()
+    assert hedged == 10
+    assert hedger.get_stats()["over_budget"] == 90
+
+def test_hedge_attempt_follows_and_then_leaves_the_game_token():
+    game = CancelToken()
+    attempt = HedgeAttempt(game)
+    attempt.close()
+    assert game._callbacks == []
+    followed = HedgeAttempt(game)
+    game.cancel("client gone")
+    assert followed.token.reason == "client gone" and not followed.superseded
+
+def test_fast_call_is_not_hedged(make_client):
+    backend = FakeBackend({"main": "sí", "spare": "no"})
+    client = make_client(backend, warmed_hedger(0.2), model_fallbacks=FALLBACKS)
+    assert client.generate_text("mock:main", "¿?", role="narrator") == "sí"
+    assert backend.calls == ["main"]
+    assert client.core.hedger.get_stats()["hedged"] == 0
+
+def test_slow_call_is_answered_by_the_hedge(make_client):
+    backend = FakeBackend({"main": (2.0, "sí"), "spare": "no"})
+    client = make_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+    started = time.monotonic()
+    assert client.generate_text("mock:main", "¿?", role="narrator") == "no"
+    assert time.monotonic() - started < 1.0
+    assert backend.calls == ["main", "spare"]
+    assert client.core.hedger.get_stats()["won"] == 1
+    main_call = next(call for call in client.call_log if call["provider_model"] == "mock:main")
+    assert main_call["superseded"] and not main_call["ok"] # The slow request was aborted, not waited for
+    assert client.core.breakers.get("mock:main").failures == 0
+
+def test_primary_answering_first_wins_the_race(make_client):
+    backend = FakeBackend({"main": (0.15, "sí"), "spare": (2.0, "no")})
+    client = make_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+    started = time.monotonic()
+    assert client.generate_text("mock:main", "¿?", role="narrator") == "sí"
+    assert time.monotonic() - started < 1.0
+    assert backend.calls == ["main", "spare"]
+    assert client.core.hedger.get_stats()["won"] == 0
+
+def test_rejected_reply_loses_the_race(make_client):
+    backend = FakeBackend({"main": (0.1, "quizás"), "spare": (0.2, "no")})
+    client = make_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+    assert client.generate_text("mock:main", "¿?", role="narrator", parse=strict) == "no"
+    assert backend.calls == ["main", "spare"]
+
+def test_race_lost_by_both_raises_the_primary_error(make_client):
+    backend = FakeBackend({"main": (0.1, ProviderError("primero", 400)), "spare": ProviderError("segundo", 400)})
+    client = make_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+    with pytest.raises(ProviderError, match="primero"):
+        client.generate_text("mock:main", "¿?", role="narrator")
+    assert backend.calls == ["main", "spare"]
+
+def test_cancelled_game_stops_both_requests(make_client):
+    game = CancelToken()
+    backend = FakeBackend({"main": (5.0, "sí"), "spare": (5.0, "no")})
+    client = make_client(backend, warmed_hedger(), cancel_token=game, model_fallbacks=FALLBACKS)
+    threading.Timer(0.2, game.cancel, ("client gone",)).start()
+    started = time.monotonic()
+    with pytest.raises(GameCancelled):
+        client.generate_text("mock:main", "¿?", role="narrator")
+    assert time.monotonic() - started < 2.0
+    assert backend.calls == ["main", "spare"]
+
+def test_race_leaves_no_callback_on_the_game_token(make_client):
+    game = CancelToken()
+    backend = FakeBackend({"main": (0.1, "sí"), "spare": "no"})
+    client = make_client(backend, warmed_hedger(), cancel_token=game, model_fallbacks=FALLBACKS)
+    registered = len(game._callbacks)
+    for _ in range(5):
+        client.generate_text("mock:main", "¿?", role="narrator")
+    assert len(game._callbacks) == registered
+
+def test_async_slow_call_is_answered_by_the_hedge(make_async_client):
+    backend = FakeBackend({"main": (2.0, "sí"), "spare": "no"})
+    client = make_async_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+
+    async def main() -> float:
+        started = time.monotonic()
+        assert await client.generate_text("mock:main", "¿?", role="narrator") == "no"
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 1.0
+    assert backend.calls == ["main", "spare"]
+    assert client.hedger.get_stats()["won"] == 1
+
+def test_async_rejected_reply_loses_the_race(make_async_client):
+    backend = FakeBackend({"main": (0.1, "quizás"), "spare": (0.2, "no")})
+    client = make_async_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+    assert asyncio.run(client.generate_text("mock:main", "¿?", role="narrator", parse=strict)) == "no"
+    assert backend.calls == ["main", "spare"]
+
+def test_async_cancelled_call_cancels_both_requests(make_async_client):
+    backend = FakeBackend({"main": (5.0, "sí"), "spare": (5.0, "no")})
+    client = make_async_client(backend, warmed_hedger(), model_fallbacks=FALLBACKS)
+
+    async def main() -> None:
+        task = asyncio.create_task(client.generate_text("mock:main", "¿?", role="narrator"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0) # Lets the cancelled requests record themselves
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - started < 2.0
+    assert backend.calls == ["main", "spare"]
+    assert all(call["cancelled"] for call in client.call_log)
+
+def test_async_race_follows_the_game_token(make_async_client):
+    game = CancelToken()
+    backend = FakeBackend({"main": (5.0, "sí"), "spare": (5.0, "no")})
+    client = make_async_client(backend, warmed_hedger(), cancel_token=game, model_fallbacks=FALLBACKS)
+
+    async def main() -> None:
+        asyncio.get_running_loop().call_later(0.2, game.cancel, "client gone")
+        with pytest.raises(GameCancelled):
+            await client.generate_text("mock:main", "¿?", role="narrator")
+        await asyncio.sleep(0)
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - started < 2.0
+    assert backend.calls == ["main", "spare"]
+    assert all(call["cancelled"] and not call["superseded"] for call in client.call_log)
+    assert game._callbacks == []
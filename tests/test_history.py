@@ -0,0 +1,83 @@
+from src.models.history import ContextBudget, FactSheet, QAHistory, render_history
+from src.services.prompt_cache import estimate_tokens
+
+TURNS = [("¿Murió alguien?", "sí"), ("¿Fue un accidente?", "no"), ("¿Llovía?", "no es relevante")]
+
+def test_empty_history_renders_nothing():
+    assert render_history([], "caso") == ""
+    assert render_history(QAHistory(), "caso") == ""
+
+def test_qa_history_renders_like_a_plain_list():
+    history = QAHistory()
+    for turn in TURNS:
+        history.append(turn)
+        for style in ("interrogatorio", "caso"):
+            assert render_history(history, style) == render_history(list(history), style)
+    assert render_history(history, "interrogatorio").endswith("Detective: ¿Llovía?\nNarrador: no es relevante")
+
+def test_appends_reuse_the_cached_rendering():
+    history = QAHistory(TURNS[:2])
+    first = history.render("caso")
+    assert history.render("caso") is first # Unchanged history: served from the cache
+    history.append(TURNS[2])
+    assert history.render("caso") == render_history(TURNS, "caso")
+
+def test_rewriting_earlier_turns_resets_the_cache():
+    history = QAHistory(TURNS)
+    history.render("caso")
+    history[0] = ("¿Murió una mujer?", "no")
+    assert history.render("caso") == render_history(list(history), "caso")
+    history.pop(0)
+    assert history.render("caso") == render_history(TURNS[1:], "caso")
+    history.clear()
+    assert history.render("caso") == ""
+
+def long_game(turns: int) -> list:
+    answers = ["sí", "no", "no es relevante"]
+    return [(f"¿Pregunta número {i} sobre el caso?", answers[i % 3]) for i in range(turns)]
+
+def test_short_history_is_not_compacted():
+    budget = ContextBudget(max_tokens=1000, recent_turns=2)
+    assert render_history(TURNS, "caso", budget) == render_history(TURNS, "caso")
+
+def test_long_history_keeps_the_recent_turns_verbatim():
+    budget = ContextBudget(max_tokens=200, recent_turns=3)
+    turns = long_game(40)
+    section = render_history(turns, "caso", budget)
+    assert "Resumen de las 37 preguntas anteriores:" in section
+    assert section.endswith("Últimas preguntas:\n" + "\n".join(f"Pregunta: {q}\nRespuesta: {a}" for q, a in turns[-3:]))
+    assert "Pregunta número 0" not in section.split("Últimas preguntas:")[1]
+
+def test_compaction_trims_irrelevant_then_ruled_out_facts_to_fit_the_budget():
+    budget = ContextBudget(max_tokens=300, recent_turns=2)
+    turns = [(f"¿Pregunta número {i} sobre el caso?", "sí" if i % 10 == 0 else "no" if i % 2 else "no es relevante") for i in range(60)]
+    section = render_history(turns, "caso", budget)
+    assert estimate_tokens(section) <= budget.max_tokens
+    sheet = section.split("Últimas preguntas:")[0]
+    assert all(f"- Pregunta número {i} sobre el caso\n" in sheet for i in range(0, 58, 10))
+    assert "Temas no relevantes" not in sheet and "- Pregunta número 57 sobre el caso" in sheet # Oldest ruled-out facts go next
+
+def test_confirmed_facts_are_kept_even_past_the_budget():
+    budget = ContextBudget(max_tokens=100, recent_turns=2)
+    turns = [(f"¿Pregunta número {i} sobre el caso?", "sí") for i in range(30)]
+    sheet = render_history(turns, "caso", budget).split("Últimas preguntas:")[0]
+    assert all(f"- Pregunta número {i} sobre el caso\n" in sheet for i in range(28))
+
+def test_fact_sheet_keeps_the_latest_answer_once():
+    sheet = FactSheet()
+    sheet.add("¿Estaba sola la mujer?", "no")
+    sheet.add("¿Estaba SOLA la mujer?", "Sí.")
+    rendered = sheet.render(1000)
+    assert sheet.turns == 2 and rendered.count("Estaba") == 1
+    assert "Hechos confirmados" in rendered and "Hechos descartados" not in rendered
+
+def test_compacted_qa_history_renders_like_a_plain_list():
+    budget = ContextBudget(max_tokens=200, recent_turns=3)
+    history = QAHistory()
+    for turn in long_game(30):
+        history.append(turn)
+        assert render_history(history, "interrogatorio", budget) == render_history(list(history), "interrogatorio", budget)
+
+def test_budget_from_config():
+    assert ContextBudget.from_config({"context_budget_tokens": 0}) is None
+    assert ContextBudget.from_config({"context_budget_tokens": 500, "context_recent_turns": 0}) == ContextBudget(500, 1)
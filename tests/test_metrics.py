@@ -0,0 +1,48 @@
+from src.utils.metrics import MetricsRegistry
+
+def test_counter_renders_one_sample_per_label_set():
+    registry = MetricsRegistry()
+    calls = registry.counter("llm_calls_total", "LLM calls.", ("model", "outcome"))
+    calls.inc(model="llama3", outcome="ok")
+    calls.inc(2, model="llama3", outcome="ok")
+    calls.inc(0.5, model="flash", outcome="error")
+    assert registry.render() == (
+        "# HELP llm_calls_total LLM calls.\n"
+        "# TYPE llm_calls_total counter\n"
+        'llm_calls_total{model="flash",outcome="error"} 0.5\n'
+        'llm_calls_total{model="llama3",outcome="ok"} 3\n'
+    )
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("model",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, model="llama3")
+    assert latency.samples() == [
+        'latency_seconds_bucket{model="llama3",le="0.1"} 2',
+        'latency_seconds_bucket{model="llama3",le="1"} 3',
+        'latency_seconds_bucket{model="llama3",le="+Inf"} 4',
+        'latency_seconds_count{model="llama3"} 4',
+        'latency_seconds_sum{model="llama3"} 3.65',
+    ]
+
+def test_gauge_is_collected_at_render_time():
+    registry = MetricsRegistry()
+    sessions = {("web",): 1}
+    registry.gauge("active_games", "Games in progress.", ("mode",), lambda: sessions)
+    sessions[("web",)] = 4
+    assert registry.render().splitlines()[-1] == 'active_games{mode="web"} 4'
+
+def test_label_values_are_escaped_and_unlabelled_metrics_have_no_braces():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors.", ("reason",)).inc(reason='dijo "no"\\\n')
+    registry.counter("games_total", "Games.").inc()
+    samples = registry.render().splitlines()
+    assert 'errors_total{reason="dijo \\"no\\"\\\\\\n"} 1' in samples
+    assert "games_total 1" in samples
+
+def test_registering_a_name_again_returns_the_first_metric():
+    registry = MetricsRegistry()
+    first = registry.counter("games_total", "Games.")
+    assert registry.counter("games_total", "Otra ayuda.") is first
+    assert registry.render().count("# TYPE games_total") == 1
@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+from typing import List
+
+import pytest
+
+from src.services.rate_limiter import RateLimit, RateLimiter, Ticket, parse_rate_limits, parse_retry_after
+from src.utils.cancellation import CancelToken, GameCancelled
+
+class FakeClock:
+    """
+    A monotonic clock that only moves when the test advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+def wait_until(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def waiting(limiter: RateLimiter) -> int:
+    return int(sum(limiter.queue_depths().values()))
+
+def start_waiter(limiter: RateLimiter, key: str, name: str, admitted: List[str], priority: str = "background", session: str = "", cancel_token: CancelToken | None = None) -> threading.Thread:
+    """
+    Starts a thread that waits for admission, records `name` once admitted and ends its call at once.
+    Returns once the call is queued, so waiters are queued in the order they are started.
+    """
+    queued = waiting(limiter) + 1
+
+    def run() -> None:
+        try:
+            ticket = limiter.acquire(key, 10, priority=priority, session=session, cancel_token=cancel_token)
+        except GameCancelled:
+            admitted.append(f"{name} cancelled")
+            return
+        admitted.append(name)
+        ticket.release()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    wait_until(lambda: waiting(limiter) >= queued or not thread.is_alive())
+    return thread
+
+def test_parse_rate_limits():
+    limits = parse_rate_limits("gemini=15/1000000; ollama=0/0/2; gemini:gemini-2.5-pro=2; bad=x/1")
+    assert limits == {
+        "gemini": RateLimit(15, 1000000, 0),
+        "ollama": RateLimit(0, 0, 2),
+        "gemini:gemini-2.5-pro": RateLimit(2, 0, 0),
+    }
+
+@pytest.mark.parametrize("header, body, expected", [
+    ("7", "", 7.0),
+    ("1.5", '"retryDelay": "30s"', 1.5), # The header wins over the body
+    ("-3", "", 0.0),
+    (None, '{"error": {"details": [{"@type": "RetryInfo", "retryDelay": "17s"}]}}', 17.0),
+    (None, '"retryDelay":"0.25s"', 0.25),
+    ("pronto", '"retryDelay": "2s"', 2.0), # Unreadable header: falls back to the body
+    (None, '{"error": "quota exceeded"}', None),
+    (formatdate(0, usegmt=True), "", 0.0), # A date in the past
+])
+def test_parse_retry_after(header, body, expected):
+    assert parse_retry_after(body, header) == expected
+
+def test_parse_retry_after_reads_http_dates():
+    assert 55 <= parse_retry_after("", formatdate(time.time() + 60, usegmt=True)) <= 60
+
+def test_unlimited_provider_is_admitted_at_once():
+    limiter = RateLimiter({"gemini": RateLimit(1)})
+    ticket = limiter.acquire("ollama:llama3", 100)
+    ticket.release()
+    assert limiter.get_stats() == {}
+
+def test_request_bucket_refills_with_the_clock():
+    clock = FakeClock()
+    limiter = RateLimiter({"gemini": RateLimit(requests_per_minute=2)}, clock=clock)
+    first = limiter.acquire("gemini:flash", 10)
+    second = limiter.acquire("gemini:flash", 10)
+    admitted: List[str] = []
+    thread = start_waiter(limiter, "gemini:flash", "third", admitted)
+
+    first.release() # Frees no request: the bucket is empty until the clock moves
+    time.sleep(0.05)
+    assert admitted == [] and waiting(limiter) == 1
+
+    clock.advance(30) # Half a minute refills one of the two requests
+    second.release() # Has the queue re-checked
+    thread.join(2)
+    assert admitted == ["third"]
+    stats = limiter.get_stats()["gemini"]
+    assert stats["admitted"] == 3 and stats["queued"] == 1 and stats["in_flight"] == 0
+
+def test_model_limits_take_precedence_over_the_provider():
+    clock = FakeClock()
+    limiter = RateLimiter({"gemini": RateLimit(1), "gemini:pro": RateLimit(5)}, clock=clock)
+    for _ in range(5):
+        limiter.acquire("gemini:pro", 10).release()
+    limiter.acquire("gemini:flash", 10).release()
+    stats = limiter.get_stats()
+    assert stats["gemini:pro"]["admitted"] == 5 and stats["gemini"]["admitted"] == 1
+
+def test_release_charges_the_tokens_really_used():
+    clock = FakeClock()
+    limiter = RateLimiter({"gemini": RateLimit(tokens_per_minute=1000)}, clock=clock)
+    ticket = limiter.acquire("gemini:flash", 300)
+    assert limiter.get_stats()["gemini"]["tokens_available"] == 700
+    ticket.release(used_tokens=500)
+    assert limiter.get_stats()["gemini"]["tokens_available"] == 500
+    ticket.release(used_tokens=500) # A second release is a no-op
+    stats = limiter.get_stats()["gemini"]
+    assert stats["tokens_available"] == 500 and stats["in_flight"] == 0
+
+def test_call_larger_than_the_bucket_waits_for_a_full_bucket_only():
+    clock = FakeClock()
+    limiter = RateLimiter({"gemini": RateLimit(tokens_per_minute=1000)}, clock=clock)
+    limiter.acquire("gemini:flash", 5000).release(used_tokens=5000)
+    assert limiter.get_stats()["gemini"]["tokens_available"] == -4000
+
+def test_concurrency_cap_admits_the_next_call_on_release():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+    holder = limiter.acquire("ollama:llama3", 10)
+    token = CancelToken()
+    admitted: List[str] = []
+    thread = start_waiter(limiter, "ollama:llama3", "next", admitted, cancel_token=token)
+    assert admitted == [] and limiter.in_flight() == {("ollama",): 1}
+    holder.release()
+    thread.join(2)
+    assert admitted == ["next"] and limiter.in_flight() == {("ollama",): 0}
+    assert token._callbacks == [] # The admitted call unlinked itself from the game's token
+
+def test_queue_is_ordered_by_priority_then_fairly_across_sessions():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+    holder = limiter.acquire("ollama:llama3", 10, session="holder")
+    admitted: List[str] = []
+    threads = [
+        start_waiter(limiter, "ollama:llama3", "pool", admitted, priority="prefetch"),
+        start_waiter(limiter, "ollama:llama3", "a1", admitted, session="a"),
+        start_waiter(limiter, "ollama:llama3", "a2", admitted, session="a"),
+        start_waiter(limiter, "ollama:llama3", "a3", admitted, session="a"),
+        start_waiter(limiter, "ollama:llama3", "b1", admitted, session="b"),
+        start_waiter(limiter, "ollama:llama3", "player", admitted, priority="interactive", session="c"),
+    ]
+    assert limiter.queue_depths() == {("ollama", "interactive"): 1, ("ollama", "background"): 4, ("ollama", "prefetch"): 1}
+    holder.release()
+    for thread in threads:
+        thread.join(2)
+    assert admitted == ["player", "a1", "b1", "a2", "a3", "pool"]
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+    holder = limiter.acquire("ollama:llama3", 10)
+    token = CancelToken()
+    admitted: List[str] = []
+    thread = start_waiter(limiter, "ollama:llama3", "game", admitted, cancel_token=token)
+    token.cancel("client gone")
+    thread.join(2)
+    assert admitted == ["game cancelled"]
+    assert waiting(limiter) == 0 and limiter.in_flight() == {("ollama",): 1}
+    holder.release()
+    assert limiter.in_flight() == {("ollama",): 0}
+
+def test_waiter_cancelled_as_it_is_admitted_gives_its_slot_back():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+    for _ in range(50):
+        holder = limiter.acquire("ollama:llama3", 10)
+        token = CancelToken()
+        admitted: List[str] = []
+        thread = start_waiter(limiter, "ollama:llama3", "game", admitted, cancel_token=token)
+        holder.release() # Admits the waiter, which may still see the cancellation first
+        token.cancel()
+        thread.join(2)
+        assert len(admitted) == 1
+        assert waiting(limiter) == 0 and limiter.in_flight() == {("ollama",): 0}
+
+def test_async_waiter_is_admitted_on_release():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+
+    async def main() -> None:
+        holder = limiter.acquire("ollama:llama3", 10)
+        task = asyncio.create_task(limiter.acquire_async("ollama:llama3", 10))
+        await asyncio.sleep(0.01)
+        assert not task.done() and waiting(limiter) == 1
+        holder.release()
+        ticket = await asyncio.wait_for(task, 2)
+        assert isinstance(ticket, Ticket) and limiter.in_flight() == {("ollama",): 1}
+        ticket.release()
+
+    asyncio.run(main())
+    assert limiter.in_flight() == {("ollama",): 0}
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    limiter = RateLimiter({"ollama": RateLimit(concurrency=1)}, clock=FakeClock())
+
+    async def main() -> None:
+        holder = limiter.acquire("ollama:llama3", 10)
+        task = asyncio.create_task(limiter.acquire_async("ollama:llama3", 10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert waiting(limiter) == 0
+        holder.release()
+
+    asyncio.run(main())
+    assert limiter.in_flight() == {("ollama",): 0}
+
+def test_pause_holds_admissions_until_the_clock_passes_it():
+    clock = FakeClock()
+    limiter = RateLimiter({"gemini": RateLimit(requests_per_minute=60)}, clock=clock)
+    holder = limiter.acquire("gemini:flash", 10)
+    limiter.pause("gemini:flash", 10)
+    assert limiter.get_stats()["gemini"]["paused_for"] == 10
+    admitted: List[str] = []
+    thread = start_waiter(limiter, "gemini:flash", "after pause", admitted)
+    clock.advance(10)
+    holder.release()
+    thread.join(2)
+    assert admitted == ["after pause"] and limiter.get_stats()["gemini"]["rate_limited"] == 1
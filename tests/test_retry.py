@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from conftest import FakeBackend
+from src.services.rate_limiter import RateLimitError
+from src.services.retry import (
+    CircuitBreaker, CircuitOpenError, ParseError, ProviderError, ProviderTimeout, RetryPolicy, classify_error,
+)
+from src.utils.cancellation import GameCancelled
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.mark.parametrize("error, kind", [
+    (ProviderTimeout("timed out"), "timeout"),
+    (ConnectionResetError("reset"), "connection"),
+    (RateLimitError("429", retry_after=2.0), "rate_limit"),
+    (ProviderError("503", 503), "server"),
+    (ProviderError("400", 400), None),
+    (ProviderError("no status"), None),
+    (ParseError("bad JSON"), "parse"),
+    (ValueError("GEMINI_API_KEY no está configurada"), None),
+    (KeyError("provider"), None),
+    (GameCancelled("gone"), None),
+    (CircuitOpenError("open"), None),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+def test_retry_policy_stops_after_max_attempts():
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=20.0)
+    assert policy.delay(None, 0) is None
+    assert 0 <= policy.delay("server", 0) <= 1.0
+    assert 0 <= policy.delay("server", 1) <= 2.0
+    assert policy.delay("server", 2) is None
+
+def test_retry_policy_backoff_is_capped():
+    policy = RetryPolicy(max_attempts=10, base_delay=1.0, max_delay=5.0)
+    assert all(policy.delay("timeout", 8) <= 5.0 for _ in range(100))
+
+def test_retry_policy_honors_retry_after_within_max_delay():
+    policy = RetryPolicy(max_attempts=4, base_delay=0.4, max_delay=20.0)
+    assert 3.0 <= policy.delay("rate_limit", 0, retry_after=3.0) <= 3.1
+    assert policy.delay("rate_limit", 0, retry_after=60.0) is None
+
+def test_breaker_opens_after_threshold_failures_in_a_row():
+    breaker = CircuitBreaker("mock:a", failure_threshold=3, reset_timeout=30.0, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success() # Resets the count
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError, match="30s"):
+        breaker.allow()
+
+def test_breaker_half_opens_for_one_trial_after_reset_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker("mock:a", failure_threshold=1, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    clock.now += 29.0
+    with pytest.raises(CircuitOpenError, match="1s"):
+        breaker.allow()
+    clock.now += 1.0
+    breaker.allow() # The trial call
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow() # Only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    breaker.allow()
+
+def test_failed_trial_opens_the_breaker_again():
+    clock = FakeClock()
+    breaker = CircuitBreaker("mock:a", failure_threshold=5, reset_timeout=30.0, clock=clock)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30.0
+    breaker.allow()
+    breaker.record_failure() # A single failure is enough in half-open
+    assert breaker.state == "open" and breaker.opened_at == clock.now
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+def test_released_trial_lets_another_one_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker("mock:a", failure_threshold=1, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    clock.now += 30.0
+    breaker.allow()
+    breaker.release_trial() # E.g. the trial call was cancelled
+    assert breaker.state == "half_open"
+    breaker.allow()
+
+def test_transient_errors_are_retried(make_client):
+    backend = FakeBackend({"flaky": [ProviderError("503", 503), ProviderTimeout("slow"), "hola"]})
+    client = make_client(backend)
+    assert client.generate_text("mock:flaky", "¿?") == "hola"
+    assert backend.calls == ["flaky"] * 3
+    breaker = client.core.breakers.get("mock:flaky")
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_rejected_replies_are_retried_without_failing_the_breaker(make_client):
+    backend = FakeBackend({"chatty": ["quizás", "sí"]})
+    client = make_client(backend)
+
+    def parse(reply: str) -> str:
+        if reply not in ("sí", "no"):
+            raise ParseError(reply)
+        return reply
+
+    assert client.generate_text("mock:chatty", "¿?", parse=parse) == "sí"
+    assert backend.calls == ["chatty", "chatty"]
+    assert client.core.breakers.get("mock:chatty").failures == 0
+
+def test_configuration_errors_are_not_retried(make_client):
+    backend = FakeBackend({"broken": ValueError("falta la clave")})
+    client = make_client(backend)
+    with pytest.raises(ValueError, match="falta la clave"):
+        client.generate_text("mock:broken", "¿?")
+    assert backend.calls == ["broken"]
+    assert client.core.breakers.get("mock:broken").failures == 0
+
+def test_client_errors_are_not_retried(make_client):
+    backend = FakeBackend({"strict": ProviderError("400", 400)})
+    client = make_client(backend)
+    with pytest.raises(ProviderError):
+        client.generate_text("mock:strict", "¿?")
+    assert backend.calls == ["strict"]
+
+def test_open_breaker_fails_calls_without_sending_them(make_client):
+    backend = FakeBackend({"down": ProviderError("503", 503)})
+    client = make_client(backend)
+    with pytest.raises(ProviderError):
+        client.generate_text("mock:down", "¿?")
+    assert len(backend.calls) == 3 and client.core.breakers.get("mock:down").state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.generate_text("mock:down", "¿?")
+    assert len(backend.calls) == 3
+
+def test_retries_fail_over_to_the_fallback_backends(make_client):
+    backend = FakeBackend({"down": ProviderError("503", 503), "spare": "hola"})
+    client = make_client(backend, model_fallbacks="narrator=mock:spare")
+    assert client.generate_text("mock:down", "¿?", role="narrator") == "hola"
+    assert backend.calls == ["down", "spare"]
+    assert client.core.breakers.get("mock:down").failures == 1
+
+def test_calls_skip_a_backend_whose_breaker_is_open(make_client):
+    backend = FakeBackend({"down": "nunca", "spare": "hola"})
+    client = make_client(backend, model_fallbacks="narrator=mock:spare")
+    for _ in range(3):
+        client.core.breakers.get("mock:down").record_failure()
+    assert client.generate_text("mock:down", "¿?", role="narrator") == "hola"
+    assert backend.calls == ["spare"]
+
+OLLAMA = {"ollama_host": "http://127.0.0.1:11434", "stream_responses": True}
+
+def test_ollama_error_frame_fails_the_stream(make_client):
+    backend = FakeBackend({"llama3": '{"response": "El hombre"}\n{"error": "model runner has unexpectedly stopped"}\n'})
+    client = make_client(backend, **OLLAMA)
+    chunks = []
+    with pytest.raises(ProviderError, match="unexpectedly stopped") as raised:
+        for chunk in client.stream_text("ollama:llama3", "¿?"):
+            chunks.append(chunk)
+    assert classify_error(raised.value) == "server"
+    assert chunks == ["El hombre"] and backend.calls == ["llama3"] # Text already reached the reader: no retry
+
+def test_ollama_error_frame_before_any_text_is_retried(make_client):
+    backend = FakeBackend({"llama3": ['{"error": "out of memory"}\n', '{"response": "sí"}\n{"done": true}\n']})
+    client = make_client(backend, **OLLAMA)
+    assert list(client.stream_text("ollama:llama3", "¿?")) == ["sí"]
+    assert backend.calls == ["llama3", "llama3"]
+
+def test_async_ollama_error_frame_fails_the_stream(make_async_client):
+    backend = FakeBackend({"llama3": '{"response": "El hombre"}\n{"error": "model runner has unexpectedly stopped"}\n'})
+    client = make_async_client(backend, **OLLAMA)
+
+    async def main() -> None:
+        async for _ in client.stream_text("ollama:llama3", "¿?"):
+            pass
+
+    with pytest.raises(ProviderError, match="unexpectedly stopped"):
+        asyncio.run(main())
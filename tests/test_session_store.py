@@ -0,0 +1,78 @@
+import pytest
+
+from src.services import session_store
+from src.services.session_store import SessionStore, estimate_memory
+from src.services.story_pool import StoryPool
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(session_store.time, "monotonic", clock)
+    return clock
+
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(max_size=2)
+    store.put("a", "partida a")
+    store.put("b", "partida b")
+    assert store.get("a") == "partida a" # Now "b" is the least recently used
+    store.put("c", "partida c")
+    assert store.get("b") is None
+    assert sorted(store.games()) == ["partida a", "partida c"]
+    assert store.get_stats()["evicted"] == 1
+
+def test_replacing_a_session_game_does_not_evict_others(clock):
+    store = SessionStore(max_size=2)
+    store.put("a", "primera")
+    store.put("b", "partida b")
+    store.put("a", "segunda")
+    assert store.get("a") == "segunda" and store.get("b") == "partida b"
+    assert store.get_stats()["evicted"] == 0
+
+def test_idle_sessions_expire_and_lookups_keep_them_alive(clock):
+    store = SessionStore(idle_ttl=60.0)
+    store.put("a", "partida a")
+    store.put("b", "partida b")
+    clock.now += 50.0
+    assert store.get("a") == "partida a"
+    clock.now += 50.0
+    assert store.get("a") == "partida a"
+    assert store.get("b") is None
+    assert store.get_stats()["expired"] == 1 and len(store) == 1
+
+def test_finished_games_expire_sooner(clock):
+    store = SessionStore(idle_ttl=1800.0, finished_ttl=300.0)
+    game = object()
+    store.put("a", game)
+    store.finish("a", game)
+    clock.now += 200.0
+    assert store.get("a") is game
+    clock.now += 301.0
+    assert store.games() == []
+
+def test_stale_finish_and_release_leave_the_new_game_alone(clock):
+    store = SessionStore(idle_ttl=1800.0, finished_ttl=300.0)
+    old, new = object(), object()
+    store.put("a", old)
+    store.put("a", new)
+    store.finish("a", old)
+    assert not store.release("a", old)
+    clock.now += 600.0
+    assert store.get("a") is new
+    assert store.release("a") and store.get("a") is None
+    assert store.get_stats()["released"] == 1
+
+def test_memory_estimate_skips_shared_services():
+    game = {"historia": "x" * 10_000}
+    alone = estimate_memory(game)
+    pool = StoryPool.__new__(StoryPool) # Only its type matters
+    pool.stories = ["y" * 100_000]
+    game["pool"] = pool
+    assert alone >= 10_000
+    assert estimate_memory(game) - alone < 1_000
@@ -0,0 +1,57 @@
+import json
+import threading
+from typing import List
+
+from src.models.story import Story
+from src.services import story_pool
+from src.services.story_pool import MAX_INVALID_STORIES, StoryPool
+from src.utils.config import Config
+
+class ScriptedGenerator:
+    """
+    Stands in for StoryGenerator, handing out `stories` in order.
+    """
+
+    def __init__(self, stories: List[Story]):
+        self.stories = stories
+        self.calls = 0
+
+    def generate_story(self, difficulty: str) -> Story:
+        self.calls += 1
+        return self.stories.pop(0)
+
+def make_pool(tmp_path, monkeypatch, stories: List[Story], size: int = 2) -> tuple:
+    generator = ScriptedGenerator(stories)
+    monkeypatch.setattr(story_pool, "StoryGenerator", lambda api_client, narrator_model: generator)
+    pool = StoryPool(Config(parse_cli=False).get_config(), size=size, path=str(tmp_path / "pool.json"))
+    return pool, generator
+
+def test_refill_fills_the_pool_and_saves_it(tmp_path, monkeypatch):
+    pool, _ = make_pool(tmp_path, monkeypatch, [Story("a", "b"), Story("c", "d")])
+    pool._refill(("easy", "mock:n"))
+    assert pool.get_stats()["ready"] == {"easy|mock:n": 2}
+    assert StoryPool({}, size=2, path=pool.path).get_stats()["ready"] == {"easy|mock:n": 2}
+
+def test_refill_gives_up_after_repeated_unplayable_stories(tmp_path, monkeypatch):
+    pool, generator = make_pool(tmp_path, monkeypatch, [Story("a", "a")] * 10)
+    pool._refill(("easy", "mock:n"))
+    assert generator.calls == MAX_INVALID_STORIES
+    assert pool.get_stats()["failed_refills"] == 1
+
+def test_an_unplayable_story_alone_does_not_stop_the_refill(tmp_path, monkeypatch):
+    pool, _ = make_pool(tmp_path, monkeypatch, [Story("", "x"), Story("a", "b"), Story("c", "c"), Story("e", "f")])
+    pool._refill(("easy", "mock:n"))
+    stats = pool.get_stats()
+    assert stats["ready"] == {"easy|mock:n": 2} and stats["failed_refills"] == 0
+
+def test_concurrent_saves_leave_a_readable_file(tmp_path, monkeypatch, caplog):
+    pool, _ = make_pool(tmp_path, monkeypatch, [])
+    pool._stories[("easy", "mock:n")] = story_pool.deque([Story("a", "b")] * 20)
+    threads = [threading.Thread(target=lambda: [pool._save() for _ in range(20)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(pool.path, encoding="utf-8") as f:
+        assert len(json.load(f)["easy|mock:n"]) == 20
+    assert "No se pudo guardar" not in caplog.text
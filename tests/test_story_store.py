@@ -0,0 +1,63 @@
+from src.models.story import Story
+from src.services.story_store import StoryStore, estimate_similarity, minhash, normalize_text, shingles
+
+BAR = "Una mujer entra en un bar y pide un vaso de agua. El camarero le apunta con una pistola y ella le da las gracias."
+BAR_REWORDED = "Una mujer entra en un bar y pide un vaso de agua. El camarero le apunta con un revólver y ella le da las gracias."
+CABIN = "Dos hombres aparecen muertos en una cabaña en la montaña. No hay signos de violencia ni de lucha."
+
+def make_store(tmp_path) -> StoryStore:
+    return StoryStore(str(tmp_path / "stories.db"), threshold=0.6)
+
+def test_normalize_text():
+    assert normalize_text("¡Él  MURIÓ, ayer!") == "el murio ayer"
+
+def test_short_texts_are_a_single_shingle():
+    assert shingles("Sí") == {"si"}
+    assert shingles("abcdef") == {"abcde", "bcdef"}
+
+def test_minhash_estimates_the_similarity_of_texts():
+    assert estimate_similarity(minhash(BAR), minhash(BAR.upper())) == 1.0
+    assert estimate_similarity(minhash(BAR), minhash(BAR_REWORDED)) >= 0.6
+    assert estimate_similarity(minhash(BAR), minhash(CABIN)) < 0.3
+
+def test_near_duplicates_are_not_stored_twice(tmp_path):
+    store = make_store(tmp_path)
+    story_id, is_new = store.add(Story(BAR, "Tenía hipo."), "media", "mock:n")
+    assert is_new
+    assert store.add(Story(BAR_REWORDED, "Tenía hipo."), "facil", "mock:x") == (story_id, False)
+    assert store.add(Story(CABIN, "Se cayó el avión."), "media", "mock:n")[1]
+    assert store.count() == 2
+    duplicate_id, similarity = store.find_duplicate(BAR_REWORDED)
+    assert duplicate_id == story_id and similarity >= 0.6
+    assert store.find_duplicate("Un hombre empuja su coche hasta un hotel y se declara en bancarrota.") is None
+    store.close()
+
+def test_random_and_stats_filter_by_key(tmp_path):
+    store = make_store(tmp_path)
+    store.add(Story(BAR, "Tenía hipo."), "media", "mock:n")
+    store.add(Story(CABIN, "Se cayó el avión."), "dificil", "mock:n")
+    assert store.random("dificil", "mock:n").mystery_situation == CABIN
+    assert store.random("facil") is None
+    assert store.get_stats() == {"media|mock:n": 1, "dificil|mock:n": 1}
+    store.close()
+
+def test_stories_survive_reopening_the_store(tmp_path):
+    store = make_store(tmp_path)
+    story_id, _ = store.add(Story(BAR, "Tenía hipo."), "media", "mock:n")
+    store.close()
+    reopened = make_store(tmp_path)
+    assert reopened.get(story_id) == Story(BAR, "Tenía hipo.")
+    assert reopened.find_duplicate(BAR_REWORDED)[0] == story_id
+    reopened.close()
+
+def test_ingest_markdown_skips_duplicates(tmp_path):
+    seeds = tmp_path / "seeds.md"
+    seeds.write_text(
+        '{"situacion_misteriosa": "' + BAR + '", "solucion_oculta": "Tenía hipo."}\n\n'
+        f"- **Situación misteriosa:** {BAR_REWORDED}\n- **Solución oculta:** Tenía hipo.\n\n"
+        f"Situación misteriosa: {CABIN}\nSolución oculta: Se estrelló su avión.\n",
+        encoding="utf-8",
+    )
+    store = make_store(tmp_path)
+    assert store.ingest_markdown(str(seeds)) == (3, 2)
+    store.close()
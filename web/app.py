@@ -5,17 +5,87 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import json
+import logging
 from flask import Flask, render_template, request, Response
 from src.utils.config import Config
-import asyncio
 from src.game.game_engine import GameEngine
 from src.game.fight_engine import FightEngine # Import FightEngine
 from src.game.council_engine import CouncilEngine # Import CouncilEngine
 from src.game.inverse_engine import InverseEngine # Import InverseEngine
+from src.game.tournament_engine import TournamentEngine
 from src.services.hint_generator import HintGenerator # Import HintGenerator
+from src.services.usage import get_usage_tracker
+from src.services.session_store import get_session_store
+from src.services.rate_limiter import get_rate_limiter
+from src.utils.background_loop import get_background_loop
+from src.utils.cancellation import CancelToken, get_disconnect_watcher
+from src.utils.log import STREAM_LINE
+from src.utils.metrics import HINT_REQUESTS, STREAM_BYTES, get_metrics
+
+logger = logging.getLogger("web.app")
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
-active_games = {} # Dictionary to store game instances by session_id
+sessions = get_session_store(Config(parse_cli=False).get_config()) # Game instances by session_id, bounded in size and idle time
+game_loop = get_background_loop() # Event loop shared by the async game modes (fight, council, tournament)
+disconnect_watcher = get_disconnect_watcher()
+rate_limiter = get_rate_limiter(Config(parse_cli=False).get_config()) # Admission control of the LLM calls of every game
+
+# Mode label of each engine class in the /metrics gauges
+GAME_MODES = {
+    GameEngine: "single",
+    FightEngine: "fight",
+    CouncilEngine: "council",
+    TournamentEngine: "tournament",
+    InverseEngine: "inverse",
+}
+
+def count_active_games():
+    counts = dict.fromkeys(((mode,) for mode in GAME_MODES.values()), 0)
+    for game in sessions.games():
+        mode = GAME_MODES.get(type(game), "other")
+        counts[(mode,)] = counts.get((mode,), 0) + 1
+    return counts
+
+get_metrics().gauge("blackstories_active_games", "Games held in memory by mode.", ("mode",), count_active_games)
+get_metrics().gauge("blackstories_session_memory_bytes", "Estimated memory held by the stored games.", (), lambda: {(): sessions.get_stats(memory=True)["memory_bytes"]})
+
+def watch_client() -> CancelToken:
+    """
+    Returns a token cancelled as soon as the client of the current request disconnects.
+    It needs the server to expose the client socket (the Werkzeug and Gunicorn servers do);
+    otherwise a disconnect is only noticed when writing to it fails.
+    """
+    token = CancelToken()
+    sock = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    if sock is not None:
+        disconnect_watcher.watch(sock, token)
+    return token
+
+def count_bytes(generator, mode: str, cancel_token: CancelToken | None):
+    """
+    Passes the lines of a stream through, adding their size to the streamed bytes metric.
+    Stops, closing the game's generator, once the client has disconnected.
+    """
+    try:
+        for chunk in generator:
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            STREAM_BYTES.inc(len(chunk.encode('utf-8')), mode=mode)
+            yield chunk
+    finally:
+        generator.close()
+        if cancel_token is not None:
+            disconnect_watcher.unwatch(cancel_token)
+
+def ndjson_stream(generator, mode: str, cancel_token: CancelToken | None = None) -> Response:
+    """
+    Wraps a line generator in a streaming NDJSON response.
+    Proxy buffering and caching are disabled so each delta reaches the browser as soon as it is yielded.
+    """
+    response = Response(count_bytes(generator, mode, cancel_token), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/')
 def index():
@@ -32,24 +102,31 @@ def start_game():
     if not session_id:
         return Response(json.dumps({"type": "error", "content": "Session ID required"}), mimetype='application/x-ndjson')
 
+    cancel_token = watch_client()
+
     def generate():
         try:
             config_loader = Config(parse_cli=False)
             config = config_loader.get_config()
-            game_engine = GameEngine(config)
-            active_games[session_id] = game_engine # Store instance
+            config["llm_session"] = session_id # An AI-only game: its calls yield to players waiting for an answer
+            game_engine = GameEngine(config, cancel_token)
+            sessions.put(session_id, game_engine) # Store instance
             
             for line in game_engine.run(difficulty, narrator_model, detective_model):
-                print(f"DEBUG: Yielding line: {line}") # Added for debugging
+                logger.debug("Yielding line: %s", line, extra=STREAM_LINE)
                 yield line + '\n'
+            if cancel_token.cancelled:
+                sessions.release(session_id, game_engine)
+            else:
+                sessions.finish(session_id, game_engine) # Kept a little longer so the conversation can be saved
         except Exception as e:
-            print(f"ERROR: An exception occurred in generate: {e}") # Added for debugging
+            logger.exception("An exception occurred in generate")
             yield json.dumps({"type": "error", "content": f"An error occurred: {e}"})
 
-    return Response(generate(), mimetype='application/x-ndjson')
+    return ndjson_stream(generate(), 'single', cancel_token)
 
 @app.route('/start_fight', methods=['POST'])
-async def start_fight():
+def start_fight():
     data = request.json
     # Use the narrator model from the main game form as the default for fight mode
     # If the main form's narrator model is not provided, default to 'gpt-4'
@@ -62,48 +139,34 @@ async def start_fight():
     if not session_id:
         return Response(json.dumps({"type": "error", "content": "Session ID required"}), mimetype='application/x-ndjson')
 
-    def generate_fight_stream_sync():
+    async def stream_content():
+        config_loader = Config(parse_cli=False)
+        config = config_loader.get_config()
         
-        async def stream_content():
-            config_loader = Config(parse_cli=False)
-            config = config_loader.get_config()
-            
-            # Override default difficulty with the one from the frontend
-            if difficulty:
-                config["difficulty"] = difficulty
-                print(f"DEBUG: Fight mode difficulty set to: {difficulty}")
-
-            fight_engine = FightEngine(config)
-            active_games[session_id] = fight_engine # Store instance
-
-            try:
-                async for line in fight_engine.run(narrator_model, detective_model_1, detective_model_2):
-                    print(f"DEBUG: Yielding fight line: {line}")
-                    yield line + '\n'
-            except Exception as e:
-                print(f"ERROR: An exception occurred in stream_content: {e}")
-                yield json.dumps({"type": "error", "content": f"An error occurred in fight mode: {e}"}) + '\n'
-
-        # This runs the entire async generator in a dedicated event loop
-        # and allows it to be consumed synchronously by Flask's Response
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Override default difficulty with the one from the frontend
+        if difficulty:
+            config["difficulty"] = difficulty
+            logger.debug("Fight mode difficulty set to: %s", difficulty)
+        config["llm_session"] = session_id
+
+        fight_engine = FightEngine(config)
+        sessions.put(session_id, fight_engine) # Store instance
+
         try:
-            # Create an iterator from the async generator
-            async_iter = stream_content().__aiter__()
-            while True:
-                try:
-                    # Get the next item from the async generator
-                    yield loop.run_until_complete(async_iter.__anext__())
-                except StopAsyncIteration:
-                    break
+            async for line in fight_engine.run(narrator_model, detective_model_1, detective_model_2):
+                logger.debug("Yielding fight line: %s", line, extra=STREAM_LINE)
+                yield line + '\n'
+        except Exception as e:
+            logger.exception("An exception occurred in stream_content")
+            yield json.dumps({"type": "error", "content": f"An error occurred in fight mode: {e}"}) + '\n'
         finally:
-            loop.close()
+            sessions.release(session_id, fight_engine) # Nothing else can be done with a finished fight
 
-    return Response(generate_fight_stream_sync(), mimetype='application/x-ndjson')
+    cancel_token = watch_client()
+    return ndjson_stream(game_loop.iterate(stream_content(), name=f"fight-{session_id}", cancel_token=cancel_token), 'fight', cancel_token)
 
 @app.route('/start_council', methods=['POST'])
-async def start_council():
+def start_council():
     data = request.json
     narrator_model = data.get('narrator_model', 'gpt-4')
     visionary_model = data.get('visionary_model')
@@ -115,38 +178,102 @@ async def start_council():
     if not session_id:
         return Response(json.dumps({"type": "error", "content": "Session ID required"}), mimetype='application/x-ndjson')
 
-    def generate_council_stream_sync():
-        async def stream_content():
-            config_loader = Config(parse_cli=False)
-            config = config_loader.get_config()
-            
-            if difficulty:
-                config["difficulty"] = difficulty
-
-            council_engine = CouncilEngine(config)
-            active_games[session_id] = council_engine
-
-            try:
-                for line in council_engine.run(difficulty, narrator_model, visionary_model, skeptic_model, leader_model):
-                    print(f"DEBUG: Yielding council line: {line}")
-                    yield line + '\n'
-            except Exception as e:
-                print(f"ERROR: An exception occurred in council stream: {e}")
-                yield json.dumps({"type": "error", "content": f"An error occurred in council mode: {e}"}) + '\n'
-
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    async def stream_content():
+        config_loader = Config(parse_cli=False)
+        config = config_loader.get_config()
+        
+        if difficulty:
+            config["difficulty"] = difficulty
+        config["llm_session"] = session_id
+
+        council_engine = CouncilEngine(config)
+        sessions.put(session_id, council_engine)
+
         try:
-            async_iter = stream_content().__aiter__()
-            while True:
-                try:
-                    yield loop.run_until_complete(async_iter.__anext__())
-                except StopAsyncIteration:
-                    break
+            async for line in council_engine.run_async(difficulty, narrator_model, visionary_model, skeptic_model, leader_model):
+                logger.debug("Yielding council line: %s", line, extra=STREAM_LINE)
+                yield line + '\n'
+        except Exception as e:
+            logger.exception("An exception occurred in council stream")
+            yield json.dumps({"type": "error", "content": f"An error occurred in council mode: {e}"}) + '\n'
         finally:
-            loop.close()
+            sessions.release(session_id, council_engine)
+
+    cancel_token = watch_client()
+    return ndjson_stream(game_loop.iterate(stream_content(), name=f"council-{session_id}", cancel_token=cancel_token), 'council', cancel_token)
+
+@app.route('/start_tournament', methods=['POST'])
+def start_tournament():
+    data = request.json
+    narrator_model = data.get('narrator_model')
+    detective_models = data.get('detective_models') or []
+    difficulty = data.get('difficulty') or 'media'
+    session_id = data.get('session_id')
+
+    if not session_id:
+        return Response(json.dumps({"type": "error", "content": "Session ID required"}), mimetype='application/x-ndjson')
+    if not narrator_model or len(detective_models) < 2:
+        return Response(json.dumps({"type": "error", "content": "A narrator model and at least two detective models are required"}), mimetype='application/x-ndjson')
+
+    async def stream_content():
+        config_loader = Config(parse_cli=False)
+        config = config_loader.get_config()
+        config["llm_session"] = session_id
+
+        tournament_engine = TournamentEngine(config)
+        sessions.put(session_id, tournament_engine)
+
+        try:
+            async for line in tournament_engine.run(difficulty, narrator_model, detective_models):
+                logger.debug("Yielding tournament line: %s", line, extra=STREAM_LINE)
+                yield line + '\n'
+        except Exception as e:
+            logger.exception("An exception occurred in tournament stream")
+            yield json.dumps({"type": "error", "content": f"An error occurred in tournament mode: {e}"}) + '\n'
+        finally:
+            sessions.release(session_id, tournament_engine)
+
+    cancel_token = watch_client()
+    return ndjson_stream(game_loop.iterate(stream_content(), name=f"tournament-{session_id}", cancel_token=cancel_token), 'tournament', cancel_token)
+
+@app.route('/usage')
+def usage():
+    """
+    Running token, time and cost totals of every LLM call made by this process, per role and per model.
+    """
+    return get_usage_tracker().get_summary(), 200
+
+@app.route('/sessions')
+def session_stats():
+    """
+    Stored games, evictions and expirations, and the estimated memory the stored games hold.
+    """
+    return sessions.get_stats(memory=True), 200
+
+@app.route('/rate_limits')
+def rate_limits():
+    """
+    Per rate-limited provider: its limits, the calls in flight and waiting for admission, and how long they waited.
+    """
+    return rate_limiter.get_stats(), 200
+
+@app.route('/end_game', methods=['POST'])
+def end_game():
+    """
+    Drops the session's game; the page sends it when it is closed.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        return {"status": "error", "message": "Session ID required"}, 400
+    return {"status": "success", "released": sessions.release(session_id)}, 200
 
-    return Response(generate_council_stream_sync(), mimetype='application/x-ndjson')
+@app.route('/metrics')
+def metrics():
+    """
+    Counters, gauges and latency histograms of this process in the Prometheus text format.
+    """
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/save_conversation', methods=['POST'])
 def save_conversation():
@@ -156,7 +283,7 @@ def save_conversation():
     if not session_id:
         return {"status": "error", "message": "Session ID required"}, 400
 
-    game_instance = active_games.get(session_id)
+    game_instance = sessions.get(session_id)
 
     # In fight mode, we don't save individual conversations in the same way, 
     # but the Narrator might have its own save mechanism if needed.
@@ -178,13 +305,15 @@ def get_hint():
     if not session_id:
         return {"status": "error", "message": "Session ID required"}, 400
 
-    game_instance = active_games.get(session_id)
+    game_instance = sessions.get(session_id)
     
     # Check if it is a single player game instance
     if not game_instance or not isinstance(game_instance, GameEngine):
+        HINT_REQUESTS.inc(outcome="rejected")
         return {"status": "error", "message": "Pista solo disponible en modo Single Player"}, 400
         
     if not game_instance.game_state:
+        HINT_REQUESTS.inc(outcome="rejected")
         return {"status": "error", "message": "Game state not initialized"}, 400
 
     # Use the narrator model for generating hints
@@ -196,6 +325,7 @@ def get_hint():
         game_instance.game_state.hidden_solution,
         game_instance.game_state.qa_history
     )
+    HINT_REQUESTS.inc(outcome="ok")
     
     return {"status": "success", "hint": hint}, 200
 
@@ -213,17 +343,19 @@ def start_interactive():
         try:
             config_loader = Config(parse_cli=False)
             config = config_loader.get_config()
+            config["llm_priority"] = "interactive" # A player waits for each answer (questions, hints, verdict)
+            config["llm_session"] = session_id
             game_engine = GameEngine(config)
-            active_games[session_id] = game_engine
+            sessions.put(session_id, game_engine)
             
             for line in game_engine.start_interactive_game(difficulty, narrator_model):
-                print(f"DEBUG: Yielding interactive line: {line}")
+                logger.debug("Yielding interactive line: %s", line, extra=STREAM_LINE)
                 yield line + '\n'
         except Exception as e:
-            print(f"ERROR: An exception occurred in start_interactive: {e}")
+            logger.exception("An exception occurred in start_interactive")
             yield json.dumps({"type": "error", "content": f"An error occurred: {e}"})
 
-    return Response(generate(), mimetype='application/x-ndjson')
+    return ndjson_stream(generate(), 'interactive')
 
 @app.route('/ask_narrator', methods=['POST'])
 def ask_narrator():
@@ -234,7 +366,7 @@ def ask_narrator():
     if not session_id or not question:
         return {"status": "error", "message": "Session ID and question required"}, 400
 
-    game_instance = active_games.get(session_id)
+    game_instance = sessions.get(session_id)
     if not game_instance or not isinstance(game_instance, GameEngine):
         return {"status": "error", "message": "Game not found"}, 404
 
@@ -253,7 +385,7 @@ def solve_mystery():
     if not session_id or not solution:
         return Response(json.dumps({"type": "error", "content": "Session ID and solution required"}), mimetype='application/x-ndjson')
 
-    game_instance = active_games.get(session_id)
+    game_instance = sessions.get(session_id)
     if not game_instance or not isinstance(game_instance, GameEngine):
         return Response(json.dumps({"type": "error", "content": "Game not found"}), mimetype='application/x-ndjson')
 
@@ -261,10 +393,11 @@ def solve_mystery():
         try:
             for line in game_instance.submit_solution(solution):
                 yield line + '\n'
+            sessions.finish(session_id, game_instance)
         except Exception as e:
             yield json.dumps({"type": "error", "content": f"An error occurred: {e}"})
 
-    return Response(generate(), mimetype='application/x-ndjson')
+    return ndjson_stream(generate(), 'interactive')
 
 
 
@@ -283,17 +416,19 @@ def start_inverse():
         try:
             config_loader = Config(parse_cli=False)
             config = config_loader.get_config()
+            config["llm_priority"] = "interactive" # The player is the narrator and waits for each question
+            config["llm_session"] = session_id
             inverse_engine = InverseEngine(config)
-            active_games[session_id] = inverse_engine
+            sessions.put(session_id, inverse_engine)
             
             for line in inverse_engine.start_game(difficulty, detective_model):
-                print(f"DEBUG: Yielding inverse line: {line}")
+                logger.debug("Yielding inverse line: %s", line, extra=STREAM_LINE)
                 yield line + '\n'
         except Exception as e:
-            print(f"ERROR: An exception occurred in start_inverse: {e}")
+            logger.exception("An exception occurred in start_inverse")
             yield json.dumps({"type": "error", "content": f"An error occurred: {e}"})
 
-    return Response(generate(), mimetype='application/x-ndjson')
+    return ndjson_stream(generate(), 'inverse')
 
 @app.route('/inverse_answer', methods=['POST'])
 def inverse_answer():
@@ -304,7 +439,7 @@ def inverse_answer():
     if not session_id or not answer:
         return Response(json.dumps({"type": "error", "content": "Session ID and answer required"}), mimetype='application/x-ndjson')
 
-    game_instance = active_games.get(session_id)
+    game_instance = sessions.get(session_id)
     if not game_instance or not isinstance(game_instance, InverseEngine):
         return Response(json.dumps({"type": "error", "content": "Game not found"}), mimetype='application/x-ndjson')
 
@@ -312,10 +447,12 @@ def inverse_answer():
         try:
             for line in game_instance.handle_answer(answer):
                 yield line + '\n'
+            if game_instance.game_state.usage is not None: # Set once the detective has solved the case
+                sessions.finish(session_id, game_instance)
         except Exception as e:
             yield json.dumps({"type": "error", "content": f"An error occurred: {e}"})
 
-    return Response(generate(), mimetype='application/x-ndjson')
+    return ndjson_stream(generate(), 'inverse')
 
 if __name__ == '__main__':
     app.run(debug=True)
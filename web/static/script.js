@@ -32,6 +32,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentMode = 'single'; // 'single', 'fight', 'council'
     let isGameRunning = false;
     let mysteryShown = false; // Track if the mystery has been shown
+    let streamingRows = {}; // Live bubbles fed by 'delta' messages, keyed by target type
     let sessionId = null; // Store the unique session ID
 
     // Initialize Session ID
@@ -46,6 +47,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
     initSession();
 
+    // Free the server-side game when the page is closed
+    window.addEventListener('pagehide', () => {
+        navigator.sendBeacon('/end_game', JSON.stringify({ session_id: sessionId }));
+    });
+
     // Event Listeners
     gameModeSelect.addEventListener('change', handleModeChange);
     startGameBtn.addEventListener('click', () => handleStartGame());
@@ -180,6 +186,29 @@ document.addEventListener('DOMContentLoaded', () => {
         messageRow.appendChild(bubble);
         chatContainer.appendChild(messageRow);
         scrollToBottom();
+        return bubble;
+    }
+
+    // Helper: Append a streamed chunk to the live bubble of its target type
+    function appendDelta(target, content) {
+        let live = streamingRows[target];
+        if (!live) {
+            const type = target === 'validation' ? 'system' : target;
+            const bubble = addMessage('', type);
+            live = { row: bubble.parentElement, text: bubble.lastChild };
+            streamingRows[target] = live;
+        }
+        live.text.textContent += content;
+        scrollToBottom();
+    }
+
+    // Helper: Drop the live bubble once the complete message for that target arrives
+    function clearDelta(target) {
+        const live = streamingRows[target];
+        if (live) {
+            live.row.remove();
+            delete streamingRows[target];
+        }
     }
 
     // Helper: Scroll to Bottom
@@ -241,6 +270,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Start Single Player Game
     async function startSingleGame() {
         chatContainer.innerHTML = '';
+        streamingRows = {};
         mysteryShown = false;
         addMessage("Starting new game session...", "system");
         setLoading(true);
@@ -272,6 +302,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Start Interactive Game
     async function startInteractiveGame() {
         chatContainer.innerHTML = '';
+        streamingRows = {};
         mysteryShown = false;
         addMessage("Starting interactive session...", "system");
         setLoading(true);
@@ -300,6 +331,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Start Fight Mode
     async function startFightGame() {
         chatContainer.innerHTML = '';
+        streamingRows = {};
         mysteryShown = false;
         addMessage("Starting fight mode session...", "system");
         setLoading(true);
@@ -331,6 +363,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Start Council Mode
     async function startCouncilGame() {
         chatContainer.innerHTML = '';
+        streamingRows = {};
         mysteryShown = false;
         addMessage("Convoking the Council of Detectives...", "system");
         setLoading(true);
@@ -362,6 +395,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Start Inverse Game
     async function startInverseGame() {
         chatContainer.innerHTML = '';
+        streamingRows = {};
         mysteryShown = false;
         addMessage("Initializing Inverse Mode...", "system");
         setLoading(true);
@@ -414,6 +448,15 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function handleJsonMessage(msg) {
+        if (msg.type === 'delta') {
+            appendDelta(msg.target, msg.content);
+            return;
+        }
+        clearDelta(msg.type);
+        if (msg.type === 'summary') {
+            clearDelta('validation');
+        }
+
         if (msg.type === 'narrator') {
             if (!mysteryShown) {
                 addMessage(msg.content, 'mystery');